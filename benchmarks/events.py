@@ -0,0 +1,83 @@
+import json
+import random
+
+SHAPES = ['lambda', 'eks', 'mixed']
+_LEVELS = ['INFO', 'INFO', 'INFO', 'DEBUG', 'WARN', 'ERROR']
+_PATHS = ['/api/v1/items', '/api/v1/orders/42', '/health', '/api/v2/users/someone@example.com/settings']
+# share of the messages and their size range in characters, most are short, a few are stack traces or payloads
+_SIZES = [(0.80, 80, 300), (0.15, 1024, 4096), (0.05, 16 * 1024, 64 * 1024)]
+
+
+class EventGenerator:
+    # pages shaped like the ones FilterLogEvents returns, the same seed always generates the same events
+    def __init__(self, shape='mixed', seed=0, start_time=1681389974000):
+        if shape not in SHAPES:
+            raise ValueError(f'Unknown shape {shape}, expected one of {SHAPES}')
+        self._shape = shape
+        self._random = random.Random(seed)
+        self._time = start_time
+        self._count = 0
+
+    def page(self, size):
+        return [self.event() for _ in range(size)]
+
+    def event(self):
+        self._count += 1
+        self._time += self._random.randint(0, 5)
+        shape = self._shape if self._shape != 'mixed' else self._random.choice(['lambda', 'eks'])
+        if shape == 'lambda':
+            stream = f'2023/04/13/[$LATEST]{self._count % 8:032x}'
+            message = self._lambda_message()
+        else:
+            stream = f'my-service-{self._count % 16:08x}-{self._count % 5}'
+            message = self._eks_message()
+        return {'logStreamName': stream,
+                'timestamp': self._time,
+                'message': message + '\n',
+                'ingestionTime': self._time + 800,
+                'eventId': f'{self._time:020d}{self._count:036d}'}
+
+    def _lambda_message(self):
+        kind = self._random.random()
+        request_id = f'{self._random.getrandbits(128):032x}'
+        if kind < 0.1:
+            return f'START RequestId: {request_id} Version: $LATEST'
+        if kind < 0.2:
+            return (f'REPORT RequestId: {request_id}\tDuration: {self._random.uniform(1, 900):.2f} ms\t'
+                    f'Billed Duration: 900 ms\tMemory Size: 512 MB\tMax Memory Used: 87 MB')
+        level = self._random.choice(_LEVELS)
+        if kind < 0.6:
+            return f'[{level}]\t2023-04-13T12:46:14.123Z\t{request_id}\t{self._text()}'
+        # structured logs, as written by AWS Lambda Powertools
+        return json.dumps({'level': level, 'location': 'handler:42', 'message': self._text(),
+                           'timestamp': '2023-04-13 12:46:14,123+0000', 'service': 'orders',
+                           'xray_trace_id': f'1-{self._random.getrandbits(96):024x}'})
+
+    def _eks_message(self):
+        kind = self._random.random()
+        level = self._random.choice(_LEVELS)
+        if kind < 0.4:
+            # klog, the level is a single letter and not extracted
+            return f'{level[0]}0413 12:46:14.123456       1 controller.go:117] {self._text()}'
+        if kind < 0.7:
+            return f'time="2023-04-13T12:46:14Z" level={level.lower()} msg="{self._text()}"'
+        # Fluent Bit container logs with their Kubernetes metadata
+        return json.dumps({'log': f'{level} {self._text()}', 'stream': 'stdout', 'time': '2023-04-13T12:46:14.123Z',
+                           'kubernetes': {'pod_name': 'my-service-7d9f8b6c5-x2x9z', 'namespace_name': 'prod',
+                                          'container_name': 'my-service', 'host': 'ip-10-0-1-23.ec2.internal',
+                                          'labels': {'app': 'my-service', 'pod-template-hash': '7d9f8b6c5'}}})
+
+    def _text(self):
+        roll = self._random.random()
+        for share, low, high in _SIZES:
+            if roll < share:
+                break
+            roll -= share
+        length = self._random.randint(low, high)
+        text = (f'request handled in {self._random.uniform(1, 500):.1f} ms path={self._random.choice(_PATHS)} '
+                f'status={self._random.choice([200, 200, 201, 404, 500])}')
+        if length > len(text):
+            # a stack trace or a payload, repetitive like the real ones
+            line = '\\n    at com.example.orders.Handler.handle(Handler.java:42)'
+            text += line * ((length - len(text)) // len(line) + 1)
+        return text[:length]
@@ -0,0 +1,213 @@
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from benchmarks.events import SHAPES, EventGenerator
+from src.compressed_bulk import CompressedBulk
+from src.event_transformer import EventTransformer
+from src.json_encoder import AUTO, get_encoder
+from src.log_level_extractor import LogLevelExtractor
+from src.logzio_shipper import LogzioShipper
+
+RESULTS_VERSION = 1
+STAGES = ['transform', 'serialize', 'compress', 'bulk', 'end_to_end']
+ADDITIONAL_FIELDS = {'logGroup': '/aws/lambda/my-lambda', 'owner': '123456789012', 'namespace': 'aws/lambda',
+                     'env': 'prod'}
+
+
+class OfflineShipper(LogzioShipper):
+    # bulks are sealed and acked like in production, and dropped instead of posted
+    def __init__(self, encoder, compression_level):
+        super().__init__('http://localhost:0', 'token', session=object(), encoder=encoder,
+                         compression_level=compression_level)
+        self.compressed_bytes = 0
+
+    def _send_bulk(self, compressed_data, bulk_size):
+        self.compressed_bytes += len(compressed_data)
+
+
+class HotPathBenchmark:
+    # every stage gets fresh copies of the same events, copying them is not measured
+    def __init__(self, events, encoder, compression_level, parse_json=False):
+        self._events = events
+        self._encoder = encoder
+        self._compression_level = compression_level
+        self._parse_json = parse_json
+        self._transformed = self._transform(self._copy_events())
+        self._encoded = [self._new_shipper()._add_custom_fields_to_log(event) for event in self._copy_transformed()]
+
+    def prepare(self, stage):
+        # returns run() and the bytes it goes through: the raw messages, or the encoded logs from serialize on
+        if stage == 'transform':
+            events = self._copy_events()
+            return lambda: self._transform(events), self._get_message_bytes()
+        if stage == 'serialize':
+            shipper = self._new_shipper()
+            events = self._copy_transformed()
+            return lambda: [shipper._add_custom_fields_to_log(event) for event in events], self._get_encoded_bytes()
+        if stage == 'compress':
+            return self._compress, self._get_encoded_bytes()
+        if stage == 'bulk':
+            return self._bulk, self._get_encoded_bytes()
+        if stage == 'end_to_end':
+            events = self._copy_events()
+            return lambda: self._ship(self._transform(events)), self._get_message_bytes()
+        raise ValueError(f'Unknown stage {stage}, expected one of {STAGES}')
+
+    def _transform(self, events):
+        extractor = LogLevelExtractor(parse_json=self._parse_json)
+        return EventTransformer(ADDITIONAL_FIELDS, extractor.extract).transform_page(events)
+
+    def _compress(self):
+        # the bulks the shipper would make, without its bookkeeping
+        bulk = CompressedBulk(self._compression_level)
+        for log in self._encoded:
+            if not bulk.fits(len(log), LogzioShipper.MAX_BODY_SIZE_BYTES):
+                bulk.seal()
+                bulk = CompressedBulk(self._compression_level)
+            bulk.add(log)
+        bulk.seal()
+
+    def _bulk(self):
+        shipper = self._new_shipper()
+        for log in self._encoded:
+            shipper._add_encoded_log(log)
+        shipper.send_to_logzio()
+
+    def _ship(self, events):
+        shipper = self._new_shipper()
+        shipper.add_logs_to_send(events)
+        shipper.send_to_logzio()
+
+    def _new_shipper(self):
+        return OfflineShipper(self._encoder, self._compression_level)
+
+    def _copy_events(self):
+        return [dict(event) for event in self._events]
+
+    def _copy_transformed(self):
+        return [dict(event) for event in self._transformed]
+
+    def _get_message_bytes(self):
+        return sum(len(event['message'].encode('utf-8')) for event in self._events)
+
+    def _get_encoded_bytes(self):
+        return sum(len(log) for log in self._encoded)
+
+
+def measure(benchmark, stage, events_count, repeats):
+    # the best of the repeats, then one more run under tracemalloc, which slows it down too much to be timed
+    seconds = None
+    for _ in range(repeats):
+        run, stage_bytes = benchmark.prepare(stage)
+        start = time.process_time()
+        run()
+        elapsed = time.process_time() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+    run, stage_bytes = benchmark.prepare(stage)
+    tracemalloc.start()
+    try:
+        run()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    seconds = max(seconds, 1e-9)
+    return {'events': events_count,
+            'bytes': stage_bytes,
+            'seconds': seconds,
+            'events_per_second': events_count / seconds,
+            'bytes_per_second': stage_bytes / seconds,
+            'peak_memory_bytes': peak_memory}
+
+
+def run_suite(shapes, stages, events_count, repeats, seed, encoder_name=AUTO,
+              compression_level=LogzioShipper.DEFAULT_COMPRESSION_LEVEL, parse_json=False):
+    encoder = get_encoder(encoder_name)
+    results = {}
+    for shape in shapes:
+        benchmark = HotPathBenchmark(EventGenerator(shape, seed).page(events_count), encoder, compression_level,
+                                     parse_json)
+        results[shape] = {stage: measure(benchmark, stage, events_count, repeats) for stage in stages}
+    return {'version': RESULTS_VERSION,
+            'environment': {'python': platform.python_version(),
+                            'implementation': platform.python_implementation(),
+                            'platform': platform.platform(),
+                            'encoder': encoder.NAME},
+            'parameters': {'events': events_count, 'repeats': repeats, 'seed': seed,
+                           'compression_level': compression_level, 'parse_json': parse_json},
+            'results': results}
+
+
+def compare(report, baseline, tolerance, memory_tolerance):
+    # regressions as lines to print, only the shapes and stages both runs have are compared
+    regressions = []
+    if baseline.get('parameters') != report['parameters']:
+        print(f'warning: the baseline ran with {baseline.get("parameters")}, not {report["parameters"]}')
+    for shape, stages in report['results'].items():
+        for stage, result in stages.items():
+            base = baseline.get('results', {}).get(shape, {}).get(stage)
+            if base is None:
+                continue
+            if result['events_per_second'] < base['events_per_second'] * (1 - tolerance):
+                regressions.append(f'{shape}/{stage}: {result["events_per_second"]:.0f} events/s, '
+                                   f'baseline {base["events_per_second"]:.0f}')
+            if result['peak_memory_bytes'] > base['peak_memory_bytes'] * (1 + memory_tolerance):
+                regressions.append(f'{shape}/{stage}: peak memory {result["peak_memory_bytes"]} bytes, '
+                                   f'baseline {base["peak_memory_bytes"]}')
+    return regressions
+
+
+def print_report(report, baseline=None):
+    for shape, stages in report['results'].items():
+        for stage, result in stages.items():
+            line = (f'{shape:<7} {stage:<11} {result["events_per_second"]:12,.0f} events/s '
+                    f'{result["bytes_per_second"] / 1024 / 1024:9.1f} MB/s '
+                    f'{result["peak_memory_bytes"] / 1024 / 1024:9.1f} MB peak')
+            base = (baseline or {}).get('results', {}).get(shape, {}).get(stage)
+            if base is not None:
+                line += f' ({result["events_per_second"] / base["events_per_second"]:.2f}x)'
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Transform, serialize, bulk and compress throughput on synthetic '
+                                                 'Cloudwatch events')
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--shapes', nargs='+', choices=SHAPES, default=SHAPES)
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--encoder', default=AUTO)
+    parser.add_argument('--compression-level', type=int, default=LogzioShipper.DEFAULT_COMPRESSION_LEVEL)
+    parser.add_argument('--parse-json', action='store_true')
+    parser.add_argument('--output', help='write the results as json to this file')
+    parser.add_argument('--baseline', help='results of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='slowdown in events/s allowed before a stage counts as a regression')
+    parser.add_argument('--memory-tolerance', type=float, default=0.2,
+                        help='growth of the peak memory allowed before a stage counts as a regression')
+    args = parser.parse_args()
+
+    report = run_suite(args.shapes, args.stages, args.events, args.repeats, args.seed, args.encoder,
+                       args.compression_level, args.parse_json)
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+    print_report(report, baseline)
+    if args.output is not None:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2, sort_keys=True)
+    if baseline is not None:
+        regressions = compare(report, baseline, args.tolerance, args.memory_tolerance)
+        for regression in regressions:
+            print(f'regression: {regression}')
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
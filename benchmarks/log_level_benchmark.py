@@ -0,0 +1,63 @@
+import argparse
+import json
+import time
+
+from src.log_level_extractor import LogLevelExtractor
+
+MESSAGES = {
+    'bracket': '[INFO] request handled in 12.3 ms, user=someone@example.com path=/api/v1/items',
+    'key value': 'ts=2023-04-13T12:46:14Z msg="request handled" user=someone@example.com level=warn',
+    'json': json.dumps({'time': '2023-04-13T12:46:14Z', 'level': 'error', 'msg': 'request failed', 'retries': 3}),
+    'no level': 'START RequestId: 0123456789abcdef Version: $LATEST request handled in 12.3 ms',
+    'huge, no level': 'x' * 300 * 1024,
+    'huge, late bracket': 'x' * 300 * 1024 + ']' + ' [ERROR]',
+}
+
+
+def get_log_level_from_message(message):
+    # what the manager did before: the text between the first [ and the first ]
+    try:
+        start_level = message.index('[')
+        end_level = message.index(']')
+        log_level = message[start_level + 1:end_level].upper()
+        if log_level in LogLevelExtractor.LOG_LEVELS:
+            return log_level
+    except ValueError:
+        return ''
+    return ''
+
+
+def extract_with(extractor):
+    def extract(message):
+        event = {}
+        extractor.extract(message, event)
+        return event.get(LogLevelExtractor.FIELD_LOG_LEVEL, '')
+    return extract
+
+
+def measure(extract, message, count):
+    start = time.process_time()
+    for _ in range(count):
+        extract(message)
+    return time.process_time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per message log level extraction cost')
+    parser.add_argument('--messages', type=int, default=20000)
+    args = parser.parse_args()
+
+    extracts = [get_log_level_from_message,
+                extract_with(LogLevelExtractor()),
+                extract_with(LogLevelExtractor(parse_json=True))]
+    print(f'{"message":<20} {"before":>16} {"extractor":>16} {"json fields":>16}   (CPU us per message, level)')
+    for name, message in MESSAGES.items():
+        results = []
+        for extract in extracts:
+            seconds = measure(extract, message, args.messages)
+            results.append(f'{seconds * 1000000 / args.messages:8.2f} {extract(message) or "-":<7}')
+        print(f'{name:<20} {results[0]:>16} {results[1]:>16} {results[2]:>16}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import argparse
+import json
+import time
+
+from src.json_encoder import JsonEncoder, get_encoder
+
+CUSTOM_FIELDS = {'type': 'cloudwatch', 'shipper': 'cw-fetcher'}
+
+
+def make_event(i):
+    return {'logGroup': '/aws/lambda/my-lambda',
+            'logStream': '2023/04/13/[$LATEST]0123456789abcdef',
+            'id': f'{i:056d}',
+            'message': f'[INFO] request {i} handled in 12.3 ms, user=someone@example.com path=/api/v1/items',
+            'log_level': 'INFO',
+            '@timestamp': 1681389974000 + i,
+            'ingestionTime': 1681389975000 + i,
+            'owner': '123456789012',
+            'namespace': 'aws/lambda',
+            'shipper': 'cw-fetcher',
+            'type': 'cloudwatch'}
+
+
+def round_trip(event):
+    # what the shipper did before: dumps in the manager, loads + dumps in the shipper
+    json_log = json.loads(json.dumps(event))
+    for key, value in CUSTOM_FIELDS.items():
+        json_log[key] = value
+    return json.dumps(json_log).encode()
+
+
+def single_pass(encoder):
+    def serialize(event):
+        event.update(CUSTOM_FIELDS)
+        return encoder.encode(event)
+    return serialize
+
+
+def measure(serialize, count):
+    events = [make_event(i) for i in range(count)]
+    start = time.process_time()
+    for event in events:
+        serialize(event)
+    return time.process_time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per event serialization cost')
+    parser.add_argument('--events', type=int, default=1000000)
+    args = parser.parse_args()
+
+    results = [('json round trip', measure(round_trip, args.events)),
+               ('json single pass', measure(single_pass(JsonEncoder()), args.events))]
+    encoder = get_encoder()
+    if not isinstance(encoder, JsonEncoder):
+        results.append((f'{encoder.NAME} single pass', measure(single_pass(encoder), args.events)))
+
+    baseline = results[0][1]
+    for name, seconds in results:
+        per_million = seconds * 1000000 / args.events
+        print(f'{name:<22} {per_million:8.2f} CPU seconds per million events ({baseline / seconds:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
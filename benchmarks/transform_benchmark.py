@@ -0,0 +1,100 @@
+import argparse
+import time
+
+from src.event_transformer import EventTransformer
+from src.log_level_extractor import LogLevelExtractor
+
+ADDITIONAL_FIELDS = {'logGroup': '/aws/lambda/my-lambda', 'shipper': 'cw-fetcher', 'type': 'cloudwatch',
+                     'owner': '123456789012', 'namespace': 'aws/lambda', 'env': 'prod'}
+
+
+def make_page(size):
+    # the shape of the events returned by FilterLogEvents
+    return [{'logStreamName': '2023/04/13/[$LATEST]0123456789abcdef',
+             'timestamp': 1681389974000 + i,
+             'message': f'[INFO] request {i} handled in 12.3 ms, user=someone@example.com path=/api/v1/items\n',
+             'ingestionTime': 1681389975000 + i,
+             'eventId': f'{i:056d}'} for i in range(size)]
+
+
+def get_log_level_from_message(message):
+    # what the manager did before: the text between the first [ and the first ]
+    try:
+        start_level = message.index('[')
+        end_level = message.index(']')
+        log_level = message[start_level + 1:end_level].upper()
+        if log_level in LogLevelExtractor.LOG_LEVELS:
+            return log_level
+    except ValueError:
+        return ''
+    return ''
+
+
+def per_event():
+    # what the manager did before: five guarded steps for every event
+    def transform(events):
+        for event in events:
+            try:
+                if ADDITIONAL_FIELDS is not None and len(ADDITIONAL_FIELDS) > 0:
+                    event.update(ADDITIONAL_FIELDS)
+            except Exception:
+                pass
+            try:
+                if 'logStreamName' in event:
+                    event['logStream'] = event['logStreamName']
+                    del event['logStreamName']
+            except Exception:
+                pass
+            try:
+                if 'eventId' in event:
+                    event['id'] = event['eventId']
+                    del event['eventId']
+            except Exception:
+                pass
+            try:
+                if 'message' in event:
+                    event['message'] = event['message'].rstrip('\n')
+                    log_level = get_log_level_from_message(str(event['message']))
+                    if log_level != '':
+                        event['log_level'] = log_level
+            except Exception:
+                pass
+            try:
+                if 'timestamp' in event:
+                    event['@timestamp'] = event['timestamp']
+                    del event['timestamp']
+            except Exception:
+                pass
+        return events
+    return transform
+
+
+def batched():
+    return EventTransformer(ADDITIONAL_FIELDS, LogLevelExtractor().extract).transform_page
+
+
+def measure(transform, pages, page_size):
+    pages = [make_page(page_size) for _ in range(pages)]
+    start = time.process_time()
+    for page in pages:
+        transform(page)
+    return time.process_time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per page transformation cost')
+    parser.add_argument('--pages', type=int, default=50)
+    parser.add_argument('--page-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    results = [('per event', measure(per_event(), args.pages, args.page_size)),
+               ('batched', measure(batched(), args.pages, args.page_size))]
+
+    baseline = results[0][1]
+    for name, seconds in results:
+        per_page = seconds * 1000 / args.pages
+        print(f'{name:<10} {per_page:8.2f} CPU ms per page of {args.page_size} events ({baseline / seconds:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import logging
+import threading
+
+import boto3
+import botocore.config
+import botocore.credentials
+import botocore.exceptions
+import botocore.session
+
+logger = logging.getLogger(__name__)
+
+
+class AwsClientFactory:
+    DEFAULT_MAX_POOL_CONNECTIONS = 10
+    EXPIRED_CREDENTIALS_ERRORS = ['ExpiredToken', 'ExpiredTokenException', 'RequestExpired']
+    ROLE_SESSION_NAME = 'logzio-cloudwatch-fetcher'
+
+    def __init__(self, max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS):
+        self._config = botocore.config.Config(max_pool_connections=max_pool_connections)
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._role_credentials = {}  # role arn -> credentials, shared by the clients of all regions
+
+    def get_client(self, service, region, role_arn=None, on_create=None):
+        key = (service, region, role_arn)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                # sessions are not thread safe, clients are. Credentials from the default chain
+                # that can expire (roles, SSO) are refreshed by botocore before they do
+                logger.debug(f'Creating {service} client for {region}' + (f' as {role_arn}' if role_arn else ''))
+                session = self._get_session(region, role_arn)
+                client = session.client(service, config=self._config)
+                if on_create is not None:
+                    on_create(client)
+                self._clients[key] = client
+            return client
+
+    def invalidate(self, service, region, role_arn=None):
+        with self._lock:
+            if self._clients.pop((service, region, role_arn), None) is not None:
+                logger.info(f'Dropped {service} client for {region}, it will be created with new credentials')
+            if role_arn is not None:
+                # the role is assumed again with fresh default credentials
+                self._role_credentials.pop(role_arn, None)
+
+    def _get_session(self, region, role_arn):
+        if role_arn is None:
+            return boto3.session.Session(region_name=region)
+        credentials = self._role_credentials.get(role_arn)
+        if credentials is None:
+            credentials = self._assume_role_credentials(region, role_arn)
+            self._role_credentials[role_arn] = credentials
+        botocore_session = botocore.session.Session()
+        # the only provider of the session, clients never fall back to the default credentials
+        resolver = botocore.credentials.CredentialResolver([_RoleCredentialProvider(credentials)])
+        botocore_session.register_component('credential_provider', resolver)
+        return boto3.session.Session(region_name=region, botocore_session=botocore_session)
+
+    def _assume_role_credentials(self, region, role_arn):
+        sts_client = boto3.session.Session(region_name=region).client('sts', config=self._config)
+
+        def refresh():
+            logger.debug(f'Assuming role {role_arn}')
+            credentials = sts_client.assume_role(RoleArn=role_arn, RoleSessionName=self.ROLE_SESSION_NAME)['Credentials']
+            return {'access_key': credentials['AccessKeyId'],
+                    'secret_key': credentials['SecretAccessKey'],
+                    'token': credentials['SessionToken'],
+                    'expiry_time': credentials['Expiration'].isoformat()}
+
+        # the role is assumed on the first call and again shortly before its credentials expire
+        return botocore.credentials.DeferredRefreshableCredentials(refresh_using=refresh, method='sts-assume-role')
+
+    def is_expired_credentials_error(self, error):
+        if not isinstance(error, botocore.exceptions.ClientError):
+            return False
+        return error.response.get('Error', {}).get('Code') in self.EXPIRED_CREDENTIALS_ERRORS
+
+
+class _RoleCredentialProvider(botocore.credentials.CredentialProvider):
+    METHOD = 'sts-assume-role'
+    CANONICAL_NAME = 'logzio-assume-role'
+
+    def __init__(self, credentials):
+        super().__init__()
+        self._credentials = credentials
+
+    def load(self):
+        return self._credentials
@@ -0,0 +1,41 @@
+import logging
+
+from .page_prefetcher import PagePrefetcher
+
+logger = logging.getLogger(__name__)
+
+
+class TimeSlicedFetcher:
+    def __init__(self, get_pages, start_time, end_time, slice_seconds, concurrency, depth, name='backfill'):
+        self._get_pages = get_pages
+        self._concurrency = concurrency
+        self._depth = depth
+        self._name = name
+        self.slices = self._get_slices(start_time, end_time, slice_seconds)
+
+    def __iter__(self):
+        started = []
+        try:
+            for idx, (start, end) in enumerate(self.slices):
+                # slices ahead of the one being shipped are already fetching, up to the concurrency of the group
+                while len(started) < min(idx + self._concurrency, len(self.slices)):
+                    started.append(self._start_slice(*self.slices[len(started)]))
+                logger.debug(f'{self._name}: shipping slice {idx + 1}/{len(self.slices)} ({start} - {end})')
+                yield end, started[idx]
+                started[idx].close()
+        finally:
+            for pages in started:
+                pages.close()
+
+    def _start_slice(self, start, end):
+        return iter(PagePrefetcher(self._get_pages(start, end), self._depth, name=f'{self._name}_{start}'))
+
+    @staticmethod
+    def _get_slices(start_time, end_time, slice_seconds):
+        slices = []
+        start = start_time
+        while start < end_time:
+            end = min(start + slice_seconds, end_time)
+            slices.append((start, end))
+            start = end
+        return slices
@@ -0,0 +1,30 @@
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class BulkSender:
+    def __init__(self, max_in_flight):
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='bulk_sender')
+        # bulks waiting for a worker count as in flight too, so sealed bulks in memory stay bounded
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+
+    def submit(self, send, *args):
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(send, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(self._release_slot)
+        return future
+
+    def shutdown(self):
+        logger.debug('Waiting for in flight bulks')
+        self._executor.shutdown(wait=True)
+
+    def _release_slot(self, future):
+        self._slots.release()
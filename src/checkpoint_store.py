@@ -0,0 +1,209 @@
+import abc
+import json
+import logging
+import os
+import sqlite3
+import threading
+import yaml
+
+logger = logging.getLogger(__name__)
+
+
+class CheckpointStore(abc.ABC):
+    FIELD_PATH = 'path'
+    FIELD_NEXT_TOKEN = 'next_token'
+    FIELD_LATEST_TIME = 'latest_time'
+    FIELD_WINDOW_END = 'window_end'  # optional, end of the window next_token was returned for
+    FIELD_SEEN_EVENT_IDS = 'seen_event_ids'  # optional
+
+    @abc.abstractmethod
+    def exists(self):
+        pass
+
+    @abc.abstractmethod
+    def load(self):
+        pass
+
+    def get(self, path):
+        for position in self.load() or []:
+            if position[self.FIELD_PATH] == path:
+                return position
+        return None
+
+    @abc.abstractmethod
+    def upsert(self, position, get_positions):
+        # get_positions() returns all the positions after the update, it is only called by stores
+        # that can only write everything, the others do not pay for building the list
+        pass
+
+    @abc.abstractmethod
+    def remove(self, paths, get_positions):
+        pass
+
+    @abc.abstractmethod
+    def delete(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class YamlCheckpointStore(CheckpointStore):
+    # libyaml bindings are much faster on files with thousands of log groups, when installed
+    _LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    _DUMPER = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+    def exists(self):
+        return os.path.exists(self.file_path)
+
+    def load(self):
+        if not self.exists():
+            return None
+        with open(self.file_path, 'r') as pos_file:
+            return yaml.load(pos_file, Loader=self._LOADER)
+
+    def upsert(self, position, get_positions):
+        if not self.exists():
+            logger.warning('Could not open position file, will create new one')
+        self._write(get_positions())
+
+    def remove(self, paths, get_positions):
+        self._write(get_positions())
+
+    def delete(self):
+        os.remove(self.file_path)
+
+    def _write(self, positions):
+        # written next to the file and renamed over it, a crash never leaves a truncated file
+        tmp_path = f'{self.file_path}.tmp'
+        with open(tmp_path, 'w') as pos_file:
+            yaml.dump(positions, pos_file, Dumper=self._DUMPER)
+            pos_file.flush()
+            os.fsync(pos_file.fileno())
+        os.replace(tmp_path, self.file_path)
+
+
+class SqliteCheckpointStore(CheckpointStore):
+    DEFAULT_COMMIT_INTERVAL_SECONDS = 1.0
+    DEFAULT_COMMIT_BATCH_SIZE = 100
+    # added after the first version, in the order they were added
+    _OPTIONAL_COLUMNS = [('seen_event_ids', 'TEXT'), ('window_end', 'INTEGER')]
+
+    def __init__(self, file_path,
+                 commit_interval_seconds=DEFAULT_COMMIT_INTERVAL_SECONDS,
+                 commit_batch_size=DEFAULT_COMMIT_BATCH_SIZE):
+        self.file_path = file_path
+        self._commit_interval_seconds = commit_interval_seconds
+        self._commit_batch_size = commit_batch_size
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._commit_timer = None
+        self._connection = None
+
+    def exists(self):
+        return os.path.exists(self.file_path)
+
+    def load(self):
+        with self._lock:
+            rows = self._get_connection().execute(
+                'SELECT path, next_token, latest_time, window_end, seen_event_ids FROM positions ORDER BY rowid'
+            ).fetchall()
+        return [self._to_position(row) for row in rows]
+
+    def get(self, path):
+        with self._lock:
+            row = self._get_connection().execute(
+                'SELECT path, next_token, latest_time, window_end, seen_event_ids FROM positions WHERE path = ?',
+                (path,)).fetchone()
+        return self._to_position(row) if row is not None else None
+
+    def upsert(self, position, get_positions=None):
+        with self._lock:
+            self._get_connection().execute(
+                'INSERT INTO positions (path, next_token, latest_time, window_end, seen_event_ids) '
+                'VALUES (?, ?, ?, ?, ?) ON CONFLICT(path) DO UPDATE SET next_token = excluded.next_token, '
+                'latest_time = excluded.latest_time, window_end = excluded.window_end, '
+                'seen_event_ids = excluded.seen_event_ids',
+                self._to_row(position))
+            self._pending += 1
+            # group commit, one fsync covers the checkpoints of many log groups
+            if self._pending >= self._commit_batch_size:
+                self._commit()
+            elif self._commit_timer is None:
+                self._commit_timer = threading.Timer(self._commit_interval_seconds, self.flush)
+                self._commit_timer.daemon = True
+                self._commit_timer.start()
+
+    def upsert_many(self, positions):
+        with self._lock:
+            self._get_connection().executemany(
+                'INSERT OR REPLACE INTO positions (path, next_token, latest_time, window_end, seen_event_ids) '
+                'VALUES (?, ?, ?, ?, ?)',
+                [self._to_row(pos) for pos in positions])
+            self._commit()
+
+    def remove(self, paths, get_positions=None):
+        with self._lock:
+            self._get_connection().executemany('DELETE FROM positions WHERE path = ?', [(path,) for path in paths])
+            self._commit()
+
+    def delete(self):
+        self.close()
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(self.file_path + suffix):
+                os.remove(self.file_path + suffix)
+
+    def flush(self):
+        with self._lock:
+            if self._connection is not None:
+                self._commit()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _to_row(self, position):
+        seen_event_ids = position.get(self.FIELD_SEEN_EVENT_IDS)
+        return (position[self.FIELD_PATH], position[self.FIELD_NEXT_TOKEN], position[self.FIELD_LATEST_TIME],
+                position.get(self.FIELD_WINDOW_END), json.dumps(seen_event_ids) if seen_event_ids is not None else None)
+
+    def _to_position(self, row):
+        path, next_token, latest_time, window_end, seen_event_ids = row
+        position = {self.FIELD_PATH: path, self.FIELD_NEXT_TOKEN: next_token, self.FIELD_LATEST_TIME: latest_time}
+        if window_end is not None:
+            position[self.FIELD_WINDOW_END] = window_end
+        if seen_event_ids is not None:
+            position[self.FIELD_SEEN_EVENT_IDS] = json.loads(seen_event_ids)
+        return position
+
+    def _commit(self):
+        if self._commit_timer is not None:
+            self._commit_timer.cancel()
+            self._commit_timer = None
+        self._connection.commit()
+        self._pending = 0
+
+    def _get_connection(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.file_path, check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=FULL')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS positions '
+                                     '(path TEXT PRIMARY KEY, next_token TEXT, latest_time INTEGER, '
+                                     'window_end INTEGER, seen_event_ids TEXT)')
+            columns = [row[1] for row in self._connection.execute('PRAGMA table_info(positions)')]
+            for column, column_type in self._OPTIONAL_COLUMNS:
+                if column not in columns:
+                    # created by an older version
+                    self._connection.execute(f'ALTER TABLE positions ADD COLUMN {column} {column_type}')
+            self._connection.commit()
+        return self._connection
@@ -0,0 +1,113 @@
+import bisect
+import hashlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseLostError(Exception):
+    # another replica took over the log group while this one was reading it
+    pass
+
+
+class HashRing:
+    DEFAULT_VIRTUAL_NODES = 64
+
+    def __init__(self, nodes, virtual_nodes=DEFAULT_VIRTUAL_NODES):
+        self.nodes = sorted(set(nodes))
+        # virtual nodes spread the keys evenly, a node that joins or leaves only moves its own share
+        self._ring = sorted((self._hash(f'{node}#{i}'), node) for node in self.nodes for i in range(virtual_nodes))
+        self._hashes = [node_hash for node_hash, _ in self._ring]
+
+    def get_node(self, key):
+        if len(self._ring) == 0:
+            return None
+        index = bisect.bisect(self._hashes, self._hash(key)) % len(self._ring)
+        return self._ring[index][1]
+
+    @staticmethod
+    def _hash(value):
+        return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+
+class ClusterMember:
+    DEFAULT_HEARTBEAT_SECONDS = 30
+    # a replica that missed this many heartbeats is dead, its log groups go to the others
+    _MISSED_HEARTBEATS = 3
+
+    def __init__(self, lease_store, replica_id, lease_seconds, heartbeat_seconds=DEFAULT_HEARTBEAT_SECONDS,
+                 clock=time.time):
+        self.replica_id = replica_id
+        self.heartbeat_seconds = heartbeat_seconds
+        self._lease_store = lease_store
+        self._lease_seconds = lease_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._ring = HashRing([replica_id])
+        self._held = set()
+        self._last_heartbeat = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.heartbeat()
+        # not a scheduler job, busy workers must not make the replica look dead
+        self._thread = threading.Thread(target=self._send_heartbeats, name='cluster_heartbeat', daemon=True)
+        self._thread.start()
+
+    def heartbeat(self):
+        now = self._clock()
+        replicas = self._lease_store.heartbeat(self.replica_id, now,
+                                               now + self.heartbeat_seconds * self._MISSED_HEARTBEATS)
+        with self._lock:
+            self._last_heartbeat = now
+            if replicas != self._ring.nodes:
+                logger.info(f'Cluster has {len(replicas)} replicas: {", ".join(replicas)}')
+                self._ring = HashRing(replicas)
+
+    def is_assigned(self, key):
+        with self._lock:
+            if self._last_heartbeat is None or \
+                    self._clock() - self._last_heartbeat >= self.heartbeat_seconds * self._MISSED_HEARTBEATS:
+                # the other replicas may already consider this one dead and read its log groups
+                return False
+            return self._ring.get_node(key) == self.replica_id
+
+    def holds(self, key):
+        with self._lock:
+            return key in self._held
+
+    def acquire(self, key, lease_seconds=None):
+        # renews the lease when it is already held
+        now = self._clock()
+        acquired = self._lease_store.acquire(key, self.replica_id, now, now + (lease_seconds or self._lease_seconds))
+        with self._lock:
+            if acquired:
+                self._held.add(key)
+            else:
+                self._held.discard(key)
+        return acquired
+
+    def release(self, key):
+        self._lease_store.release([key], self.replica_id)
+        with self._lock:
+            self._held.discard(key)
+
+    def leave(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        # the other replicas take over at their next cycle, without waiting for the leases to expire
+        self._lease_store.leave(self.replica_id)
+        with self._lock:
+            self._held.clear()
+        self._lease_store.close()
+
+    def _send_heartbeats(self):
+        while not self._stop_event.wait(self.heartbeat_seconds):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logger.error(f'Error while sending cluster heartbeat of {self.replica_id}: {e}')
@@ -0,0 +1,48 @@
+import zlib
+
+
+class CompressedBulk:
+    _GZIP_WBITS = 16 + zlib.MAX_WBITS
+    _GZIP_OVERHEAD_BYTES = 18 + 13  # gzip header and trailer, plus the final deflate block
+    _SEPARATOR = b'\n'
+
+    def __init__(self, compression_level):
+        self._compressor = zlib.compressobj(compression_level, zlib.DEFLATED, self._GZIP_WBITS)
+        self._chunks = []
+        self._unflushed_size = 0
+        self.compressed_size = 0
+        self.raw_size = 0
+        self.logs_count = 0
+
+    def fits(self, log_size, max_size):
+        if self._compressed_bound(self._unflushed_size + log_size + 1) <= max_size:
+            return True
+        if self._unflushed_size == 0:
+            return False
+        # the estimate is not good enough anymore, flush to learn the real compressed size
+        self._append_chunk(self._compressor.flush(zlib.Z_SYNC_FLUSH))
+        self._unflushed_size = 0
+        return self._compressed_bound(log_size + 1) <= max_size
+
+    def add(self, log):
+        data = log if self.logs_count == 0 else self._SEPARATOR + log
+        self._append_chunk(self._compressor.compress(data))
+        self._unflushed_size += len(data)
+        self.raw_size += len(data)
+        self.logs_count += 1
+
+    def seal(self):
+        self._append_chunk(self._compressor.flush())
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+    def _append_chunk(self, chunk):
+        if len(chunk) > 0:
+            self._chunks.append(chunk)
+            self.compressed_size += len(chunk)
+
+    def _compressed_bound(self, raw_size):
+        # worst case of data the compressor still buffers, same as zlib's deflateBound()
+        return (self.compressed_size + raw_size + (raw_size >> 12) + (raw_size >> 14) + (raw_size >> 25)
+                + self._GZIP_OVERHEAD_BYTES)
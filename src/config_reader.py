@@ -1,7 +1,9 @@
 import logging
+import re
 import yaml
 
 from .log_group import LogGroup
+from .log_group_discovery import LogGroupPattern
 
 logger = logging.getLogger(__name__)
 
@@ -10,8 +12,39 @@ class ConfigReader:
     KEY_LOG_GROUPS = 'log_groups'
     KEY_INTERVAL = 'collection_interval'
     KEY_LOG_GROUP_PATH = 'path'
+    KEY_LOG_GROUP_PATH_PREFIX = 'path_prefix'
+    KEY_LOG_GROUP_PATH_PATTERN = 'path_pattern'
     KEY_LOG_GROUP_CUSTOM_FIELDS = 'custom_fields'
     KEY_LOG_GROUP_REGION = 'aws_region'
+    KEY_LOG_GROUP_ROLE_ARN = 'role_arn'
+    KEY_LOG_GROUP_STREAM_CONCURRENCY = 'stream_concurrency'
+    KEY_LOG_GROUP_PARSE_JSON = 'parse_json'
+    KEY_LOG_GROUP_FILTER_PATTERN = 'filter_pattern'
+    KEY_LOG_GROUP_DROP_LEVELS = 'drop_levels'
+    KEY_LOG_GROUP_DROP_PATTERNS = 'drop_patterns'
+    KEY_LOG_GROUP_SAMPLE_RATE = 'sample_rate'
+    KEY_LOG_GROUP_STREAM_MAX_EVENTS = 'stream_max_events_per_minute'
+    KEY_PREFETCH_DEPTH = 'prefetch_depth'
+    KEY_LOGZIO_POOL_SIZE = 'logzio_pool_size'
+    KEY_LOGZIO_MAX_CONNECTIONS = 'logzio_max_connections'
+    KEY_MAX_IN_FLIGHT_BULKS = 'max_in_flight_bulks'
+    KEY_JSON_ENCODER = 'json_encoder'
+    KEY_COMPRESSION_LEVEL = 'compression_level'
+    KEY_BACKFILL_SLICE = 'backfill_slice_minutes'
+    KEY_BACKFILL_CONCURRENCY = 'backfill_concurrency'
+    KEY_BACKFILL_MAX_CONCURRENCY = 'backfill_max_concurrency'
+    KEY_WORKERS = 'workers'
+    KEY_AWS_MAX_POOL_CONNECTIONS = 'aws_max_pool_connections'
+    KEY_CLOUDWATCH_RATE_LIMIT = 'cloudwatch_rate_limit'
+    KEY_DISCOVERY_REFRESH = 'discovery_refresh_minutes'
+    KEY_LOG_LEVEL_SCAN_LENGTH = 'log_level_scan_length'
+    KEY_DEDUP_MAX_EVENTS = 'dedup_max_events'
+    KEY_DEDUP_PERSIST = 'dedup_persist'
+    KEY_SPILL_MAX_MEGABYTES = 'spill_max_megabytes'
+    KEY_SPILL_MAX_AGE_HOURS = 'spill_max_age_hours'
+    KEY_SPILL_REPLAY_RATE = 'spill_replay_bulks_per_second'
+    KEY_SLOW_CYCLE = 'slow_cycle_seconds'
+    _MAX_COMPRESSION_LEVEL = 9
 
     def __init__(self, config_file):
         with open(config_file, 'r') as config:
@@ -24,6 +57,8 @@ class ConfigReader:
             logger.error('No log groups in config')
             return None
         for lgd in self._config_data[self.KEY_LOG_GROUPS]:
+            if self._is_log_group_pattern(lgd):
+                continue
             if self.KEY_LOG_GROUP_PATH not in lgd:
                 logger.error(f'Field {self.KEY_LOG_GROUP_PATH} not specified for a log group')
                 return None
@@ -35,10 +70,114 @@ class ConfigReader:
             interval = self.get_time_interval()
             if interval == 0:
                 interval = default_interval
-            log_group = LogGroup(path, custom_fields, start_time, interval)
-            log_groups.append(log_group)
+            stream_concurrency = self._get_log_group_stream_concurrency(lgd)
+            parse_json = self._get_log_group_parse_json(lgd)
+            filter_rules = self._get_log_group_filter_rules(lgd)
+            for region, role_arn in self._get_log_group_targets(lgd):
+                log_group = LogGroup(path, custom_fields, start_time, interval, stream_concurrency, region, role_arn,
+                                     parse_json, lgd.get(self.KEY_LOG_GROUP_FILTER_PATTERN), filter_rules)
+                log_groups.append(log_group)
         return log_groups
 
+    def get_log_group_patterns(self):
+        patterns = []
+        for lgd in self._config_data.get(self.KEY_LOG_GROUPS) or []:
+            if not self._is_log_group_pattern(lgd):
+                continue
+            for region, role_arn in self._get_log_group_targets(lgd):
+                pattern = LogGroupPattern(lgd.get(self.KEY_LOG_GROUP_PATH_PREFIX),
+                                          lgd.get(self.KEY_LOG_GROUP_PATH_PATTERN),
+                                          lgd.get(self.KEY_LOG_GROUP_CUSTOM_FIELDS),
+                                          self._get_log_group_stream_concurrency(lgd),
+                                          region, role_arn, self._get_log_group_parse_json(lgd),
+                                          lgd.get(self.KEY_LOG_GROUP_FILTER_PATTERN),
+                                          self._get_log_group_filter_rules(lgd))
+                logger.debug(f'Found log group pattern {pattern}')
+                patterns.append(pattern)
+        return patterns
+
+    def _get_log_group_targets(self, lgd):
+        # an entry is collected once per region and role it lists, the default region is kept as None
+        regions = self._get_log_group_list(lgd, self.KEY_LOG_GROUP_REGION)
+        role_arns = self._get_log_group_list(lgd, self.KEY_LOG_GROUP_ROLE_ARN)
+        default_region = self.get_aws_region()
+        targets = []
+        for region in regions:
+            if region == default_region:
+                region = None
+            for role_arn in role_arns:
+                if (region, role_arn) not in targets:
+                    targets.append((region, role_arn))
+        return targets
+
+    def _get_log_group_list(self, lgd, key):
+        # a single value or a list of them, [None] when the field is not set
+        values = lgd.get(key)
+        if not values:
+            return [None]
+        if not isinstance(values, list):
+            values = [values]
+        valid_values = []
+        for value in values:
+            if not isinstance(value, str) or value == '':
+                logger.error(f'Ignoring invalid {key} entry {value} of {lgd.get(self.KEY_LOG_GROUP_PATH)}, '
+                             f'it must be a string')
+                continue
+            valid_values.append(value)
+        return valid_values
+
+    def _is_log_group_pattern(self, lgd):
+        return isinstance(lgd, dict) and (self.KEY_LOG_GROUP_PATH_PREFIX in lgd or self.KEY_LOG_GROUP_PATH_PATTERN in lgd)
+
+    def _get_log_group_stream_concurrency(self, lgd):
+        if self.KEY_LOG_GROUP_STREAM_CONCURRENCY not in lgd:
+            return 0
+        try:
+            stream_concurrency = int(lgd[self.KEY_LOG_GROUP_STREAM_CONCURRENCY])
+        except (TypeError, ValueError):
+            logger.warning(f'Could not parse field {self.KEY_LOG_GROUP_STREAM_CONCURRENCY} of {lgd}')
+            return 0
+        return max(stream_concurrency, 0)
+
+    def _get_log_group_parse_json(self, lgd):
+        return lgd.get(self.KEY_LOG_GROUP_PARSE_JSON) is True
+
+    def _get_log_group_filter_rules(self, lgd):
+        rules = {}
+        drop_levels = lgd.get(self.KEY_LOG_GROUP_DROP_LEVELS)
+        if drop_levels:
+            rules['drop_levels'] = [str(level) for level in drop_levels]
+        drop_patterns = []
+        for pattern in lgd.get(self.KEY_LOG_GROUP_DROP_PATTERNS) or []:
+            try:
+                re.compile(pattern)
+            except (TypeError, re.error) as e:
+                logger.warning(f'Ignoring invalid {self.KEY_LOG_GROUP_DROP_PATTERNS} entry {pattern}: {e}')
+                continue
+            drop_patterns.append(pattern)
+        if len(drop_patterns) > 0:
+            rules['drop_patterns'] = drop_patterns
+        if self.KEY_LOG_GROUP_SAMPLE_RATE in lgd:
+            try:
+                sample_rate = float(lgd[self.KEY_LOG_GROUP_SAMPLE_RATE])
+            except (TypeError, ValueError):
+                sample_rate = -1
+            if 0 < sample_rate <= 1:
+                rules['sample_rate'] = sample_rate
+            else:
+                logger.warning(f'Field {self.KEY_LOG_GROUP_SAMPLE_RATE} must be greater than 0 and at most 1, '
+                               f'keeping all logs')
+        if self.KEY_LOG_GROUP_STREAM_MAX_EVENTS in lgd:
+            try:
+                stream_max_events = int(lgd[self.KEY_LOG_GROUP_STREAM_MAX_EVENTS])
+            except (TypeError, ValueError):
+                stream_max_events = 0
+            if stream_max_events > 0:
+                rules['stream_max_events_per_minute'] = stream_max_events
+            else:
+                logger.warning(f'Field {self.KEY_LOG_GROUP_STREAM_MAX_EVENTS} must be greater than 0, ignoring it')
+        return rules if len(rules) > 0 else None
+
     def get_time_interval(self):
         time_interval = 0
         if self.KEY_INTERVAL in self._config_data:
@@ -48,6 +187,91 @@ class ConfigReader:
                 logger.warning(f'Could not parse field {self.KEY_INTERVAL}')
         return time_interval
 
+    def get_prefetch_depth(self):
+        return self._get_non_negative_int(self.KEY_PREFETCH_DEPTH)
+
+    def get_logzio_pool_size(self, default):
+        return self._get_positive_int(self.KEY_LOGZIO_POOL_SIZE, default)
+
+    def get_logzio_max_connections(self, default):
+        return self._get_positive_int(self.KEY_LOGZIO_MAX_CONNECTIONS, default)
+
+    def get_max_in_flight_bulks(self):
+        return self._get_non_negative_int(self.KEY_MAX_IN_FLIGHT_BULKS)
+
+    def get_json_encoder(self, default):
+        return str(self._config_data.get(self.KEY_JSON_ENCODER, default)).lower()
+
+    def get_compression_level(self, default):
+        level = self._get_non_negative_int(self.KEY_COMPRESSION_LEVEL, default)
+        if level > self._MAX_COMPRESSION_LEVEL:
+            logger.warning(f'Field {self.KEY_COMPRESSION_LEVEL} must be between 0 and {self._MAX_COMPRESSION_LEVEL}, '
+                           f'using default value: {default}')
+            return default
+        return level
+
+    def get_backfill_slice_minutes(self, default):
+        return self._get_non_negative_int(self.KEY_BACKFILL_SLICE, default)
+
+    def get_backfill_concurrency(self, default):
+        return self._get_positive_int(self.KEY_BACKFILL_CONCURRENCY, default)
+
+    def get_backfill_max_concurrency(self, default):
+        return self._get_positive_int(self.KEY_BACKFILL_MAX_CONCURRENCY, default)
+
+    def get_discovery_refresh_minutes(self, default):
+        return self._get_positive_int(self.KEY_DISCOVERY_REFRESH, default)
+
+    def get_log_level_scan_length(self, default):
+        return self._get_positive_int(self.KEY_LOG_LEVEL_SCAN_LENGTH, default)
+
+    def get_dedup_max_events(self, default):
+        return self._get_non_negative_int(self.KEY_DEDUP_MAX_EVENTS, default)
+
+    def get_dedup_persist(self):
+        return self._config_data.get(self.KEY_DEDUP_PERSIST) is True
+
+    def get_spill_max_megabytes(self):
+        return self._get_non_negative_int(self.KEY_SPILL_MAX_MEGABYTES)
+
+    def get_spill_max_age_hours(self, default):
+        return self._get_positive_int(self.KEY_SPILL_MAX_AGE_HOURS, default)
+
+    def get_spill_replay_rate(self, default):
+        return self._get_positive_int(self.KEY_SPILL_REPLAY_RATE, default)
+
+    def get_slow_cycle_seconds(self, default):
+        return self._get_positive_int(self.KEY_SLOW_CYCLE, default)
+
+    def get_workers(self, default):
+        return self._get_positive_int(self.KEY_WORKERS, default)
+
+    def get_aws_max_pool_connections(self, default):
+        return self._get_positive_int(self.KEY_AWS_MAX_POOL_CONNECTIONS, default)
+
+    def get_cloudwatch_rate_limit(self, default):
+        return self._get_positive_int(self.KEY_CLOUDWATCH_RATE_LIMIT, default)
+
+    def _get_positive_int(self, key, default):
+        value = self._get_non_negative_int(key, default)
+        if value == 0:
+            logger.warning(f'Field {key} must be greater than 0, using default value: {default}')
+            return default
+        return value
+
+    def _get_non_negative_int(self, key, default=0):
+        if key not in self._config_data:
+            return default
+        try:
+            value = int(self._config_data[key])
+        except (TypeError, ValueError):
+            logger.warning(f'Could not parse field {key}, using default value: {default}')
+            return default
+        if value < 0:
+            logger.warning(f'Field {key} can not be negative, using default value: {default}')
+            return default
+        return value
+
     def get_aws_region(self):
         if self.KEY_LOG_GROUP_REGION in self._config_data:
             return self._config_data[self.KEY_LOG_GROUP_REGION]
@@ -0,0 +1,137 @@
+import collections
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class EventDeduplicator:
+    DEFAULT_MAX_EVENTS = 100000
+    # persisted with the position, the newest events are the ones a restart reads again
+    MAX_EXPORTED_EVENTS = 10000
+    _KEY_EVENT_ID = 'eventId'
+    _KEY_TIMESTAMP = 'timestamp'
+
+    def __init__(self, max_events=DEFAULT_MAX_EVENTS):
+        # runs on the events as Cloudwatch returned them, duplicates are not even transformed
+        self._max_events = max_events
+        self._buckets = {}  # second of the event timestamp -> ids of the events shipped in it
+        # ids of the current cycle, they only count as shipped once the bulks of their logs were acked
+        self._pending = {}
+        self._batches = collections.deque()  # (seq, [(second, id)]) of the pages whose logs were not acked yet
+        self._batch = []
+        self._seq = 0
+        self._pending_size = 0
+        self._size = 0
+        self._watermark = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return self._size
+
+    def filter_page(self, events):
+        kept = []
+        for event in events:
+            event_id = event.get(self._KEY_EVENT_ID)
+            if event_id is None:
+                kept.append(event)
+                continue
+            second = event.get(self._KEY_TIMESTAMP, 0) // 1000
+            if event_id in self._buckets.get(second, ()):
+                self.hits += 1
+                continue
+            pending = self._pending.get(second)
+            if pending is None:
+                pending = self._pending[second] = set()
+            elif event_id in pending:
+                self.hits += 1
+                continue
+            pending.add(event_id)
+            self._batch.append((second, event_id))
+            self._size += 1
+            self._pending_size += 1
+            self.misses += 1
+            kept.append(event)
+        while self._pending_size > self._max_events and len(self._batches) > 0:
+            # the oldest ids are forgotten instead of committed, at worst their logs are shipped twice
+            self._forget(self._batches.popleft()[1])
+        if self._size > self._max_events:
+            self._evict(sorted(self._buckets), self._max_events)
+        return kept
+
+    def seal(self):
+        # closes the ids filtered since the last seal, commit(seq) commits them once their logs were acked
+        self._seq += 1
+        self._batches.append((self._seq, self._batch))
+        self._batch = []
+        return self._seq
+
+    def commit(self, seq=None):
+        # every sealed batch up to seq, and all pending ids when seq is None
+        if seq is None:
+            self.seal()
+            seq = self._seq
+        while len(self._batches) > 0 and self._batches[0][0] <= seq:
+            for second, event_id in self._batches.popleft()[1]:
+                self._pop_pending(second, event_id)
+                bucket = self._buckets.get(second)
+                if bucket is None:
+                    bucket = self._buckets[second] = set()
+                elif event_id in bucket:
+                    self._size -= 1
+                    continue
+                bucket.add(event_id)
+        if self._size > self._max_events:
+            self._evict(sorted(self._buckets), self._max_events)
+
+    def rollback(self):
+        # the logs were not acked, they are shipped when the window is read again
+        self._size -= self._pending_size
+        self._pending_size = 0
+        self._pending = {}
+        self._batches.clear()
+        self._batch = []
+
+    def advance(self, watermark):
+        # windows start at the watermark, events before it are never read again
+        if watermark <= self._watermark:
+            return
+        self._watermark = watermark
+        self._evict([second for second in self._buckets if second < watermark], 0)
+
+    def export(self):
+        exported = {}
+        count = 0
+        for second in sorted(self._buckets, reverse=True):
+            bucket = self._buckets[second]
+            if count + len(bucket) > self.MAX_EXPORTED_EVENTS:
+                break
+            exported[second] = sorted(bucket)
+            count += len(bucket)
+        return exported
+
+    def load(self, exported):
+        for second, event_ids in (exported or {}).items():
+            bucket = self._buckets.setdefault(int(second), set())
+            size = len(bucket)
+            bucket.update(event_ids)
+            self._size += len(bucket) - size
+
+    def _forget(self, batch):
+        for second, event_id in batch:
+            self._pop_pending(second, event_id)
+            self._size -= 1
+
+    def _pop_pending(self, second, event_id):
+        pending = self._pending[second]
+        pending.remove(event_id)
+        if len(pending) == 0:
+            del self._pending[second]
+        self._pending_size -= 1
+
+    def _evict(self, seconds, max_events):
+        # oldest first, until no more than max_events are kept
+        for second in seconds:
+            if self._size <= max_events:
+                return
+            self._size -= len(self._buckets.pop(second))
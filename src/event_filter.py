@@ -0,0 +1,66 @@
+import logging
+import re
+import zlib
+
+from .event_transformer import EventTransformer
+from .log_level_extractor import LogLevelExtractor
+
+logger = logging.getLogger(__name__)
+
+
+class EventFilter:
+    REASON_LEVEL = 'level'
+    REASON_PATTERN = 'pattern'
+    REASON_SAMPLE = 'sample'
+    REASON_STREAM_RATE = 'stream_rate'
+    _SAMPLE_BUCKETS = 10000
+    _MINUTE = 60 * 1000  # milliseconds
+
+    def __init__(self, drop_levels=None, drop_patterns=None, sample_rate=1.0, stream_max_events_per_minute=0):
+        # runs on transformed events, before they are serialized, so dropped events are never encoded
+        self._drop_levels = frozenset(level.upper() for level in drop_levels or [])
+        self._drop_pattern = re.compile('|'.join(f'(?:{pattern})' for pattern in drop_patterns)) \
+            if drop_patterns else None
+        self._sample_threshold = int(sample_rate * self._SAMPLE_BUCKETS)
+        self._stream_max_events_per_minute = stream_max_events_per_minute
+        self._stream_counts = {}  # (stream, minute of the event) -> events kept
+        self._dropped = {}  # reason -> events dropped since the last stats
+
+    def start_cycle(self):
+        self._stream_counts.clear()
+
+    def filter_page(self, events):
+        kept = []
+        for event in events:
+            reason = self._get_drop_reason(event)
+            if reason is None:
+                kept.append(event)
+            else:
+                self._dropped[reason] = self._dropped.get(reason, 0) + 1
+        return kept
+
+    def pop_stats(self):
+        dropped = self._dropped
+        self._dropped = {}
+        return dropped
+
+    def _get_drop_reason(self, event):
+        if len(self._drop_levels) > 0 and event.get(LogLevelExtractor.FIELD_LOG_LEVEL) in self._drop_levels:
+            return self.REASON_LEVEL
+        if self._drop_pattern is not None and \
+                self._drop_pattern.search(event.get(EventTransformer.KEY_MESSAGE, '')) is not None:
+            return self.REASON_PATTERN
+        if self._sample_threshold < self._SAMPLE_BUCKETS and EventTransformer.FIELD_ID in event:
+            # the same events are kept on every replica and when a window is read again
+            event_hash = zlib.crc32(event[EventTransformer.FIELD_ID].encode('utf-8'))
+            if event_hash % self._SAMPLE_BUCKETS >= self._sample_threshold:
+                return self.REASON_SAMPLE
+        if self._stream_max_events_per_minute > 0:
+            # counted by the minute of the event, a window that is read again drops the same events
+            key = (event.get(EventTransformer.FIELD_LOG_STREAM),
+                   event.get(EventTransformer.FIELD_TIMESTAMP, 0) // self._MINUTE)
+            count = self._stream_counts.get(key, 0)
+            if count >= self._stream_max_events_per_minute:
+                return self.REASON_STREAM_RATE
+            self._stream_counts[key] = count + 1
+        return None
@@ -0,0 +1,56 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class EventTransformer:
+    KEY_MESSAGE = 'message'
+    FIELD_LOG_STREAM = 'logStream'
+    FIELD_ID = 'id'
+    FIELD_TIMESTAMP = '@timestamp'
+    # Cloudwatch field -> field name in Logz.io, following the existing conventions for cw logs
+    RENAMES = (('logStreamName', FIELD_LOG_STREAM),
+               ('eventId', FIELD_ID),
+               ('timestamp', FIELD_TIMESTAMP))
+    _MISSING = object()
+
+    def __init__(self, additional_fields, extract):
+        # built once per log group and cycle, the per event work is a fixed sequence of dict operations.
+        # extract(message, event) adds the fields found in the message, such as its log level
+        self._transform = self._compile(dict(additional_fields or {}), extract)
+
+    def transform_page(self, events):
+        # events are transformed in place. A transform can be applied again to an event it failed on,
+        # so a failing event is shipped as far as it got and the rest of the page carries on
+        index = 0
+        while index < len(events):
+            try:
+                for index in range(index, len(events)):
+                    self._transform(events[index])
+                return events
+            except Exception as e:
+                logger.warning(f'Error while trying to transform log: {e}')
+                index += 1
+        return events
+
+    def _compile(self, additional_fields, extract):
+        renames = self.RENAMES
+        missing = self._MISSING
+        key_message = self.KEY_MESSAGE
+        update = dict.update if len(additional_fields) > 0 else None
+
+        def transform(event):
+            if update is not None:
+                update(event, additional_fields)
+            for source, target in renames:
+                value = event.pop(source, missing)
+                if value is not missing:
+                    event[target] = value
+            message = event.get(key_message)
+            if isinstance(message, str):
+                # remove newline at the end of the message, if exists
+                message = message.rstrip('\n')
+                event[key_message] = message
+                extract(message, event)
+
+        return transform
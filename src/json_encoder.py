@@ -0,0 +1,44 @@
+import json
+import logging
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+class JsonEncoder:
+    NAME = 'json'
+
+    def encode(self, log):
+        return json.dumps(log).encode()
+
+
+class OrjsonEncoder:
+    NAME = 'orjson'
+
+    def encode(self, log):
+        try:
+            return orjson.dumps(log)
+        except TypeError:
+            # orjson is stricter than json (e.g. non string keys, integers above 64 bit)
+            return json.dumps(log).encode()
+
+
+_ENCODERS = {JsonEncoder.NAME: JsonEncoder, OrjsonEncoder.NAME: OrjsonEncoder}
+AUTO = 'auto'
+
+
+def get_encoder(name=AUTO):
+    if name == AUTO:
+        name = OrjsonEncoder.NAME if orjson is not None else JsonEncoder.NAME
+    if name not in _ENCODERS:
+        logger.warning(f'Unknown json encoder {name}, using {JsonEncoder.NAME}')
+        name = JsonEncoder.NAME
+    if name == OrjsonEncoder.NAME and orjson is None:
+        logger.warning(f'{OrjsonEncoder.NAME} is not installed, using {JsonEncoder.NAME}')
+        name = JsonEncoder.NAME
+    logger.debug(f'Using {name} encoder')
+    return _ENCODERS[name]()
@@ -0,0 +1,103 @@
+import abc
+import contextlib
+import logging
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseStore(abc.ABC):
+    # times are unix seconds, replicas compare them with their own clocks
+
+    @abc.abstractmethod
+    def heartbeat(self, replica_id, now, expires_at):
+        # returns the replicas that are alive, including this one
+        pass
+
+    @abc.abstractmethod
+    def acquire(self, key, replica_id, now, expires_at):
+        # a lease is taken over once it expired or its owner stopped sending heartbeats
+        pass
+
+    @abc.abstractmethod
+    def release(self, keys, replica_id):
+        pass
+
+    @abc.abstractmethod
+    def leave(self, replica_id):
+        pass
+
+    def close(self):
+        pass
+
+
+class SqliteLeaseStore(LeaseStore):
+    # every change is one immediate transaction, the database lock keeps the replicas that share the file in line
+    _TIMEOUT_SECONDS = 30
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def heartbeat(self, replica_id, now, expires_at):
+        with self._transaction() as connection:
+            connection.execute('INSERT OR REPLACE INTO replicas (replica_id, expires_at) VALUES (?, ?)',
+                               (replica_id, expires_at))
+            rows = connection.execute('SELECT replica_id FROM replicas WHERE expires_at > ? ORDER BY replica_id',
+                                      (now,)).fetchall()
+        return [row[0] for row in rows]
+
+    def acquire(self, key, replica_id, now, expires_at):
+        with self._transaction() as connection:
+            row = connection.execute(
+                'SELECT leases.owner, leases.expires_at, replicas.expires_at FROM leases '
+                'LEFT JOIN replicas ON replicas.replica_id = leases.owner WHERE leases.key = ?', (key,)).fetchone()
+            if row is not None:
+                owner, lease_expires_at, owner_expires_at = row
+                if owner != replica_id and lease_expires_at > now and (owner_expires_at or 0) > now:
+                    return False
+                if owner != replica_id:
+                    logger.info(f'Taking over the lease of {key} from {owner}')
+            connection.execute('INSERT OR REPLACE INTO leases (key, owner, expires_at) VALUES (?, ?, ?)',
+                               (key, replica_id, expires_at))
+        return True
+
+    def release(self, keys, replica_id):
+        with self._transaction() as connection:
+            connection.executemany('DELETE FROM leases WHERE key = ? AND owner = ?',
+                                   [(key, replica_id) for key in keys])
+
+    def leave(self, replica_id):
+        with self._transaction() as connection:
+            connection.execute('DELETE FROM leases WHERE owner = ?', (replica_id,))
+            connection.execute('DELETE FROM replicas WHERE replica_id = ?', (replica_id,))
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self._lock:
+            connection = self._get_connection()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield connection
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+
+    def _get_connection(self):
+        if self._connection is None:
+            # transactions are started explicitly, so they can take the write lock before reading
+            self._connection = sqlite3.connect(self.file_path, timeout=self._TIMEOUT_SECONDS,
+                                               isolation_level=None, check_same_thread=False)
+            self._connection.execute('CREATE TABLE IF NOT EXISTS replicas (replica_id TEXT PRIMARY KEY, expires_at REAL)')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS leases '
+                                     '(key TEXT PRIMARY KEY, owner TEXT, expires_at REAL)')
+        return self._connection
@@ -18,12 +18,38 @@ class LogGroup:
         "/aws/amazonmq/broker/": "aws/amazonmq"
     }
 
-    def __init__(self, path, custom_fields, start_time, interval):
+    def __init__(self, path, custom_fields, start_time, interval, stream_concurrency=0, region=None, role_arn=None,
+                 parse_json=False, filter_pattern=None, filter_rules=None):
         self.path = path
+        self.region = region  # None uses the default aws_region
+        self.role_arn = role_arn  # None uses the default credentials
+        self.key = self.get_key(path, region, role_arn)
         self.custom_fields = custom_fields
         self.namespace = self._get_namespace_by_path()
+        self.interval = interval  # minutes
         self.latest_time = self._get_first_latest_time(start_time, interval)
         self.next_token = ''
+        self.window_end = 0  # end of the window next_token was returned for
+        self.checkpointed_at = 0  # time.monotonic() of the last position saved while a window was read
+        self.lease_renewed_at = 0  # time.monotonic() of the last renewal of its lease, in cluster mode
+        self.stream_concurrency = stream_concurrency
+        self.parse_json = parse_json
+        self.filter_pattern = filter_pattern  # Cloudwatch filter pattern, applied by AWS
+        self.filter_rules = filter_rules  # EventFilter arguments, applied before logs are sent
+        self.stream_positions = {}  # stream name -> time it was read up to, when ahead of latest_time
+        self.metrics = None  # LogGroupMetrics, None when metrics are not served
+        self.trace = None  # CycleTrace of the running or last cycle
+
+    @staticmethod
+    def get_key(path, region=None, role_arn=None):
+        # the same path can be collected from several regions and accounts. Log groups of the
+        # default region and credentials are keyed by their path, so their positions still apply
+        if region is None and role_arn is None:
+            return path
+        key = f'{path}@{region or ""}'
+        if role_arn is not None:
+            key += f'@{role_arn}'
+        return key
 
     def _get_namespace_by_path(self):
         for key in self._LOG_GROUP_TO_PREFIX:
@@ -36,3 +62,15 @@ class LogGroup:
         minutes_ago = dt - datetime.timedelta(minutes=interval)
         unix_seconds = int(minutes_ago.timestamp())
         return unix_seconds
+
+
+class Watermark:
+    # where a log group can be resumed from once the logs read before it were acked
+    def __init__(self, latest_time, next_token, window_end, max_event_time, dedup_seq=None, streams=None):
+        # pages that are not read in order have no position, only what they read is committed
+        self.latest_time = latest_time
+        self.next_token = next_token
+        self.window_end = window_end
+        self.max_event_time = max_event_time  # milliseconds, 0 when the pages had no events
+        self.dedup_seq = dedup_seq  # the batch of event ids of the pages, committed to the deduplicator
+        self.streams = streams or {}  # stream name -> time it was read up to, for the streams it finished
@@ -0,0 +1,108 @@
+import fnmatch
+import logging
+import threading
+import time
+
+from .log_group import LogGroup
+
+logger = logging.getLogger(__name__)
+
+
+class LogGroupPattern:
+    _WILDCARDS = '*?['
+
+    def __init__(self, prefix, pattern, custom_fields, stream_concurrency, region=None, role_arn=None,
+                 parse_json=False, filter_pattern=None, filter_rules=None):
+        self.pattern = pattern
+        if pattern is not None:
+            # only the part before the first wildcard can be sent to AWS as a prefix
+            wildcard_index = min([pattern.index(c) for c in self._WILDCARDS if c in pattern] + [len(pattern)])
+            prefix = pattern[:wildcard_index]
+        self.prefix = prefix
+        self.custom_fields = custom_fields
+        self.stream_concurrency = stream_concurrency
+        self.region = region
+        self.role_arn = role_arn
+        self.parse_json = parse_json
+        self.filter_pattern = filter_pattern
+        self.filter_rules = filter_rules
+
+    def matches(self, path):
+        if not path.startswith(self.prefix):
+            return False
+        return self.pattern is None or fnmatch.fnmatchcase(path, self.pattern)
+
+    def __str__(self):
+        name = self.pattern if self.pattern is not None else f'{self.prefix}*'
+        return LogGroup.get_key(name, self.region, self.role_arn)
+
+
+class LogGroupDiscovery:
+    def __init__(self, patterns, refresh_seconds, excluded_keys=None):
+        self._patterns = patterns
+        self._refresh_seconds = refresh_seconds
+        self._excluded_keys = set(excluded_keys or [])
+        self._lock = threading.Lock()
+        self._index = {}  # log group key -> (path, pattern it matched)
+        self._last_refresh = None
+
+    def get_log_groups(self):
+        with self._lock:
+            return dict(self._index)
+
+    def refresh(self, get_client, force=False):
+        # get_client(region, role_arn) returns the logs client of the account and region to list
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._last_refresh is not None and now - self._last_refresh < self._refresh_seconds:
+                return {}, []
+            found = {}
+            for (region, role_arn), patterns in self._get_patterns_by_target().items():
+                cw_client = get_client(region, role_arn)
+                for prefix in self._get_prefixes(patterns):
+                    for path in self._describe_log_groups(cw_client, prefix):
+                        key = LogGroup.get_key(path, region, role_arn)
+                        if key in found or key in self._excluded_keys:
+                            continue
+                        pattern = self._get_matching_pattern(patterns, path)
+                        if pattern is not None:
+                            found[key] = (path, pattern)
+            added = {key: match for key, match in found.items() if key not in self._index}
+            removed = [key for key in self._index if key not in found]
+            self._index = found
+            self._last_refresh = now
+        if len(added) > 0 or len(removed) > 0:
+            logger.info(f'Log group discovery: {len(added)} new, {len(removed)} deleted, {len(found)} total')
+        return added, removed
+
+    def _get_patterns_by_target(self):
+        patterns_by_target = {}
+        for pattern in self._patterns:
+            patterns_by_target.setdefault((pattern.region, pattern.role_arn), []).append(pattern)
+        return patterns_by_target
+
+    @staticmethod
+    def _get_prefixes(patterns):
+        # a prefix that starts with another one is already covered by its listing
+        prefixes = []
+        for prefix in sorted(set(pattern.prefix for pattern in patterns)):
+            if len(prefixes) == 0 or not prefix.startswith(prefixes[-1]):
+                prefixes.append(prefix)
+        return prefixes
+
+    @staticmethod
+    def _get_matching_pattern(patterns, path):
+        for pattern in patterns:
+            if pattern.matches(path):
+                return pattern
+        return None
+
+    @staticmethod
+    def _describe_log_groups(cw_client, prefix):
+        params = {}
+        if prefix != '':
+            params['logGroupNamePrefix'] = prefix
+        paginator = cw_client.get_paginator('describe_log_groups')
+        for page in paginator.paginate(**params):
+            for log_group in page['logGroups']:
+                yield log_group['logGroupName']
@@ -0,0 +1,95 @@
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+
+class LogLevelExtractor:
+    DEFAULT_SCAN_LENGTH = 1024  # characters
+    DEFAULT_MAX_JSON_LENGTH = 64 * 1024  # characters
+    FIELD_LOG_LEVEL = 'log_level'
+    LOG_LEVELS = ['ALERT', 'TRACE', 'DEBUG', 'NOTICE', 'INFO', 'WARN',
+                  'WARNING', 'ERROR', 'ERR', 'CRITICAL', 'CRIT',
+                  'FATAL', 'SEVERE', 'EMERG', 'EMERGENCY']
+    LEVEL_KEYS = ['level', 'log_level', 'loglevel', 'severity']
+    SHAPE_JSON = 'json'
+    SHAPE_TEXT = 'text'
+    _LEVELS_SET = frozenset(LOG_LEVELS)
+    # longest first, so WARNING is not matched as WARN
+    _LEVELS_PATTERN = '|'.join(sorted(LOG_LEVELS, key=len, reverse=True))
+    _MAX_BRACKET_LENGTH = max(len(level) for level in LOG_LEVELS) + 1
+    # level=info, level: INFO, "level":"info", log_level=warn
+    _KEY_VALUE = re.compile(rf'(?:level|severity)"?\s*[=:]\s*"?({_LEVELS_PATTERN})\b', re.IGNORECASE)
+    _JSON_START = re.compile(r'\s*\{')
+
+    def __init__(self, scan_length=DEFAULT_SCAN_LENGTH, parse_json=False, max_json_length=DEFAULT_MAX_JSON_LENGTH):
+        # one extractor per log group
+        self._scan_length = scan_length
+        self._parse_json = parse_json
+        self._max_json_length = max_json_length
+        # shape -> matchers by precedence, the level of a message never depends on the messages before it
+        self._matchers = {self.SHAPE_JSON: (self._match_key_value, self._match_bracket),
+                          self.SHAPE_TEXT: (self._match_bracket, self._match_key_value)}
+
+    def extract(self, message, event):
+        first = message[:1]
+        is_json = first == '{' or (first.isspace() and self._JSON_START.match(message) is not None)
+        if is_json and self._parse_json and len(message) <= self._max_json_length:
+            log_level = self._add_json_fields(message, event)
+            if log_level != '':
+                event[self.FIELD_LOG_LEVEL] = log_level
+                return
+        log_level = self.get_log_level(message, self.SHAPE_JSON if is_json else self.SHAPE_TEXT)
+        if log_level != '':
+            event[self.FIELD_LOG_LEVEL] = log_level
+
+    def get_log_level(self, message, shape=SHAPE_TEXT):
+        # only the start of the message is scanned, levels of huge messages are at its beginning anyway
+        matchers = self._matchers[shape]
+        log_level = matchers[0](message, self._scan_length)
+        if log_level == '':
+            log_level = matchers[1](message, self._scan_length)
+        return log_level
+
+    def _match_bracket(self, message, end):
+        # [INFO], str.find is much faster than searching with a pattern
+        start = message.find('[', 0, end)
+        while start != -1:
+            close = message.find(']', start + 1, end)
+            if close == -1:
+                return ''
+            if close - start <= self._MAX_BRACKET_LENGTH:
+                log_level = message[start + 1:close].upper()
+                if log_level in self._LEVELS_SET:
+                    return log_level
+            start = message.find('[', start + 1, end)
+        return ''
+
+    def _match_key_value(self, message, end):
+        # the keys are found with str.find before the pattern is tried, scanning with the pattern is much slower
+        prefix = message[:end].lower()
+        for key in ('level', 'severity'):
+            index = prefix.find(key)
+            while index != -1:
+                match = self._KEY_VALUE.match(prefix, index)
+                if match is not None:
+                    return match.group(1).upper()
+                index = prefix.find(key, index + 1)
+        return ''
+
+    def _add_json_fields(self, message, event):
+        try:
+            fields = json.loads(message)
+        except ValueError:
+            return ''
+        if not isinstance(fields, dict):
+            return ''
+        for key, value in fields.items():
+            # fields of the fetcher are kept
+            event.setdefault(key, value)
+        for key in self.LEVEL_KEYS:
+            value = fields.get(key)
+            if isinstance(value, str) and value.upper() in self._LEVELS_SET:
+                return value.upper()
+        return ''
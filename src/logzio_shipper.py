@@ -1,12 +1,18 @@
+import collections
+import contextlib
 import logging
 import requests
-import gzip
-import json
+import threading
+import time
+import zlib
 
 from requests.adapters import HTTPAdapter, RetryError
 from requests.sessions import InvalidSchema, Session
 from urllib3.util.retry import Retry
 
+from .compressed_bulk import CompressedBulk
+from .json_encoder import get_encoder
+
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -14,55 +20,203 @@ logger.setLevel(logging.INFO)
 
 class LogzioShipper:
     MAX_BODY_SIZE_BYTES = 10 * 1024 * 1024              # 10 MB
-    MAX_BULK_SIZE_BYTES = MAX_BODY_SIZE_BYTES / 10      # 1 MB
     MAX_LOG_SIZE_BYTES = 500 * 1000                     # 500 KB
+    DEFAULT_COMPRESSION_LEVEL = zlib.Z_DEFAULT_COMPRESSION
 
     MAX_RETRIES = 3
     BACKOFF_FACTOR = 1
     STATUS_FORCELIST = [500, 502, 503, 504]
     CONNECTION_TIMEOUT_SECONDS = 5
+    STAGE_ENCODE = 'encode'
+    STAGE_COMPRESS = 'compress'
+    STAGE_POST = 'post'
+    STAGE_SPILL = 'spill'
+    STAGE_WAIT_SENT = 'wait_sent'
+    _NO_SPAN = contextlib.nullcontext()
 
-    def __init__(self, logzio_url, token):
+    def __init__(self, logzio_url, token, session=None, bulk_sender=None, encoder=None,
+                 compression_level=DEFAULT_COMPRESSION_LEVEL, spill_queue=None, metrics=None):
         self._logzio_url = "{0}/?token={1}".format(logzio_url, token)
-        self._logs = []
-        self._bulk_size = 0
+        self._session = session if session is not None else LogzioSession()
+        self._bulk_sender = bulk_sender
+        self._encoder = encoder if encoder is not None else get_encoder()
+        self._spill_queue = spill_queue
+        self._metrics = metrics  # LogGroupMetrics
+        self._trace = None  # CycleTrace of the running cycle
+        self._pending_bulks = []
+        self._compression_level = compression_level
+        # created with the first log, so idle log groups don't hold a compressor
+        self._bulk = None
+        # bulks are numbered in the order they were opened, acked once sent or spilled
+        self._ack_lock = threading.Lock()
+        self._next_bulk_id = 0
+        self._open_bulk_id = -1
+        self._acked_through = -1  # every bulk up to this one was acked
+        self._acked = set()  # acked bulks after it
+        self._watermarks = collections.deque()  # (bulk that has to be acked, watermark)
         self._custom_fields = {'type': 'cloudwatch', 'shipper': 'cw-fetcher'}
 
+    def set_trace(self, trace):
+        self._trace = trace
+
     def add_log_to_send(self, log):
-        enriched_log = self._add_custom_fields_to_log(log)
+        self._add_encoded_log(self._add_custom_fields_to_log(log))
+
+    def add_logs_to_send(self, logs):
+        # a page at a time, so encoding and compression are timed apart
+        with self._span(self.STAGE_ENCODE):
+            encoded_logs = [self._add_custom_fields_to_log(log) for log in logs]
+        with self._span(self.STAGE_COMPRESS):
+            for encoded_log in encoded_logs:
+                self._add_encoded_log(encoded_log)
+
+    def _add_encoded_log(self, enriched_log):
         enriched_log_size = len(enriched_log)
 
         if not self._is_log_valid_to_be_sent(enriched_log, enriched_log_size):
             return
 
-        if not self._bulk_size + enriched_log_size > LogzioShipper.MAX_BULK_SIZE_BYTES:
-            self._logs.append(enriched_log)
-            self._bulk_size += enriched_log_size
-            return
+        if self._bulk is not None and not self._bulk.fits(enriched_log_size, LogzioShipper.MAX_BODY_SIZE_BYTES):
+            try:
+                self._dispatch_bulk()
+            except Exception:
+                raise
 
-        try:
-            self.send_to_logzio()
-        except Exception:
-            raise
+        if self._bulk is None:
+            self._bulk = CompressedBulk(self._compression_level)
+            self._open_bulk_id = self._next_bulk_id
+            self._next_bulk_id += 1
+        self._bulk.add(enriched_log)
+
+    def mark_watermark(self, watermark):
+        # reached once the logs added so far were acked, whichever bulk they went to
+        bulk_id = self._open_bulk_id if self._bulk is not None else self._next_bulk_id - 1
+        with self._ack_lock:
+            self._watermarks.append((bulk_id, watermark))
 
-        self._logs.append(enriched_log)
-        self._bulk_size = enriched_log_size
+    def pop_acked_watermarks(self):
+        # the watermarks all the logs before them were acked for, oldest first
+        watermarks = []
+        with self._ack_lock:
+            while len(self._watermarks) > 0 and self._watermarks[0][0] <= self._acked_through:
+                watermarks.append(self._watermarks.popleft()[1])
+        return watermarks
+
+    def reset_watermarks(self):
+        # bulks that failed are never acked, the watermarks after them are dropped with them
+        with self._ack_lock:
+            self._watermarks.clear()
+            self._acked.clear()
+            self._acked_through = self._next_bulk_id - 1
 
     def send_to_logzio(self):
-        if self._logs is None:
+        if self._bulk is not None:
+            with self._span(self.STAGE_COMPRESS):
+                self._dispatch_bulk()
+        self.flush()
+
+    def flush(self):
+        pending_bulks = self._pending_bulks
+        self._pending_bulks = []
+        error = None
+        with self._span(self.STAGE_WAIT_SENT):
+            for future in pending_bulks:
+                try:
+                    future.result()
+                except Exception as e:
+                    if error is None:
+                        error = e
+        if error is not None:
+            raise error
+
+    def _span(self, stage):
+        trace = self._trace
+        return trace.span(stage) if trace is not None else self._NO_SPAN
+
+    def _dispatch_bulk(self):
+        bulk_size = self._bulk.raw_size
+        logs_count = self._bulk.logs_count
+        compressed_data = self._bulk.seal()
+        bulk_id = self._open_bulk_id
+        self._reset_logs()
+        if self._metrics is not None:
+            self._metrics.bulk_size.observe(bulk_size)
+            self._metrics.compression_ratio.observe(bulk_size / max(len(compressed_data), 1))
+        if self._bulk_sender is None:
+            self._send_and_ack_bulk(bulk_id, compressed_data, bulk_size, logs_count)
+        else:
+            self._pending_bulks.append(
+                self._bulk_sender.submit(self._send_and_ack_bulk, bulk_id, compressed_data, bulk_size, logs_count))
+
+    def _send_and_ack_bulk(self, bulk_id, compressed_data, bulk_size, logs_count=0):
+        self._send_or_spill_bulk(compressed_data, bulk_size)
+        if self._metrics is not None:
+            self._metrics.events_shipped.inc(logs_count)
+            self._metrics.bytes_shipped.inc(bulk_size)
+        with self._ack_lock:
+            # bulks in flight are acked out of order, the watermarks only follow the contiguous ones
+            if bulk_id > self._acked_through:
+                self._acked.add(bulk_id)
+            while self._acked_through + 1 in self._acked:
+                self._acked_through += 1
+                self._acked.remove(self._acked_through)
+
+    def send_sealed_bulk(self, compressed_data, bulk_size):
+        self._send_bulk(compressed_data, bulk_size)
+
+    def _send_or_spill_bulk(self, compressed_data, bulk_size):
+        if self._spill_queue is None:
+            self._send_measured_bulk(compressed_data, bulk_size)
             return
+        if self._spill_queue.should_spill() and self._spill_bulk(compressed_data, bulk_size):
+            logger.debug("Spilled bulk of {0} bytes, the Logz.io listener is unhealthy.".format(bulk_size))
+            return
+        try:
+            self._send_measured_bulk(compressed_data, bulk_size)
+        except Exception as e:
+            if isinstance(e, requests.HTTPError) and e.response is not None and e.response.status_code == 400:
+                # sending it again would fail again
+                raise
+            # the bulk is kept on disk and replayed later, so the logs it holds count as sent
+            if not self._spill_bulk(compressed_data, bulk_size):
+                logger.error("The spill queue is full, bulk of {0} bytes was not spilled.".format(bulk_size))
+                raise
+            logger.warning("Spilled bulk of {0} bytes after its retries were exhausted.".format(bulk_size))
 
+    def _spill_bulk(self, compressed_data, bulk_size):
+        with self._span(self.STAGE_SPILL):
+            return self._spill_queue.put(compressed_data, bulk_size)
+
+    def _send_measured_bulk(self, compressed_data, bulk_size):
+        with self._span(self.STAGE_POST):
+            if self._metrics is None:
+                self._send_bulk(compressed_data, bulk_size)
+                return
+            start = time.perf_counter()
+            try:
+                response = self._send_bulk(compressed_data, bulk_size)
+            except Exception:
+                self._metrics.post_failures.inc()
+                raise
+            finally:
+                self._metrics.post_latency.observe(time.perf_counter() - start)
+        # retried by urllib3 within the post
+        retries = getattr(response.raw, 'retries', None)
+        if retries is not None and len(retries.history) > 0:
+            self._metrics.post_retries.inc(len(retries.history))
+
+    def _send_bulk(self, compressed_data, bulk_size):
         try:
             headers = {"Content-Type": "application/json",
                        "Content-Encoding": "gzip"}
-            compressed_data = gzip.compress(str.encode('\n'.join(self._logs)))
-            response = self._get_request_retry_session().post(url=self._logzio_url,
-                                                              data=compressed_data,
-                                                              headers=headers,
-                                                              timeout=LogzioShipper.CONNECTION_TIMEOUT_SECONDS)
+            response = self._session.post(url=self._logzio_url,
+                                          data=compressed_data,
+                                          headers=headers,
+                                          timeout=LogzioShipper.CONNECTION_TIMEOUT_SECONDS)
             response.raise_for_status()
-            logger.info("Successfully sent bulk of {} bytes to Logz.io.".format(self._bulk_size))
-            self._reset_logs()
+            logger.info("Successfully sent bulk of {0} bytes ({1} compressed) to Logz.io.".format(
+                bulk_size, len(compressed_data)))
+            return response
         except requests.ConnectionError as e:
             logger.error(
                 "Can't establish connection to {0} url. Please make sure your url is a Logz.io valid url. Max retries "
@@ -110,20 +264,24 @@ class LogzioShipper:
         return True
 
     def _add_custom_fields_to_log(self, log):
-        json_log = json.loads(log)
+        log.update(self._custom_fields)
 
-        for key, value in self._custom_fields.items():
-            json_log[key] = value
+        return self._encoder.encode(log)
 
-        return json.dumps(json_log)
+    def _reset_logs(self):
+        self._bulk = None
 
-    def _get_request_retry_session(
-            self,
-            retries=MAX_RETRIES,
-            backoff_factor=BACKOFF_FACTOR,
-            status_forcelist=STATUS_FORCELIST
-    ):
-        session = requests.Session()
+
+class LogzioSession:
+    DEFAULT_POOL_SIZE = 1
+    DEFAULT_MAX_CONNECTIONS = 10
+
+    def __init__(self,
+                 pool_size=DEFAULT_POOL_SIZE,
+                 max_connections=DEFAULT_MAX_CONNECTIONS,
+                 retries=LogzioShipper.MAX_RETRIES,
+                 backoff_factor=LogzioShipper.BACKOFF_FACTOR,
+                 status_forcelist=LogzioShipper.STATUS_FORCELIST):
         retry = Retry(
             total=retries,
             read=retries,
@@ -133,14 +291,35 @@ class LogzioShipper:
             allowed_methods=frozenset(['GET', 'POST']),
             status_forcelist=status_forcelist,
         )
-        adapter = HTTPAdapter(max_retries=retry)
+        # pool_block caps the open connections to the listener, extra senders wait for a free one
+        self._adapter = HTTPAdapter(max_retries=retry,
+                                    pool_connections=pool_size,
+                                    pool_maxsize=max_connections,
+                                    pool_block=True)
+        self._session = requests.Session()
+        self._session.mount('http://', self._adapter)
+        self._session.mount('https://', self._adapter)
+        self._session.headers.update({"Content-Type": "application/json"})
+        self._lock = threading.Lock()
+        self._requests = 0
 
-        session.mount('http://', adapter)
-        session.mount('https://', adapter)
-        session.headers.update({"Content-Type": "application/json"})
+    def post(self, **kwargs):
+        with self._lock:
+            self._requests += 1
+        return self._session.post(**kwargs)
 
-        return session
+    def get_connection_stats(self):
+        pools = self._adapter.poolmanager.pools
+        opened = 0
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                opened += pool.num_connections
+        with self._lock:
+            sent = self._requests
+        return {'requests': sent,
+                'connections_opened': opened,
+                'connections_reused': max(sent - opened, 0)}
 
-    def _reset_logs(self):
-        self._logs.clear()
-        self._bulk_size = 0
+    def close(self):
+        self._session.close()
@@ -1,17 +1,36 @@
-import json
+import collections
+import contextlib
 import logging
 import os
 import threading
 import signal
-import boto3
+import socket
 import time
 
 import botocore.exceptions
 
+from .aws_client_factory import AwsClientFactory
+from .backfill import TimeSlicedFetcher
+from .bulk_sender import BulkSender
+from .cluster import ClusterMember, LeaseLostError
+from .event_deduplicator import EventDeduplicator
+from .event_filter import EventFilter
+from .event_transformer import EventTransformer
 from .config_reader import ConfigReader
-from .log_group import LogGroup
-from .logzio_shipper import LogzioShipper
+from .json_encoder import AUTO, get_encoder
+from .lease_store import SqliteLeaseStore
+from .log_group import LogGroup, Watermark
+from .log_group_discovery import LogGroupDiscovery
+from .log_level_extractor import LogLevelExtractor
+from .metrics import FetcherMetrics, MetricsServer
+from .logzio_shipper import LogzioShipper, LogzioSession
+from .page_prefetcher import PagePrefetcher
 from .position_manager import PositionManager
+from .rate_limiter import AdaptiveRateLimiter
+from .scheduler import Scheduler
+from .spill_queue import SpillQueue, SpillReplayer
+from .stream_fetcher import StreamPartitionFetcher
+from .tracing import CycleProfiler, CycleTrace
 
 logger = logging.getLogger(__name__)
 
@@ -21,86 +40,202 @@ class Manager:
     _DEFAULT_TYPE = 'cloudwatch'
     _CONFIG_FILE = 'shared/config.yaml'
     _POS_FILE = 'shared/position.yaml'
+    _LEASE_FILE = 'shared/leases.db'
+    _SPILL_DIR = 'shared/spill'
+    _PROFILE_DIR = 'shared/profiles'
+    _DEFAULT_SLOW_CYCLE = 60  # seconds
+    STAGE_RATE_LIMIT = 'rate_limit'
+    STAGE_FILTER_LOG_EVENTS = 'filter_log_events'
+    STAGE_DEDUP = 'dedup'
+    STAGE_TRANSFORM = 'transform'
+    STAGE_FILTER = 'filter'
+    STAGE_CHECKPOINT = 'checkpoint'
+    _DEFAULT_SPILL_MAX_AGE = 24  # hours
     _DEFAULT_INTERVAL = 5
     _DEFAULT_LOGZIO_LISTENER = 'https://listener.logz.io:8071'
     _MIN_INTERVAL = 5  # 5 minutes
     _MAX_INTERVAL = 1380  # 1380 minutes (23 hours)
+    _DEFAULT_BACKFILL_SLICE = 60  # minutes
+    _DEFAULT_BACKFILL_CONCURRENCY = 4
+    _DEFAULT_BACKFILL_MAX_CONCURRENCY = 16
+    _DEFAULT_WORKERS = 10
+    _DEFAULT_DISCOVERY_REFRESH = 10  # minutes
+    _DISCOVERY_JOB = 'log group discovery'
+    _MAX_THROTTLE_RETRIES = 5
+    _CHECKPOINT_SECONDS = 10
+    _MAX_STREAMS_PER_REQUEST = 100
+    # lastEventTimestamp of a stream is eventually consistent, streams that look idle for less than this are kept
+    _STREAM_ACTIVITY_MARGIN = 2 * 60 * 60  # seconds
+    _THROTTLING_ERRORS = ['ThrottlingException', 'Throttling', 'TooManyRequestsException']
     ENV_LOGZIO_TOKEN = 'LOGZIO_LOG_SHIPPING_TOKEN'
     ENV_LOGZIO_LISTENER = 'LOGZIO_LISTENER'
+    ENV_CLUSTER_MODE = 'CLUSTER_MODE'
+    ENV_REPLICA_ID = 'REPLICA_ID'
+    ENV_METRICS_PORT = 'METRICS_PORT'
+    ENV_PROFILE_CYCLES = 'PROFILE_CYCLES'
     _KEY_NEXT_TOKEN = 'nextToken'
+    _KEY_FILTER_PATTERN = 'filterPattern'
     _KEY_EVENTS = 'events'
-    KEY_MESSAGE = 'message'
     _KEY_TIMESTAMP = 'timestamp'
+    KEY_MESSAGE = EventTransformer.KEY_MESSAGE
     FIELD_NAMESPACE = 'namespace'
     FIELD_LOG_GROUP = 'logGroup'
-    FIELD_LOG_STREAM = 'logStream'
+    FIELD_LOG_STREAM = EventTransformer.FIELD_LOG_STREAM
     FIELD_OWNER = 'owner'
     FIELD_SHIPPER = 'shipper'
     FIELD_TYPE = 'type'
-    FIELD_ID = 'id'
-    FIELD_LOG_LEVEL = 'log_level'
-    FIELD_TIMESTAMP = '@timestamp'
-    _LOG_LEVELS = ['ALERT', 'TRACE', 'DEBUG', 'NOTICE', 'INFO', 'WARN',
-                  'WARNING', 'ERROR', 'ERR', 'CRITICAL', 'CRIT',
-                  'FATAL', 'SEVERE', 'EMERG', 'EMERGENCY']
+    FIELD_ID = EventTransformer.FIELD_ID
+    FIELD_LOG_LEVEL = LogLevelExtractor.FIELD_LOG_LEVEL
+    FIELD_TIMESTAMP = EventTransformer.FIELD_TIMESTAMP
 
     def __init__(self):
-        self._threads = []
-        self._event = threading.Event()
-        self._lock = threading.Lock()
+        self._scheduler = None
+        self._workers = self._DEFAULT_WORKERS
+        self._aws_clients = AwsClientFactory()
+        self._cloudwatch_rate_limit = AdaptiveRateLimiter.DEFAULT_REQUESTS_PER_SECOND
+        # Cloudwatch quotas are per account and region, so is the rate limit budget
+        self._rate_limiters = {}  # (account id, region) -> rate limiter
+        self._account_ids = {}  # role arn -> account id, None for the default credentials
+        self._aws_lock = threading.Lock()
+        self._discovery = None
+        self._discovery_refresh_minutes = self._DEFAULT_DISCOVERY_REFRESH
         self._log_groups = []
         self._interval = self._DEFAULT_INTERVAL  # minutes
+        self._prefetch_depth = 0  # pages, 0 fetches and ships sequentially
+        self._logzio_session = None
+        self._bulk_sender = None
+        self._encoder = None
+        self._compression_level = LogzioShipper.DEFAULT_COMPRESSION_LEVEL
+        self._log_level_scan_length = LogLevelExtractor.DEFAULT_SCAN_LENGTH
+        self._dedup_max_events = EventDeduplicator.DEFAULT_MAX_EVENTS  # 0 disables de-duplication
+        self._dedup_persist = False
+        self._backfill_slice_minutes = self._DEFAULT_BACKFILL_SLICE
+        self._backfill_concurrency = self._DEFAULT_BACKFILL_CONCURRENCY
+        self._backfill_semaphore = threading.BoundedSemaphore(self._DEFAULT_BACKFILL_MAX_CONCURRENCY)
         self._logzio_token = ''
         self._logzio_listener = ''
         self._aws_region = ''
         self.start_time = int(time.time())
-        self._account_id = ''
+        self._spill_max_megabytes = 0  # 0 keeps the bulks that could not be sent in memory
+        self._spill_max_age_hours = self._DEFAULT_SPILL_MAX_AGE
+        self._spill_replay_rate = SpillReplayer.DEFAULT_BULKS_PER_SECOND
+        self._spill_queue = None
+        self._spill_replayer = None
+        self._metrics = None
+        self._metrics_server = None
+        self._slow_cycle_seconds = self._DEFAULT_SLOW_CYCLE
+        # cycles profiled from the start, read in run(). SIGUSR1 profiles the next ones
+        self._profile_cycles = 0
+        self._profiler = CycleProfiler(os.path.join(os.path.dirname(os.path.abspath(__file__)), self._PROFILE_DIR))
+        self._cluster = None
+        self._cluster_mode = os.getenv(self.ENV_CLUSTER_MODE, 'false').lower() == 'true'
         pos_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), self._POS_FILE)
-        self._position_manager = PositionManager(pos_path)
+        if self._cluster_mode:
+            # replicas share the positions, a log group is read by the replica that holds its lease
+            self._position_manager = PositionManager(pos_path, PositionManager.STORE_SQLITE, shared=True)
+        else:
+            self._position_manager = PositionManager(pos_path)
 
     def run(self):
         logger.info('Starting Cloudwatch Fetcher')
+        # blocked before any thread starts, threads inherit the mask and only sigwait below gets them.
+        # SIGUSR1 would terminate the process if one of the threads got it
+        signals = [signal.SIGINT, signal.SIGTERM, signal.SIGUSR1]
+        signal.pthread_sigmask(signal.SIG_BLOCK, signals)
         if not self._get_logzio_credentials():
             return
+        if not self._read_profile_cycles():
+            return
         if not self._read_data_from_config():
             return
         try:
-            self._account_id = self._get_account_id()
+            self._get_account_id(self._aws_region)
         except Exception as e:
             logger.error(e)
             return
         if not self._valid_interval():
             return
+        try:
+            self._discover_log_groups()
+        except Exception as e:
+            # positions of discovered log groups would be removed by the sync below
+            logger.error(f'Encountered error while discovering log groups: {e}')
+            return
         self._position_manager.sync_position_file(self._log_groups)
+        if self._cluster_mode:
+            try:
+                self._join_cluster()
+            except Exception as e:
+                logger.error(f'Encountered error while joining the cluster: {e}')
+                return
+        if os.getenv(self.ENV_METRICS_PORT):
+            try:
+                self._start_metrics_server(int(os.getenv(self.ENV_METRICS_PORT)))
+            except Exception as e:
+                logger.error(f'Encountered error while serving metrics on port {os.getenv(self.ENV_METRICS_PORT)}: {e}')
+                return
+        if self._spill_max_megabytes > 0:
+            try:
+                self._start_spill_replay()
+            except Exception as e:
+                logger.error(f'Encountered error while opening the spill queue: {e}')
+                return
+        self._scheduler = Scheduler(self._workers)
         for log_group in self._log_groups:
             self._load_data_from_position_file(log_group)
-            self._threads.append(threading.Thread(target=self._run_scheduled_log_collection, args=(log_group,), name=f'scheduled_{log_group.path}'))
-        for thread in self._threads:
-            thread.start()
+            self._schedule_log_group(log_group)
+        if self._discovery is not None:
+            refresh_seconds = self._discovery_refresh_minutes * 60
+            self._scheduler.add(self._DISCOVERY_JOB, self._refresh_discovered_log_groups, refresh_seconds,
+                                delay_seconds=refresh_seconds)
+        logger.info(f'Collecting {len(self._log_groups)} log groups with {self._workers} workers')
+        self._scheduler.start()
 
-        signal.sigwait([signal.SIGINT, signal.SIGTERM])
+        while signal.sigwait(signals) == signal.SIGUSR1:
+            self._profiler.request(self._profile_cycles or CycleProfiler.DEFAULT_CYCLES)
         self.__exit_gracefully()
 
+    def _read_profile_cycles(self):
+        profile_cycles = os.getenv(self.ENV_PROFILE_CYCLES)
+        if not profile_cycles:
+            return True
+        try:
+            self._profile_cycles = int(profile_cycles)
+        except ValueError:
+            self._profile_cycles = -1
+        if self._profile_cycles < 0:
+            logger.error(f'Env var {self.ENV_PROFILE_CYCLES} must be a number of cycles, got {profile_cycles}')
+            return False
+        if self._profile_cycles > 0:
+            self._profiler.request(self._profile_cycles)
+        return True
+
     def _valid_interval(self):
         if self._interval < self._MIN_INTERVAL or self._interval > self._MAX_INTERVAL:
             logger.error(f'Interval must be between {self._MIN_INTERVAL} and {self._MAX_INTERVAL} minutes!')
             return False
         return True
 
-    def _get_account_id(self):
-        try:
-            session = boto3.session.Session(region_name=self._aws_region)
-            sts_client = session.client('sts')
-        except botocore.exceptions.BotoCoreError as bce:
-            raise bce
-        except Exception as e:
-            raise Exception(f'Encountered error while creating sts client: {e}')
-        try:
-            account_id = sts_client.get_caller_identity()['Account']
-            logger.debug(f'AWS account id: {account_id}')
+    def _get_account_id(self, region, role_arn=None):
+        with self._aws_lock:
+            if role_arn in self._account_ids:
+                return self._account_ids[role_arn]
+            try:
+                sts_client = self._aws_clients.get_client('sts', region, role_arn)
+            except botocore.exceptions.BotoCoreError as bce:
+                raise bce
+            except Exception as e:
+                raise Exception(f'Encountered error while creating sts client: {e}')
+            try:
+                account_id = sts_client.get_caller_identity()['Account']
+                logger.debug(f'AWS account id: {account_id}' + (f' for role {role_arn}' if role_arn else ''))
+            except Exception as e:
+                raise Exception(f'Encountered error while getting AWS account id: {e}')
+            self._account_ids[role_arn] = account_id
             return account_id
-        except Exception as e:
-            raise Exception(f'Encountered error while getting AWS account id: {e}')
+
+    def _get_region(self, log_group):
+        return log_group.region or self._aws_region
 
     def _read_data_from_config(self):
         config_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), self._CONFIG_FILE)
@@ -109,8 +244,16 @@ class Manager:
         if config_reader is None:
             return False
         self._log_groups = config_reader.get_log_groups(self.start_time, self._DEFAULT_INTERVAL)
-        if self._log_groups is None or len(self._log_groups) == 0:
+        if self._log_groups is None:
+            return False
+        patterns = config_reader.get_log_group_patterns()
+        if len(self._log_groups) == 0 and len(patterns) == 0:
             return False
+        if len(patterns) > 0:
+            self._discovery_refresh_minutes = config_reader.get_discovery_refresh_minutes(self._DEFAULT_DISCOVERY_REFRESH)
+            # log groups listed by path keep their own settings
+            self._discovery = LogGroupDiscovery(patterns, self._discovery_refresh_minutes * 60,
+                                                excluded_keys=[log_group.key for log_group in self._log_groups])
         region = config_reader.get_aws_region()
         if region != '':
             self._aws_region = region
@@ -124,8 +267,109 @@ class Manager:
             logger.debug(f'Set {config_reader.KEY_INTERVAL} to: {self._interval}')
         else:
             logger.info(f'Reverting {config_reader.KEY_INTERVAL} to default value: {self._DEFAULT_INTERVAL}')
+        self._prefetch_depth = config_reader.get_prefetch_depth()
+        if self._prefetch_depth > 0:
+            logger.info(f'Prefetching up to {self._prefetch_depth} Cloudwatch pages while shipping')
+        # one pooled session is shared by the shippers of all log groups
+        self._logzio_session = LogzioSession(
+            pool_size=config_reader.get_logzio_pool_size(LogzioSession.DEFAULT_POOL_SIZE),
+            max_connections=config_reader.get_logzio_max_connections(LogzioSession.DEFAULT_MAX_CONNECTIONS))
+        max_in_flight_bulks = config_reader.get_max_in_flight_bulks()
+        if max_in_flight_bulks > 0:
+            logger.info(f'Sending up to {max_in_flight_bulks} bulks to Logz.io concurrently')
+            self._bulk_sender = BulkSender(max_in_flight_bulks)
+        self._encoder = get_encoder(config_reader.get_json_encoder(AUTO))
+        self._compression_level = config_reader.get_compression_level(LogzioShipper.DEFAULT_COMPRESSION_LEVEL)
+        self._log_level_scan_length = config_reader.get_log_level_scan_length(LogLevelExtractor.DEFAULT_SCAN_LENGTH)
+        self._dedup_max_events = config_reader.get_dedup_max_events(EventDeduplicator.DEFAULT_MAX_EVENTS)
+        self._dedup_persist = config_reader.get_dedup_persist()
+        if self._dedup_persist and self._position_manager.store_type != PositionManager.STORE_SQLITE:
+            # the yaml file is rewritten with every checkpoint, thousands of ids per log group make it huge
+            logger.warning(f'{config_reader.KEY_DEDUP_PERSIST} needs the {PositionManager.STORE_SQLITE} position '
+                           f'store, the event ids will not be kept across restarts')
+            self._dedup_persist = False
+        self._backfill_slice_minutes = config_reader.get_backfill_slice_minutes(self._DEFAULT_BACKFILL_SLICE)
+        self._backfill_concurrency = config_reader.get_backfill_concurrency(self._DEFAULT_BACKFILL_CONCURRENCY)
+        # shared by the backfills of all log groups
+        self._backfill_semaphore = threading.BoundedSemaphore(
+            config_reader.get_backfill_max_concurrency(self._DEFAULT_BACKFILL_MAX_CONCURRENCY))
+        self._workers = config_reader.get_workers(self._DEFAULT_WORKERS)
+        self._aws_clients = AwsClientFactory(
+            config_reader.get_aws_max_pool_connections(AwsClientFactory.DEFAULT_MAX_POOL_CONNECTIONS))
+        self._cloudwatch_rate_limit = config_reader.get_cloudwatch_rate_limit(
+            AdaptiveRateLimiter.DEFAULT_REQUESTS_PER_SECOND)
+        self._spill_max_megabytes = config_reader.get_spill_max_megabytes()
+        self._spill_max_age_hours = config_reader.get_spill_max_age_hours(self._DEFAULT_SPILL_MAX_AGE)
+        self._spill_replay_rate = config_reader.get_spill_replay_rate(SpillReplayer.DEFAULT_BULKS_PER_SECOND)
+        self._slow_cycle_seconds = config_reader.get_slow_cycle_seconds(self._DEFAULT_SLOW_CYCLE)
+        return True
+
+    def _join_cluster(self):
+        replica_id = os.getenv(self.ENV_REPLICA_ID) or socket.gethostname()
+        lease_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), self._LEASE_FILE)
+        # leases are sized from the interval of each log group, and renewed while its cycle runs
+        self._cluster = ClusterMember(SqliteLeaseStore(lease_path), replica_id, self._interval * 60 * 2)
+        self._cluster.start()
+        logger.info(f'Joined the cluster as {replica_id}')
+
+    def _start_metrics_server(self, port):
+        self._metrics = FetcherMetrics()
+        self._metrics_server = MetricsServer(self._metrics.registry, port)
+        self._metrics_server.start()
+        logger.info(f'Serving metrics on port {self._metrics_server.port}{MetricsServer.PATH}')
+
+    def _start_spill_replay(self):
+        spill_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), self._SPILL_DIR)
+        if self._cluster is not None:
+            # segments are appended and replayed by one replica only. The hostname of a pod changes on restart,
+            # its spilled bulks would never be replayed and they were already checkpointed as sent
+            if not os.getenv(self.ENV_REPLICA_ID):
+                raise Exception(f'Env var {self.ENV_REPLICA_ID} must be set to a name that stays the same across '
+                                f'restarts when spilling bulks in cluster mode')
+            spill_dir = os.path.join(spill_dir, self._cluster.replica_id)
+        self._spill_queue = SpillQueue(spill_dir, self._spill_max_megabytes * 1024 * 1024,
+                                       self._spill_max_age_hours * 60 * 60)
+        replay_shipper = LogzioShipper(self._logzio_listener, self._logzio_token, self._logzio_session)
+        self._spill_replayer = SpillReplayer(self._spill_queue, replay_shipper.send_sealed_bulk,
+                                             self._spill_replay_rate)
+        self._spill_replayer.start()
+        logger.info(f'Spilling bulks that could not be sent to {spill_dir}, up to {self._spill_max_megabytes} MB')
+
+    def _acquire_lease(self, log_group):
+        if not self._cluster.is_assigned(log_group.key):
+            if self._cluster.holds(log_group.key):
+                # the next owner starts from the position saved here
+                self._position_manager.flush()
+                self._cluster.release(log_group.key)
+                logger.info(f'Log group {log_group.key} moved to another replica')
+            return False
+        held = self._cluster.holds(log_group.key)
+        if not self._cluster.acquire(log_group.key, self._get_lease_seconds(log_group)):
+            logger.debug(f'Log group {log_group.key} is still read by another replica')
+            return False
+        log_group.lease_renewed_at = time.monotonic()
+        if not held:
+            # another replica may have read the log group since its position was loaded
+            log_group.stream_positions.clear()
+            self._load_data_from_position_file(log_group, reload=True)
         return True
 
+    def _renew_lease(self, log_group, force=False):
+        # False once another replica took the log group over, its position must not be moved from here anymore
+        if self._cluster is None:
+            return True
+        now = time.monotonic()
+        if not force and now - log_group.lease_renewed_at < self._cluster.heartbeat_seconds:
+            return True
+        if not self._cluster.acquire(log_group.key, self._get_lease_seconds(log_group)):
+            return False
+        log_group.lease_renewed_at = now
+        return True
+
+    def _get_lease_seconds(self, log_group):
+        # a lease outlives one late cycle of its log group before another replica can take it
+        return log_group.interval * 60 * 2
+
     def _get_logzio_credentials(self):
         self._logzio_token = os.getenv(self.ENV_LOGZIO_TOKEN)
         if self._logzio_token is None or self._logzio_token == '':
@@ -134,149 +378,479 @@ class Manager:
         self._logzio_listener = os.getenv(self.ENV_LOGZIO_LISTENER, self._DEFAULT_LOGZIO_LISTENER)
         return True
 
-    def _run_scheduled_log_collection(self, log_group):
-        logzio_shipper = LogzioShipper(self._logzio_listener, self._logzio_token)
+    def _discover_log_groups(self):
+        if self._discovery is None:
+            return
+        added, _ = self._discovery.refresh(self._get_discovery_client, force=True)
+        for path, pattern in added.values():
+            self._log_groups.append(self._new_discovered_log_group(path, pattern, self.start_time))
 
-        while True:
-            thread = threading.Thread(target=self._fetch_and_send, args=(log_group, logzio_shipper,), name=f'fetch_{log_group.path}')
+    def _refresh_discovered_log_groups(self):
+        added, removed = self._discovery.refresh(self._get_discovery_client)
+        for key in removed:
+            logger.info(f'Log group {key} was deleted, it will not be collected anymore')
+            self._scheduler.remove(key)
+            if self._metrics is not None:
+                self._metrics.remove_log_group(key)
+        self._position_manager.remove_positions(removed)
+        for key, (path, pattern) in added.items():
+            logger.info(f'Discovered new log group {key}')
+            log_group = self._new_discovered_log_group(path, pattern, int(time.time()))
+            self._load_data_from_position_file(log_group)
+            self._schedule_log_group(log_group)
+
+    def _new_discovered_log_group(self, path, pattern, start_time):
+        return LogGroup(path, pattern.custom_fields, start_time, self._interval, pattern.stream_concurrency,
+                        pattern.region, pattern.role_arn, pattern.parse_json, pattern.filter_pattern,
+                        pattern.filter_rules)
+
+    def _get_discovery_client(self, region, role_arn):
+        region = region or self._aws_region
+        return self._get_logs_client(region, role_arn, self._get_rate_limiter(region, role_arn))
 
-            thread.start()
-            thread.join()
+    def _get_logs_client(self, region, role_arn, rate_limiter):
+        return self._aws_clients.get_client('logs', region, role_arn,
+                                            lambda cw_client: self._register_throttling_hook(cw_client, rate_limiter))
 
-            timeout_seconds = self._interval * 60
-            if self._event.wait(timeout=timeout_seconds):
-                logger.info('Terminating...')
-                break
+    def _get_rate_limiter(self, region, role_arn=None):
+        key = (self._get_account_id(region, role_arn), region)
+        with self._aws_lock:
+            rate_limiter = self._rate_limiters.get(key)
+            if rate_limiter is None:
+                rate_limiter = AdaptiveRateLimiter(self._cloudwatch_rate_limit)
+                self._rate_limiters[key] = rate_limiter
+            return rate_limiter
 
-    def _fetch_and_send(self, log_group, logzio_shipper):
+    def _schedule_log_group(self, log_group):
+        if self._metrics is not None:
+            log_group.metrics = self._metrics.for_log_group(log_group.key)
+        logzio_shipper = LogzioShipper(self._logzio_listener, self._logzio_token, self._logzio_session,
+                                       self._bulk_sender, self._encoder, self._compression_level, self._spill_queue,
+                                       log_group.metrics)
+        # kept between cycles, it learns the shape of the messages of the log group
+        extractor = LogLevelExtractor(self._log_level_scan_length, log_group.parse_json)
+        event_filter = EventFilter(**log_group.filter_rules) if log_group.filter_rules is not None else None
+        deduplicator = self._new_deduplicator(log_group)
+        self._scheduler.add(log_group.key,
+                            lambda: self._profiler.run(log_group.key, lambda: self._fetch_and_send(
+                                log_group, logzio_shipper, extractor, event_filter, deduplicator)),
+                            self._interval * 60)
+
+    def _new_deduplicator(self, log_group):
+        if self._dedup_max_events == 0:
+            return None
+        deduplicator = EventDeduplicator(self._dedup_max_events)
+        if self._dedup_persist:
+            # the window read again after a restart skips the logs shipped before it
+            position = self._position_manager.get_position(log_group.key)
+            if position is not None:
+                deduplicator.load(position.get(PositionManager.FIELD_SEEN_EVENT_IDS))
+        return deduplicator
+
+    def _fetch_and_send(self, log_group, logzio_shipper, extractor, event_filter=None, deduplicator=None):
+        if self._cluster is not None and not self._acquire_lease(log_group):
+            return
         now = int(time.time())
-        resp = None
         new_logs = False
+        drained = False
+        sent = True
+        region = self._get_region(log_group)
         try:
-            session = boto3.session.Session(region_name=self._aws_region)
-            cw_client = session.client('logs')
+            rate_limiter = self._get_rate_limiter(region, log_group.role_arn)
+            cw_client = self._get_logs_client(region, log_group.role_arn, rate_limiter)
         except Exception as e:
-            logger.error(f'Encountered error while creating Cloudwatch client: {e}')
+            logger.error(f'Encountered error while creating Cloudwatch client for {log_group.key}: {e}')
             return
 
-        additional_fields = self._get_additional_fields(log_group)
+        trace = CycleTrace()
+        log_group.trace = trace
+        logzio_shipper.set_trace(trace)
+        transformer = EventTransformer(self._get_additional_fields(log_group), extractor.extract)
+        if event_filter is not None:
+            event_filter.start_cycle()
+        hits = deduplicator.hits if deduplicator is not None else 0
+        misses = deduplicator.misses if deduplicator is not None else 0
+        logzio_shipper.reset_watermarks()
+        page_tokens = collections.deque()
+        read_until = now
+        checkpointed = False
+        lease_lost = False
+        pages_count = 0
 
-        while True:
+        try:
+            for window_end, pages in self._get_windows(cw_client, rate_limiter, log_group, now, logzio_shipper,
+                                                       page_tokens):
+                read_until = window_end
+                with contextlib.closing(pages):
+                    for events in pages:
+                        if not self._renew_lease(log_group):
+                            raise LeaseLostError(log_group.key)
+                        new_logs = True
+                        pages_count += 1
+                        logger.info(f'Got {len(events)} new logs')
+                        newest_event_time = self._record_page(log_group, events)
+                        watermark = Watermark(None, None, None, newest_event_time)
+                        if len(page_tokens) > 0:
+                            # the window can be resumed after this page once its logs were acked,
+                            # it is done after its last page, which has no token
+                            next_token = page_tokens.popleft()
+                            if next_token != '':
+                                watermark = Watermark(log_group.latest_time, next_token, window_end,
+                                                      newest_event_time)
+                            else:
+                                watermark = Watermark(window_end, '', 0, newest_event_time)
+                        self._process_events(events, deduplicator, transformer, event_filter, logzio_shipper, trace)
+                        if deduplicator is not None:
+                            watermark.dedup_seq = deduplicator.seal()
+                        logzio_shipper.mark_watermark(watermark)
+                        checkpointed |= self._checkpoint_acked(log_group, logzio_shipper, deduplicator)
+                if window_end < now:
+                    # a backfill slice was fully read, checkpoint it once its logs were sent
+                    logzio_shipper.send_to_logzio()
+                    if not self._renew_lease(log_group, force=True):
+                        raise LeaseLostError(log_group.key)
+                    self._checkpoint_acked(log_group, logzio_shipper, deduplicator)
+                    log_group.latest_time = window_end
+                    # a token of the window, checkpointed while it was read, is not valid after it
+                    log_group.next_token = ''
+                    log_group.window_end = 0
+                    if deduplicator is not None:
+                        deduplicator.advance(window_end)
+                    self._save_latest_to_file(log_group, deduplicator)
+            drained = True
+        except LeaseLostError:
+            lease_lost = True
+        except Exception as e:
+            logger.error(f'Error while trying to get log events for {log_group.path}: {e}')
+            if not checkpointed:
+                # the window will be read again from its start on the next cycle, the token may be the culprit
+                log_group.next_token = ''
+                log_group.window_end = 0
+            if self._aws_clients.is_expired_credentials_error(e):
+                self._aws_clients.invalidate('logs', region, log_group.role_arn)
+
+        if not new_logs:
+            logger.info('No new logs at the moment')
+        else:
             try:
-                logger.debug(f'Start time: {log_group.latest_time}')
-                logger.debug(f'End time: {now}')
-                logger.debug(f'Next token: {log_group.next_token}')
-                if log_group.next_token != '':
-                    resp = cw_client.filter_log_events(logGroupName=log_group.path,
-                                                       startTime=log_group.latest_time * 1000,
-                                                       endTime=now * 1000,
-                                                       nextToken=log_group.next_token)
-                else:
-                    resp = cw_client.filter_log_events(logGroupName=log_group.path,
-                                                       startTime=log_group.latest_time * 1000,
-                                                       endTime=now * 1000)
-                if self._KEY_NEXT_TOKEN in resp:
-                    log_group.next_token = resp[self._KEY_NEXT_TOKEN]
-                if len(resp[self._KEY_EVENTS]) == 0:
-                    logger.info('No new logs at the moment')
-                    break
-                new_logs = True
-                logger.info(f'Got {len(resp[self._KEY_EVENTS])} new logs')
-                self._process_events(resp[self._KEY_EVENTS], additional_fields, logzio_shipper)
-                break
+                # waits for the bulks still in flight, the window is done only once all of them were sent
+                logzio_shipper.send_to_logzio()
             except Exception as e:
-                logger.error(f'Error while trying to get log events for {log_group.path}: {e}')
-                break
-
-        log_group.latest_time = now
+                logger.error(f'Error while trying to send logs of {log_group.path}: {e}')
+                sent = False
+        if lease_lost or not self._renew_lease(log_group, force=True):
+            # the other replica reads the log group from its saved position, checkpoints from here would move it back
+            logger.warning(f'Log group {log_group.key} was taken over by another replica, stopped reading it')
+            if deduplicator is not None:
+                deduplicator.rollback()
+            self._finish_trace(log_group, trace)
+            return
+        # the window is resumed after the last page whose logs were all acked
+        self._checkpoint_acked(log_group, logzio_shipper, deduplicator)
+        if deduplicator is not None:
+            # logs that were not acked must not be skipped when their window is read again
+            deduplicator.rollback()
+        if drained and sent:
+            log_group.latest_time = read_until
+            log_group.next_token = ''
+            log_group.window_end = 0
+            log_group.stream_positions.clear()
+            if deduplicator is not None:
+                deduplicator.advance(read_until)
+        if event_filter is not None:
+            dropped = event_filter.pop_stats()
+            if len(dropped) > 0:
+                logger.info(f'Dropped {sum(dropped.values())} logs of {log_group.path} by filter rules: {dropped}')
+                if log_group.metrics is not None:
+                    log_group.metrics.add_dropped(dropped)
+        if deduplicator is not None:
+            duplicated = deduplicator.hits - hits
+            unique = deduplicator.misses - misses
+            if duplicated > 0:
+                logger.info(f'Skipped {duplicated} logs of {log_group.path} that were already shipped, '
+                            f'{unique} were new')
+            if log_group.metrics is not None:
+                log_group.metrics.events_duplicated.inc(duplicated)
+                log_group.metrics.events_unique.inc(unique)
+        if log_group.metrics is not None:
+            log_group.metrics.pages_per_cycle.observe(pages_count)
+            if self._spill_queue is not None:
+                self._metrics.spill_queue_bytes.labels().set(len(self._spill_queue))
         if new_logs:
-            logzio_shipper.send_to_logzio()
-            self._save_latest_to_file(log_group)
+            self._save_latest_to_file(log_group, deduplicator)
+            logger.debug(f'Logz.io connection stats: {self._logzio_session.get_connection_stats()}')
+        self._finish_trace(log_group, trace)
+
+    def _finish_trace(self, log_group, trace):
+        elapsed = trace.get_elapsed()
+        if elapsed >= self._slow_cycle_seconds:
+            logger.warning(f'Slow cycle of {log_group.key} took {elapsed:.1f} seconds: {trace.format()}')
+        else:
+            logger.debug(f'Cycle of {log_group.key} took {elapsed:.3f} seconds: {trace.format()}')
+        if log_group.metrics is not None:
+            log_group.metrics.add_stages(trace.stages)
+
+    def _record_page(self, log_group, events):
+        # the newest event time of the page, in milliseconds
+        newest_event_time = 0
+        size = 0
+        for event in events:
+            timestamp = event.get(self._KEY_TIMESTAMP, 0)
+            if timestamp > newest_event_time:
+                newest_event_time = timestamp
+            size += len(event.get(self.KEY_MESSAGE, ''))
+        if log_group.metrics is not None:
+            log_group.metrics.events_fetched.inc(len(events))
+            log_group.metrics.bytes_fetched.inc(size)
+            log_group.metrics.ingestion_lag.set(max(time.time() - newest_event_time / 1000, 0))
+        return newest_event_time
+
+    def _checkpoint_acked(self, log_group, logzio_shipper, deduplicator=None):
+        # the event ids of acked pages count as shipped, returns whether the position moved
+        watermark = None
+        dedup_seq = None
+        for acked in logzio_shipper.pop_acked_watermarks():
+            if acked.dedup_seq is not None:
+                dedup_seq = acked.dedup_seq
+            # streams that were fully read and acked are not read again when the window is retried
+            log_group.stream_positions.update(acked.streams)
+            if acked.next_token is not None:
+                watermark = acked
+        if dedup_seq is not None:
+            deduplicator.commit(dedup_seq)
+        if watermark is None:
+            return False
+        # saved at most once per interval while the window is read, the end of the cycle saves it anyway
+        now = time.monotonic()
+        save = now - log_group.checkpointed_at >= self._CHECKPOINT_SECONDS
+        if save and not self._renew_lease(log_group, force=True):
+            raise LeaseLostError(log_group.key)
+        log_group.latest_time = watermark.latest_time
+        log_group.next_token = watermark.next_token
+        log_group.window_end = watermark.window_end
+        if save:
+            log_group.checkpointed_at = now
+            self._save_latest_to_file(log_group, deduplicator)
+            logger.debug(f'Checkpointed {log_group.key} after logs up to {watermark.max_event_time}')
+        return True
+
+    def _get_windows(self, cw_client, rate_limiter, log_group, now, logzio_shipper, page_tokens=None):
+        if log_group.stream_concurrency > 0:
+            partitions = self._get_stream_partitions(cw_client, log_group, now)
+            logger.info(f'Fetching {len(partitions)} stream partitions of {log_group.path}')
+            fetcher = StreamPartitionFetcher(
+                lambda partition: self._get_stream_partition_pages(cw_client, rate_limiter, log_group, partition, now),
+                partitions, log_group.stream_concurrency, max(self._prefetch_depth, 1),
+                # all the pages of the partition were shipped, its streams are done once they were acked
+                on_partition_done=lambda partition: logzio_shipper.mark_watermark(
+                    Watermark(None, None, None, 0, streams={stream_name: now for stream_name in partition[1]})),
+                name=f'streams_{log_group.path}')
+            yield now, fetcher
+            return
+        if log_group.next_token != '' and 0 < log_group.window_end < now:
+            # a token is only valid for the window it was returned for, the rest is read on the next cycle
+            now = log_group.window_end
+        window_seconds = now - log_group.latest_time
+        slice_seconds = self._backfill_slice_minutes * 60
+        if slice_seconds > 0 and window_seconds > slice_seconds and log_group.next_token == '':
+            backfill = TimeSlicedFetcher(
+                lambda start, end: self._get_slice_pages(cw_client, rate_limiter, log_group, start, end, now),
+                log_group.latest_time, now, slice_seconds, self._backfill_concurrency,
+                max(self._prefetch_depth, 1), name=f'backfill_{log_group.path}')
+            logger.info(f'Catching up on {window_seconds} seconds of {log_group.path} in {len(backfill.slices)} slices')
+            yield from backfill
+            return
+        pages = self._get_log_events_pages(cw_client, rate_limiter, log_group, now, page_tokens)
+        if self._prefetch_depth > 0:
+            pages = PagePrefetcher(pages, self._prefetch_depth, name=f'prefetch_{log_group.path}')
+        yield now, pages
+
+    def _get_log_events_pages(self, cw_client, rate_limiter, log_group, end_time, page_tokens=None):
+        # the position of the log group only moves once logs were acked, the token of every page
+        # is appended to page_tokens before the page is yielded
+        next_token = log_group.next_token
+        while True:
+            logger.debug(f'Start time: {log_group.latest_time}')
+            logger.debug(f'End time: {end_time}')
+            logger.debug(f'Next token: {next_token}')
+            params = {'logGroupName': log_group.path,
+                      'startTime': log_group.latest_time * 1000,
+                      'endTime': end_time * 1000}
+            if next_token != '':
+                params[self._KEY_NEXT_TOKEN] = next_token
+            self._add_filter_pattern(params, log_group)
+            resp = self._filter_log_events(cw_client, rate_limiter, params, end_time - log_group.latest_time,
+                                           log_group.metrics, log_group.trace)
+            # pages may be empty while CloudWatch is still scanning, only a missing token ends the window
+            next_token = resp.get(self._KEY_NEXT_TOKEN, '')
+            if len(resp[self._KEY_EVENTS]) > 0:
+                if page_tokens is not None:
+                    page_tokens.append(next_token)
+                yield resp[self._KEY_EVENTS]
+            if next_token == '':
+                return
+
+    def _get_slice_pages(self, cw_client, rate_limiter, log_group, start_time, end_time, now):
+        # slices of a group that is further behind get the rate limiter first
+        lag = now - start_time
+        params = {'logGroupName': log_group.path,
+                  'startTime': start_time * 1000,
+                  # the end of a slice is the start of the next one, so it is excluded
+                  'endTime': end_time * 1000 if end_time == now else end_time * 1000 - 1}
+        self._add_filter_pattern(params, log_group)
+        while True:
+            with self._backfill_semaphore:
+                resp = self._filter_log_events(cw_client, rate_limiter, params, lag, log_group.metrics,
+                                               log_group.trace)
+            if len(resp[self._KEY_EVENTS]) > 0:
+                yield resp[self._KEY_EVENTS]
+            if self._KEY_NEXT_TOKEN not in resp:
+                return
+            params[self._KEY_NEXT_TOKEN] = resp[self._KEY_NEXT_TOKEN]
+
+    def _get_stream_partitions(self, cw_client, log_group, now):
+        # streams already read up to a later time than the group start where they stopped
+        starts = {}
+        paginator = cw_client.get_paginator('describe_log_streams')
+        for page in paginator.paginate(logGroupName=log_group.path, orderBy='LastEventTime', descending=True):
+            for stream in page['logStreams']:
+                last_event_time = stream.get('lastEventTimestamp', now * 1000) // 1000
+                if last_event_time < log_group.latest_time - self._STREAM_ACTIVITY_MARGIN:
+                    return self._partition_streams(starts)
+                start_time = max(log_group.latest_time, log_group.stream_positions.get(stream['logStreamName'], 0))
+                if start_time < now:
+                    starts.setdefault(start_time, []).append(stream['logStreamName'])
+        return self._partition_streams(starts)
+
+    def _partition_streams(self, starts):
+        partitions = []
+        for start_time, stream_names in sorted(starts.items()):
+            for i in range(0, len(stream_names), self._MAX_STREAMS_PER_REQUEST):
+                partitions.append((start_time, tuple(stream_names[i:i + self._MAX_STREAMS_PER_REQUEST])))
+        return partitions
+
+    def _get_stream_partition_pages(self, cw_client, rate_limiter, log_group, partition, now):
+        start_time, stream_names = partition
+        params = {'logGroupName': log_group.path,
+                  'logStreamNames': list(stream_names),
+                  'startTime': start_time * 1000,
+                  'endTime': now * 1000}
+        self._add_filter_pattern(params, log_group)
+        while True:
+            resp = self._filter_log_events(cw_client, rate_limiter, params, now - start_time, log_group.metrics,
+                                           log_group.trace)
+            if len(resp[self._KEY_EVENTS]) > 0:
+                yield resp[self._KEY_EVENTS]
+            if self._KEY_NEXT_TOKEN not in resp:
+                return
+            params[self._KEY_NEXT_TOKEN] = resp[self._KEY_NEXT_TOKEN]
+
+    def _add_filter_pattern(self, params, log_group):
+        # events that do not match are not transferred at all
+        if log_group.filter_pattern:
+            params[self._KEY_FILTER_PATTERN] = log_group.filter_pattern
+
+    def _filter_log_events(self, cw_client, rate_limiter, params, lag, metrics=None, trace=None):
+        for attempt in range(self._MAX_THROTTLE_RETRIES + 1):
+            with self._span(trace, self.STAGE_RATE_LIMIT):
+                rate_limiter.acquire(priority=lag)
+            start = time.perf_counter()
+            try:
+                with self._span(trace, self.STAGE_FILTER_LOG_EVENTS):
+                    resp = cw_client.filter_log_events(**params)
+            except botocore.exceptions.ClientError as e:
+                if metrics is not None:
+                    metrics.cloudwatch_calls.inc()
+                    metrics.cloudwatch_latency.observe(time.perf_counter() - start)
+                if not self._is_throttling_error(e.response) or attempt == self._MAX_THROTTLE_RETRIES:
+                    raise
+                if metrics is not None:
+                    metrics.cloudwatch_throttles.inc()
+                logger.debug(f'Throttled while getting log events for {params["logGroupName"]}, retrying')
+                continue
+            rate_limiter.on_success()
+            if metrics is not None:
+                metrics.cloudwatch_calls.inc()
+                metrics.cloudwatch_latency.observe(time.perf_counter() - start)
+                # attempts botocore retried on its own, mostly throttled ones
+                metrics.cloudwatch_throttles.inc(resp.get('ResponseMetadata', {}).get('RetryAttempts', 0))
+            return resp
+
+    def _register_throttling_hook(self, cw_client, rate_limiter):
+        # botocore retries throttled calls on its own, every attempt has to slow the limiter down
+        cw_client.meta.events.register_first(
+            'needs-retry.logs.FilterLogEvents',
+            lambda response, **kwargs: self._on_filter_log_events_response(rate_limiter, response))
+
+    def _on_filter_log_events_response(self, rate_limiter, response):
+        if response is not None and self._is_throttling_error(response[1]):
+            rate_limiter.on_throttle()
+
+    def _is_throttling_error(self, parsed_response):
+        return parsed_response.get('Error', {}).get('Code') in self._THROTTLING_ERRORS
 
     def _get_additional_fields(self, log_group):
         additional_fields = {self.FIELD_LOG_GROUP: log_group.path,
                              self.FIELD_SHIPPER: self._SHIPPER,
                              self.FIELD_TYPE: self._DEFAULT_TYPE}
-        if self._account_id != '':
-            additional_fields[self.FIELD_OWNER] = self._account_id
+        account_id = self._account_ids.get(log_group.role_arn, '')
+        if account_id != '':
+            additional_fields[self.FIELD_OWNER] = account_id
         if log_group.custom_fields is not None and len(log_group.custom_fields) > 0:
             additional_fields.update(log_group.custom_fields)
         if log_group.namespace != '':
             additional_fields[self.FIELD_NAMESPACE] = log_group.namespace
         return additional_fields
 
-    def _process_events(self, events, additional_fields, logzio_shipper):
-        for event in events:
-            try:
-                # add additional fields
-                if additional_fields is not None and len(additional_fields) > 0:
-                    event.update(additional_fields)
-            except Exception as e:
-                logger.warning(f'Error while trying to add additional fields: {e}')
-            try:
-                # rename logStreamName -> logStream (to follow existing conventions for cw logs)
-                if 'logStreamName' in event:
-                    event[self.FIELD_LOG_STREAM] = event['logStreamName']
-                    del event['logStreamName']
-            except Exception as e:
-                logger.warning(f'Error while trying to rename logStreamName: {e}')
-            try:
-                # rename eventId -> id (to follow existing conventions for cw logs)
-                if 'eventId' in event:
-                    event[self.FIELD_ID] = event['eventId']
-                    del event['eventId']
-            except Exception as e:
-                logger.warning(f'Error while trying to rename eventId: {e}')
-            try:
-                if self.KEY_MESSAGE in event:
-                    # remove newline at the end of the message, if exists
-                    event[self.KEY_MESSAGE] = event[self.KEY_MESSAGE].rstrip('\n')
-                    log_level = self._get_log_level_from_message(str(event[self.KEY_MESSAGE]))
-                    if log_level != '':
-                        event[self.FIELD_LOG_LEVEL] = log_level
-            except Exception as e:
-                logger.warning(f'Error while trying to process message: {e}')
-            try:
-                if self._KEY_TIMESTAMP in event:
-                    event[self.FIELD_TIMESTAMP] = event[self._KEY_TIMESTAMP]
-                    del event[self._KEY_TIMESTAMP]
-            except Exception as e:
-                logger.warning(f'Error while trying to process timestamp: {e}')
-            log_str = json.dumps(event)
-            logzio_shipper.add_log_to_send(log_str)
+    def _process_events(self, events, deduplicator, transformer, event_filter, logzio_shipper, trace=None):
+        if deduplicator is not None:
+            with self._span(trace, self.STAGE_DEDUP):
+                events = deduplicator.filter_page(events)
+        with self._span(trace, self.STAGE_TRANSFORM):
+            events = transformer.transform_page(events)
+        if event_filter is not None:
+            # dropped logs are never serialized or compressed
+            with self._span(trace, self.STAGE_FILTER):
+                events = event_filter.filter_page(events)
+        logzio_shipper.add_logs_to_send(events)
 
-    def _get_log_level_from_message(self, message):
-        try:
-            start_level = message.index('[')
-            end_level = message.index(']')
-            log_level = message[start_level + 1:end_level].upper()
-            if log_level in self._LOG_LEVELS:
-                return log_level
-        except ValueError:
-            return ''
-        return ''
+    def _span(self, trace, stage):
+        return trace.span(stage) if trace is not None else contextlib.nullcontext()
 
-    def _save_latest_to_file(self, log_group):
-        self._lock.acquire()
-        self._position_manager.update_position_file(log_group)
-        self._lock.release()
+    def _save_latest_to_file(self, log_group, deduplicator=None):
+        with self._span(log_group.trace, self.STAGE_CHECKPOINT):
+            if self._dedup_persist and deduplicator is not None:
+                self._position_manager.update_position_file(log_group, deduplicator.export())
+            else:
+                self._position_manager.update_position_file(log_group)
 
-    def _load_data_from_position_file(self, log_group):
-        pos_yaml = self._position_manager.get_pos_file_yaml()
-        if pos_yaml is None:
+    def _load_data_from_position_file(self, log_group, reload=False):
+        position = self._position_manager.get_position(log_group.key, reload)
+        if position is None:
+            logger.info(f'Could not find data in position file for {log_group.key}')
             return
-        for lgp in pos_yaml:
-            if log_group.path == lgp[PositionManager.FIELD_PATH]:
-                logger.info(f'Found data in position file for {log_group.path}, latest time: {lgp[PositionManager.FIELD_LATEST_TIME]}')
-                log_group.next_token = lgp[PositionManager.FIELD_NEXT_TOKEN]
-                log_group.latest_time = lgp[PositionManager.FIELD_LATEST_TIME]
-                return
-        logger.info(f'Could not find data in position file for {log_group.path}')
+        logger.info(f'Found data in position file for {log_group.key}, latest time: {position[PositionManager.FIELD_LATEST_TIME]}')
+        log_group.next_token = position[PositionManager.FIELD_NEXT_TOKEN]
+        log_group.latest_time = position[PositionManager.FIELD_LATEST_TIME]
+        log_group.window_end = position.get(PositionManager.FIELD_WINDOW_END, 0)
 
     def __exit_gracefully(self):
         logger.info("Signal caught...")
 
-        self._event.set()
+        # running cycles are completed, log groups that are not running yet won't start
+        if self._scheduler is not None:
+            self._scheduler.stop()
+            logger.debug(f'Last lateness per log group: {self._scheduler.get_lateness()}')
 
-        for thread in self._threads:
-            thread.join()
+        if self._bulk_sender is not None:
+            self._bulk_sender.shutdown()
+        if self._spill_replayer is not None:
+            self._spill_replayer.stop()
+            self._spill_queue.close()
+        if self._metrics_server is not None:
+            self._metrics_server.stop()
+        self._position_manager.close()
+        if self._cluster is not None:
+            self._cluster.leave()
+        if self._logzio_session is not None:
+            self._logzio_session.close()
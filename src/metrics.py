@@ -0,0 +1,292 @@
+import abc
+import bisect
+import logging
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+
+class _Metric(abc.ABC):
+    _TYPE = None
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._children = {}  # label values -> child
+        if len(self.label_names) == 0:
+            self._children[()] = self._new_child()
+
+    def labels(self, *label_values):
+        # children are meant to be kept by the caller, so the hot path does not look them up
+        key = tuple(str(value) for value in label_values)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self._new_child()
+            return child
+
+    def remove(self, *label_values):
+        # the children whose first labels are label_values
+        prefix = tuple(str(value) for value in label_values)
+        with self._lock:
+            for key in [key for key in self._children if key[:len(prefix)] == prefix]:
+                del self._children[key]
+
+    def render(self, lines):
+        lines.append(f'# HELP {self.name} {self.documentation}')
+        lines.append(f'# TYPE {self.name} {self._TYPE}')
+        with self._lock:
+            children = list(self._children.items())
+        for label_values, child in children:
+            child.render(self.name, _format_labels(self.label_names, label_values), lines)
+
+    @abc.abstractmethod
+    def _new_child(self):
+        pass
+
+
+class _Value:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+    def render(self, name, labels, lines):
+        lines.append(f'{name}{_braces(labels)} {_format_value(self.value)}')
+
+
+class Counter(_Metric):
+    _TYPE = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+
+class Gauge(_Metric):
+    _TYPE = 'gauge'
+
+    def _new_child(self):
+        return _Value()
+
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self._lock = threading.Lock()
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self._sum = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def render(self, name, labels, lines):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative = 0
+        separator = ',' if labels else ''
+        for bound, count in zip(self._buckets + [float('inf')], counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else _format_value(bound)
+            lines.append(f'{name}_bucket{{{labels}{separator}le="{le}"}} {cumulative}')
+        lines.append(f'{name}_sum{_braces(labels)} {_format_value(total)}')
+        lines.append(f'{name}_count{_braces(labels)} {cumulative}')
+
+
+class Histogram(_Metric):
+    _TYPE = 'histogram'
+    DEFAULT_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+    def __init__(self, name, documentation, label_names=(), buckets=None):
+        self._buckets = sorted(buckets or self.DEFAULT_BUCKETS)
+        super().__init__(name, documentation, label_names)
+
+    def _new_child(self):
+        return _HistogramValue(self._buckets)
+
+
+class MetricsRegistry:
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, prefix=''):
+        self._prefix = prefix
+        self._metrics = []
+
+    def counter(self, name, documentation, label_names=()):
+        return self._register(Counter(self._prefix + name, documentation, label_names))
+
+    def gauge(self, name, documentation, label_names=()):
+        return self._register(Gauge(self._prefix + name, documentation, label_names))
+
+    def histogram(self, name, documentation, label_names=(), buckets=None):
+        return self._register(Histogram(self._prefix + name, documentation, label_names, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            metric.render(lines)
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+
+class FetcherMetrics:
+    _PREFIX = 'cloudwatch_fetcher_'
+    _LOG_GROUP = 'log_group'
+    _SIZE_BUCKETS = [1024, 16 * 1024, 128 * 1024, 512 * 1024, 1024 * 1024, 4 * 1024 * 1024, 10 * 1024 * 1024]
+    _RATIO_BUCKETS = [1, 2, 4, 6, 8, 10, 15, 20, 30]
+    _PAGE_BUCKETS = [0, 1, 2, 5, 10, 25, 50, 100, 250, 1000]
+
+    def __init__(self, registry=None):
+        self.registry = registry if registry is not None else MetricsRegistry(self._PREFIX)
+        log_group = (self._LOG_GROUP,)
+        self.events_fetched = self.registry.counter('events_fetched_total', 'Events read from Cloudwatch', log_group)
+        self.bytes_fetched = self.registry.counter('bytes_fetched_total',
+                                                   'Bytes of event messages read from Cloudwatch', log_group)
+        self.events_shipped = self.registry.counter('events_shipped_total',
+                                                    'Events sent or spilled to disk', log_group)
+        self.bytes_shipped = self.registry.counter('bytes_shipped_total',
+                                                   'Bytes of bulks sent or spilled to disk, before compression',
+                                                   log_group)
+        self.events_dropped = self.registry.counter('events_dropped_total', 'Events dropped by filter rules',
+                                                    log_group + ('reason',))
+        self.events_duplicated = self.registry.counter('events_duplicated_total',
+                                                       'Events skipped because they were already shipped', log_group)
+        self.events_unique = self.registry.counter('events_unique_total',
+                                                   'Events checked for duplicates that were not shipped before',
+                                                   log_group)
+        self.cloudwatch_calls = self.registry.counter('cloudwatch_calls_total', 'FilterLogEvents calls', log_group)
+        self.cloudwatch_throttles = self.registry.counter('cloudwatch_throttles_total',
+                                                          'FilterLogEvents calls that were throttled or retried',
+                                                          log_group)
+        self.cloudwatch_latency = self.registry.histogram('cloudwatch_call_seconds',
+                                                          'FilterLogEvents latency, rate limiter wait excluded',
+                                                          log_group)
+        self.pages_per_cycle = self.registry.histogram('pages_per_cycle', 'Cloudwatch pages with events per cycle',
+                                                       log_group, self._PAGE_BUCKETS)
+        self.ingestion_lag = self.registry.gauge('ingestion_lag_seconds', 'Now minus the newest event read',
+                                                 log_group)
+        self.bulk_size = self.registry.histogram('bulk_size_bytes', 'Bulk size before compression',
+                                                 buckets=self._SIZE_BUCKETS)
+        self.compression_ratio = self.registry.histogram('bulk_compression_ratio',
+                                                         'Bulk size before compression divided by its size after',
+                                                         buckets=self._RATIO_BUCKETS)
+        self.post_latency = self.registry.histogram('logzio_post_seconds', 'Logz.io listener POST latency, retries '
+                                                    'included')
+        self.post_retries = self.registry.counter('logzio_post_retries_total', 'Logz.io listener POST retries')
+        self.post_failures = self.registry.counter('logzio_post_failures_total',
+                                                   'Bulks that could not be sent once their retries were exhausted')
+        self.spill_queue_bytes = self.registry.gauge('spill_queue_bytes', 'Bytes of bulks waiting on disk')
+        self.stage_seconds = self.registry.counter('stage_seconds_total', 'Seconds spent in each stage of the cycles',
+                                                   log_group + ('stage',))
+
+    def for_log_group(self, key):
+        return LogGroupMetrics(self, key)
+
+    def remove_log_group(self, key):
+        for metric in [self.events_fetched, self.bytes_fetched, self.events_shipped, self.bytes_shipped,
+                       self.events_dropped, self.events_duplicated, self.events_unique, self.stage_seconds,
+                       self.cloudwatch_calls, self.cloudwatch_throttles,
+                       self.cloudwatch_latency, self.pages_per_cycle, self.ingestion_lag]:
+            metric.remove(key)
+
+
+class LogGroupMetrics:
+    def __init__(self, metrics, key):
+        # the children of one log group, bound once
+        self.key = key
+        self._metrics = metrics
+        self.events_fetched = metrics.events_fetched.labels(key)
+        self.bytes_fetched = metrics.bytes_fetched.labels(key)
+        self.events_shipped = metrics.events_shipped.labels(key)
+        self.bytes_shipped = metrics.bytes_shipped.labels(key)
+        self.events_duplicated = metrics.events_duplicated.labels(key)
+        self.events_unique = metrics.events_unique.labels(key)
+        self.cloudwatch_calls = metrics.cloudwatch_calls.labels(key)
+        self.cloudwatch_throttles = metrics.cloudwatch_throttles.labels(key)
+        self.cloudwatch_latency = metrics.cloudwatch_latency.labels(key)
+        self.pages_per_cycle = metrics.pages_per_cycle.labels(key)
+        self.ingestion_lag = metrics.ingestion_lag.labels(key)
+        self.bulk_size = metrics.bulk_size.labels()
+        self.compression_ratio = metrics.compression_ratio.labels()
+        self.post_latency = metrics.post_latency.labels()
+        self.post_retries = metrics.post_retries.labels()
+        self.post_failures = metrics.post_failures.labels()
+
+    def add_dropped(self, dropped):
+        for reason, count in dropped.items():
+            self._metrics.events_dropped.labels(self.key, reason).inc(count)
+
+    def add_stages(self, stages):
+        for stage, seconds in stages.items():
+            self._metrics.stage_seconds.labels(self.key, stage).inc(seconds)
+
+
+class MetricsServer:
+    PATH = '/metrics'
+
+    def __init__(self, registry, port, host=''):
+        handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_port
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics_server', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = None
+
+    def do_GET(self):
+        if self.path.split('?')[0] != MetricsServer.PATH:
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', MetricsRegistry.CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def _format_labels(names, values):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+def _braces(labels):
+    return f'{{{labels}}}' if labels else ''
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
@@ -0,0 +1,57 @@
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class PagePrefetcher:
+    _END = object()
+    _PUT_TIMEOUT_SECONDS = 0.5
+
+    def __init__(self, pages, depth, name='prefetch'):
+        self._pages = pages
+        self._queue = queue.Queue(maxsize=depth)
+        self._stop = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(target=self._produce, name=name, daemon=True)
+
+    def __iter__(self):
+        if self._thread.ident is None:
+            self._thread.start()
+        return self
+
+    def __next__(self):
+        item = self._queue.get()
+        if item is self._END:
+            self.close()
+            if self._error is not None:
+                raise self._error
+            raise StopIteration
+        return item
+
+    def close(self):
+        self._stop.set()
+        if self._thread.ident is not None:
+            self._thread.join()
+
+    def _produce(self):
+        try:
+            for page in self._pages:
+                if not self._put(page):
+                    logger.debug('Consumer stopped, dropping prefetched pages')
+                    return
+        except Exception as e:
+            self._error = e
+        finally:
+            self._put(self._END)
+
+    def _put(self, item):
+        # a full queue is the backpressure, wait until the consumer takes a page or stops
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=self._PUT_TIMEOUT_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
@@ -1,87 +1,140 @@
 import logging
 import os
-import yaml
+import threading
 
+from .checkpoint_store import CheckpointStore, SqliteCheckpointStore, YamlCheckpointStore
 from .log_group import LogGroup
 
 logger = logging.getLogger(__name__)
 
 
 class PositionManager:
-    FIELD_PATH = 'path'
-    FIELD_NEXT_TOKEN = 'next_token'
-    FIELD_LATEST_TIME = 'latest_time'
+    FIELD_PATH = CheckpointStore.FIELD_PATH
+    FIELD_NEXT_TOKEN = CheckpointStore.FIELD_NEXT_TOKEN
+    FIELD_LATEST_TIME = CheckpointStore.FIELD_LATEST_TIME
+    FIELD_WINDOW_END = CheckpointStore.FIELD_WINDOW_END
+    FIELD_SEEN_EVENT_IDS = CheckpointStore.FIELD_SEEN_EVENT_IDS
+    STORE_YAML = 'yaml'
+    STORE_SQLITE = 'sqlite'
+    _SQLITE_FILE_EXTENSION = '.db'
+    _MIGRATED_FILE_SUFFIX = '.migrated'
     _DEFAULT_RESET_POSITION_FILE = 'false'
     ENV_RESET_POSITION = 'RESET_POSITION_FILE'
+    ENV_POSITION_STORE = 'POSITION_STORE'
 
-    def __init__(self, file_path):
+    def __init__(self, file_path, store_type=None, shared=False):
         self._file_path = file_path
+        self._lock = threading.Lock()
+        # log group key -> position, loaded from the store on first use and kept in sync with it
+        self._positions = None
+        if store_type is None:
+            store_type = os.getenv(self.ENV_POSITION_STORE, self.STORE_YAML).lower()
+        if store_type == self.STORE_SQLITE:
+            # a store shared with other replicas is committed on every update, so its lock is never held for long
+            self._store = SqliteCheckpointStore(os.path.splitext(file_path)[0] + self._SQLITE_FILE_EXTENSION,
+                                                commit_batch_size=1 if shared else
+                                                SqliteCheckpointStore.DEFAULT_COMMIT_BATCH_SIZE)
+        else:
+            if store_type != self.STORE_YAML:
+                logger.warning(f'Unknown position store {store_type}, using {self.STORE_YAML}')
+            store_type = self.STORE_YAML
+            self._store = YamlCheckpointStore(file_path)
+        self.store_type = store_type
         reset_str = os.getenv(self.ENV_RESET_POSITION, self._DEFAULT_RESET_POSITION_FILE)
         if reset_str.lower() == 'true':
             self._delete_position_file()
+        if isinstance(self._store, SqliteCheckpointStore):
+            self._migrate_yaml_position_file()
 
-    def update_position_file(self, log_group):
-        pos_file_yaml = self.get_pos_file_yaml()
-        if pos_file_yaml is not None:
-            pos_file_yaml = self._update_position_yaml(pos_file_yaml, log_group)
-        else:
-            logger.warning('Could not open position file, will create new one')
-            self._create_new_position_file()
-            pos_file_yaml = []
-            pos_file_yaml = self._update_position_yaml(pos_file_yaml, log_group)
-        with open(self._file_path, 'w') as pos_file:
-            yaml.dump(pos_file_yaml, pos_file)
+    def update_position_file(self, log_group, seen_event_ids=None):
+        # the key is the path for the default region and credentials, so older position files still apply
+        position = {self.FIELD_PATH: log_group.key,
+                    self.FIELD_NEXT_TOKEN: log_group.next_token,
+                    self.FIELD_LATEST_TIME: log_group.latest_time}
+        if log_group.next_token != '':
+            position[self.FIELD_WINDOW_END] = log_group.window_end
+        if seen_event_ids is not None:
+            position[self.FIELD_SEEN_EVENT_IDS] = seen_event_ids
+        with self._lock:
+            positions = self._get_positions()
+            if log_group.key in positions:
+                logger.debug(f'Log group {log_group.key} exists in file, loading details')
+            positions[log_group.key] = position
+            self._store.upsert(position, lambda: list(positions.values()))
 
-    def get_pos_file_yaml(self):
-        pos_file_yaml = None
-        if os.path.exists(self._file_path):
-            with open(self._file_path, 'r') as pos_file:
-                pos_file_yaml = yaml.safe_load(pos_file)
-        return pos_file_yaml
-
-    def _update_position_yaml(self, pos_file_yaml, log_group):
-        for pos_log_group in pos_file_yaml:
-            if log_group.path == pos_log_group[self.FIELD_PATH]:
-                logger.debug(f'Log group {log_group.path} exists in file, loading details')
-                pos_log_group[self.FIELD_NEXT_TOKEN] = log_group.next_token
-                pos_log_group[self.FIELD_LATEST_TIME] = log_group.latest_time
-                return pos_file_yaml
-        pos_file_yaml.append({self.FIELD_PATH: log_group.path,
-                              self.FIELD_NEXT_TOKEN: log_group.next_token,
-                              self.FIELD_LATEST_TIME: log_group.latest_time})
-        return pos_file_yaml
-
-    def _create_new_position_file(self, log_groups=None):
-        with open(self._file_path, 'w') as pos_file:
-            if log_groups is not None:
-                yaml.dump(log_groups, pos_file)
+    def get_position(self, path, reload=False):
+        with self._lock:
+            if reload:
+                # another replica may have updated it since it was loaded
+                position = self._store.get(path)
+                positions = self._get_positions()
+                if position is not None:
+                    positions[path] = position
+                else:
+                    positions.pop(path, None)
             else:
-                logger.info(f'Created position file at: {self._file_path}')
+                position = self._get_positions().get(path)
+            return dict(position) if position is not None else None
+
+    def get_pos_file_yaml(self):
+        with self._lock:
+            return self._store.load()
 
     def sync_position_file(self, log_groups_config):
-        current_log_groups = []
-        pos_yaml = self.get_pos_file_yaml()
-        if pos_yaml is not None:
-            for log_group in pos_yaml:
-                for lg_config in log_groups_config:
-                    if log_group[self.FIELD_PATH] == lg_config.path:
-                        logger.info(f'Found previous data for log group {lg_config.path}')
-                        current_log_groups.append(log_group)
-                        break
-            if len(current_log_groups) < len(pos_yaml):
+        with self._lock:
+            positions = self._get_positions()
+            config_paths = set(lg_config.key for lg_config in log_groups_config)
+            removed_paths = [path for path in positions if path not in config_paths]
+            logger.info(f'Found previous data for {len(positions) - len(removed_paths)} log groups')
+            if len(removed_paths) > 0:
                 # Some log groups were removed, we need to remove them from the position file
                 logger.debug(
-                    f'Position file has {len(pos_yaml)} log groups, but only {len(current_log_groups)} match the current '
-                    f'configuration')
+                    f'Position file has {len(positions)} log groups, but only {len(positions) - len(removed_paths)} '
+                    f'match the current configuration')
                 logger.debug('Updating position file')
-                self._create_new_position_file(current_log_groups)
+                self._remove_positions(removed_paths)
+
+    def remove_positions(self, paths):
+        with self._lock:
+            self._remove_positions([path for path in paths if path in self._get_positions()])
+
+    def _remove_positions(self, paths):
+        if len(paths) == 0:
+            return
+        positions = self._get_positions()
+        for path in paths:
+            del positions[path]
+        self._store.remove(paths, lambda: list(positions.values()))
+
+    def _get_positions(self):
+        if self._positions is None:
+            self._positions = {pos[self.FIELD_PATH]: pos for pos in self._store.load() or []}
+            logger.debug(f'Loaded {len(self._positions)} positions from {self._store.file_path}')
+        return self._positions
+
+    def flush(self):
+        with self._lock:
+            self._store.flush()
+
+    def close(self):
+        with self._lock:
+            self._store.close()
+
+    def _migrate_yaml_position_file(self):
+        yaml_store = YamlCheckpointStore(self._file_path)
+        if self._store.exists() or not yaml_store.exists():
+            return
+        positions = yaml_store.load() or []
+        self._store.upsert_many(positions)
+        os.replace(self._file_path, self._file_path + self._MIGRATED_FILE_SUFFIX)
+        logger.info(f'Migrated {len(positions)} positions from {self._file_path} to {self._store.file_path}')
 
     def _delete_position_file(self):
         try:
-            if os.path.exists(self._file_path):
-                os.remove(self._file_path)
+            if self._store.exists():
+                self._store.delete()
                 logger.info('Deleted current position file')
             else:
-                logger.warning(f'Env var {self.ENV_RESET_POSITION} is set to true, but no position file exists on {self._file_path}')
+                logger.warning(f'Env var {self.ENV_RESET_POSITION} is set to true, but no position file exists on {self._store.file_path}')
         except Exception as e:
-            logger.error(f'Something went wrong while trying to delete current position file at {self._file_path}: {e}')
+            logger.error(f'Something went wrong while trying to delete current position file at {self._store.file_path}: {e}')
@@ -0,0 +1,62 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveRateLimiter:
+    DEFAULT_REQUESTS_PER_SECOND = 10
+    MIN_REQUESTS_PER_SECOND = 0.5
+    _DECREASE_FACTOR = 0.5
+    _INCREASE_PER_SECOND = 0.5  # requests per second gained back for each second without throttling
+
+    def __init__(self, max_rate=DEFAULT_REQUESTS_PER_SECOND, min_rate=MIN_REQUESTS_PER_SECOND):
+        self._max_rate = float(max_rate)
+        self._min_rate = min(float(min_rate), self._max_rate)
+        self._rate = self._max_rate
+        self._tokens = 1.0
+        self._last_refill = time.monotonic()
+        self._condition = threading.Condition()
+        self._waiters = []  # heap of (-priority, seq)
+        self._seq = itertools.count()
+
+    @property
+    def rate(self):
+        with self._condition:
+            return self._rate
+
+    def acquire(self, priority=0):
+        # callers with a higher priority (e.g. log groups that are further behind) are served first
+        with self._condition:
+            waiter = (-priority, next(self._seq))
+            heapq.heappush(self._waiters, waiter)
+            while True:
+                self._refill()
+                if self._waiters[0] == waiter and self._tokens >= 1:
+                    heapq.heappop(self._waiters)
+                    self._tokens -= 1
+                    self._condition.notify_all()
+                    return
+                self._condition.wait((1 - self._tokens) / self._rate if self._tokens < 1 else None)
+
+    def on_success(self):
+        with self._condition:
+            if self._rate < self._max_rate:
+                # additive increase, spread over the requests of a second
+                self._rate = min(self._max_rate, self._rate + self._INCREASE_PER_SECOND / self._rate)
+
+    def on_throttle(self):
+        with self._condition:
+            # multiplicative decrease, and the current burst is dropped
+            self._rate = max(self._min_rate, self._rate * self._DECREASE_FACTOR)
+            self._tokens = min(self._tokens, 0.0)
+            logger.warning(f'Throttled by AWS, lowering Cloudwatch requests rate to {self._rate:.2f} per second')
+
+    def _refill(self):
+        now = time.monotonic()
+        # at most one second of burst
+        self._tokens = min(max(self._rate, 1.0), self._tokens + (now - self._last_refill) * self._rate)
+        self._last_refill = now
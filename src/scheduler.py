@@ -0,0 +1,94 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Scheduler:
+    DEFAULT_LATENESS_WARNING_SECONDS = 60
+
+    def __init__(self, workers, lateness_warning_seconds=DEFAULT_LATENESS_WARNING_SECONDS):
+        self._lateness_warning_seconds = lateness_warning_seconds
+        self._condition = threading.Condition()
+        self._queue = []  # heap of (due, seq, key)
+        self._jobs = {}  # key -> [job, interval seconds, seq of its queue entry]
+        self._running = set()
+        self._lateness = {}  # key -> seconds the last run started after it was due
+        self._seq = itertools.count()
+        self._stopped = False
+        self._workers = [threading.Thread(target=self._work, name=f'worker_{i}') for i in range(workers)]
+
+    def add(self, key, job, interval_seconds, delay_seconds=0):
+        with self._condition:
+            self._jobs[key] = [job, interval_seconds, None]
+            # a running key is queued again by its worker once the run is over
+            if key not in self._running:
+                self._schedule(key, time.monotonic() + delay_seconds)
+
+    def remove(self, key):
+        # the queue entry is dropped lazily once it is due
+        with self._condition:
+            self._jobs.pop(key, None)
+            self._lateness.pop(key, None)
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        for worker in self._workers:
+            if worker.ident is not None:
+                worker.join()
+
+    def get_lateness(self):
+        with self._condition:
+            return dict(self._lateness)
+
+    def _work(self):
+        while True:
+            with self._condition:
+                key, due = self._next_due_key()
+                if key is None:
+                    return
+                job = self._jobs[key][0]
+                lateness = time.monotonic() - due
+                self._lateness[key] = lateness
+                self._running.add(key)
+            if lateness > self._lateness_warning_seconds:
+                logger.warning(f'{key} started {int(lateness)} seconds late, consider adding workers')
+            try:
+                job()
+            except Exception as e:
+                logger.error(f'Unexpected error while running {key}: {e}')
+            with self._condition:
+                self._running.discard(key)
+                # runs of the same key never overlap, the next one is due an interval after this one finished
+                if not self._stopped and key in self._jobs:
+                    self._schedule(key, time.monotonic() + self._jobs[key][1])
+
+    def _next_due_key(self):
+        while not self._stopped:
+            if len(self._queue) == 0:
+                self._condition.wait()
+                continue
+            due, seq, key = self._queue[0]
+            delay = due - time.monotonic()
+            if delay > 0:
+                self._condition.wait(delay)
+                continue
+            heapq.heappop(self._queue)
+            if key in self._jobs and self._jobs[key][2] == seq:
+                return key, due
+        return None, None
+
+    def _schedule(self, key, due):
+        seq = next(self._seq)
+        self._jobs[key][2] = seq
+        heapq.heappush(self._queue, (due, seq, key))
+        self._condition.notify()
@@ -0,0 +1,226 @@
+import logging
+import os
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class SpillQueue:
+    DEFAULT_MAX_BYTES = 1024 * 1024 * 1024  # 1 GB
+    DEFAULT_MAX_AGE_SECONDS = 24 * 60 * 60
+    DEFAULT_SEGMENT_BYTES = 64 * 1024 * 1024  # 64 MB
+    # compressed size, raw size, spill time
+    _HEADER = struct.Struct('>IId')
+    _SEGMENT_PREFIX = 'spill-'
+    _SEGMENT_SUFFIX = '.seg'
+    _OFFSET_FILE = 'replay.offset'
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES, max_age_seconds=DEFAULT_MAX_AGE_SECONDS,
+                 segment_bytes=DEFAULT_SEGMENT_BYTES, clock=time.time):
+        # sealed bulks, already compressed, appended to segment files and replayed oldest first
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._max_age_seconds = max_age_seconds
+        self._segment_bytes = segment_bytes
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._listener_healthy = True
+        os.makedirs(directory, exist_ok=True)
+        self._segments = self._list_segments()  # oldest first
+        self._sizes = {segment: os.path.getsize(self._get_path(segment)) for segment in self._segments}
+        self._read_offset = self._load_read_offset()
+        self._writer = None
+        # segments of a previous run are never appended to, a torn last record stays at their end
+        self._next_segment = self._segments[-1] + 1 if len(self._segments) > 0 else 0
+
+    def __len__(self):
+        with self._lock:
+            return self._get_bytes()
+
+    def should_spill(self):
+        # while the listener is down new bulks go to the queue directly, instead of waiting for their retries
+        return not self._listener_healthy
+
+    def put(self, data, raw_size):
+        record_size = self._HEADER.size + len(data)
+        with self._lock:
+            if self._get_bytes() + record_size > self._max_bytes:
+                return False
+            if self._writer is None or self._sizes[self._segments[-1]] + record_size > self._segment_bytes:
+                self._open_segment()
+            self._writer.write(self._HEADER.pack(len(data), raw_size, self._clock()))
+            self._writer.write(data)
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+            self._sizes[self._segments[-1]] += record_size
+            self._listener_healthy = False
+            self._not_empty.notify_all()
+        return True
+
+    def peek(self, timeout=None):
+        # the oldest bulk that did not expire as (data, raw size), None when the queue stays empty
+        with self._lock:
+            while True:
+                if len(self._segments) == 0 or not self._has_unread():
+                    if not self._not_empty.wait(timeout):
+                        return None
+                    continue
+                record = self._read_record()
+                if record is None:
+                    self._remove_segment()
+                    continue
+                data, raw_size, spilled_at = record
+                if self._clock() - spilled_at > self._max_age_seconds:
+                    logger.warning(f'Dropping a spilled bulk of {raw_size} bytes, it is older than '
+                                   f'{self._max_age_seconds} seconds')
+                    self._advance(self._HEADER.size + len(data))
+                    continue
+                return data, raw_size
+
+    def ack(self, data):
+        # the bulk returned by peek was sent, so the listener is up again and new bulks are sent directly
+        with self._lock:
+            self._advance(self._HEADER.size + len(data))
+            self._listener_healthy = True
+
+    def mark_unhealthy(self):
+        self._listener_healthy = False
+
+    def close(self):
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    def _get_bytes(self):
+        return sum(self._sizes.values()) - self._read_offset
+
+    def _has_unread(self):
+        return len(self._segments) > 1 or (len(self._segments) == 1 and
+                                           self._read_offset < self._sizes[self._segments[0]])
+
+    def _read_record(self):
+        # streamed, only one bulk is held in memory
+        segment = self._segments[0]
+        with open(self._get_path(segment), 'rb') as segment_file:
+            segment_file.seek(self._read_offset)
+            header = segment_file.read(self._HEADER.size)
+            if len(header) < self._HEADER.size:
+                return self._end_of_segment(segment, header)
+            size, raw_size, spilled_at = self._HEADER.unpack(header)
+            data = segment_file.read(size)
+        if len(data) < size:
+            return self._end_of_segment(segment, data)
+        return data, raw_size, spilled_at
+
+    def _end_of_segment(self, segment, partial):
+        if len(partial) > 0:
+            logger.warning(f'Skipping a partially written bulk at the end of spill segment {segment}')
+        return None
+
+    def _advance(self, record_size):
+        self._read_offset += record_size
+        if self._read_offset >= self._sizes[self._segments[0]] and len(self._segments) > 1:
+            self._remove_segment()
+        else:
+            self._save_read_offset()
+
+    def _remove_segment(self):
+        segment = self._segments.pop(0)
+        if self._writer is not None and len(self._segments) == 0:
+            self._writer.close()
+            self._writer = None
+        del self._sizes[segment]
+        os.remove(self._get_path(segment))
+        self._read_offset = 0
+        self._save_read_offset()
+
+    def _open_segment(self):
+        if self._writer is not None:
+            self._writer.close()
+        segment = self._next_segment
+        self._next_segment += 1
+        self._writer = open(self._get_path(segment), 'ab')
+        self._segments.append(segment)
+        self._sizes[segment] = 0
+
+    def _list_segments(self):
+        segments = []
+        for name in os.listdir(self._directory):
+            if name.startswith(self._SEGMENT_PREFIX) and name.endswith(self._SEGMENT_SUFFIX):
+                segments.append(int(name[len(self._SEGMENT_PREFIX):-len(self._SEGMENT_SUFFIX)]))
+        return sorted(segments)
+
+    def _get_path(self, segment):
+        return os.path.join(self._directory, f'{self._SEGMENT_PREFIX}{segment:012d}{self._SEGMENT_SUFFIX}')
+
+    def _load_read_offset(self):
+        # offset in the oldest segment, so a restart does not replay the bulks that were already sent
+        try:
+            with open(os.path.join(self._directory, self._OFFSET_FILE), 'r') as offset_file:
+                offset = int(offset_file.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+        if len(self._segments) == 0 or offset > self._sizes[self._segments[0]]:
+            return 0
+        return offset
+
+    def _save_read_offset(self):
+        path = os.path.join(self._directory, self._OFFSET_FILE)
+        with open(path + '.tmp', 'w') as offset_file:
+            offset_file.write(str(self._read_offset))
+        os.replace(path + '.tmp', path)
+
+
+class SpillReplayer:
+    DEFAULT_BULKS_PER_SECOND = 2
+    MAX_BACKOFF_SECONDS = 60
+
+    def __init__(self, spill_queue, send, bulks_per_second=DEFAULT_BULKS_PER_SECOND):
+        # send(data, raw size) raises when the bulk could not be sent
+        self._spill_queue = spill_queue
+        self._send = send
+        self._interval = 1.0 / bulks_per_second
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='spill_replayer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def replay_once(self, timeout=None):
+        # True when a bulk was sent
+        bulk = self._spill_queue.peek(timeout)
+        if bulk is None:
+            return False
+        data, raw_size = bulk
+        try:
+            self._send(data, raw_size)
+        except Exception:
+            self._spill_queue.mark_unhealthy()
+            raise
+        self._spill_queue.ack(data)
+        return True
+
+    def _run(self):
+        backoff = self._interval
+        while not self._stop_event.is_set():
+            try:
+                replayed = self.replay_once(timeout=1)
+                backoff = self._interval
+            except Exception as e:
+                logger.warning(f'Could not replay a spilled bulk, retrying in {backoff} seconds: {e}')
+                self._stop_event.wait(backoff)
+                backoff = min(backoff * 2, self.MAX_BACKOFF_SECONDS)
+                continue
+            if replayed:
+                # the listener is not flooded with the backlog when it recovers
+                self._stop_event.wait(self._interval)
@@ -0,0 +1,74 @@
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class StreamPartitionFetcher:
+    _DONE = object()
+    _PUT_TIMEOUT_SECONDS = 0.5
+
+    def __init__(self, get_pages, partitions, concurrency, depth, on_partition_done=None, name='streams'):
+        self._get_pages = get_pages
+        self._partitions = queue.Queue()
+        for partition in partitions:
+            self._partitions.put(partition)
+        self._partitions_count = len(partitions)
+        self._on_partition_done = on_partition_done
+        self._pages = queue.Queue(maxsize=max(depth, 1) * concurrency)
+        self._stop = threading.Event()
+        self._workers = [threading.Thread(target=self._fetch_partitions, name=f'{name}_{i}', daemon=True)
+                         for i in range(min(concurrency, len(partitions)))]
+
+    def __iter__(self):
+        for worker in self._workers:
+            worker.start()
+        error = None
+        done = 0
+        # pages of different partitions are interleaved, each partition keeps its own order
+        while done < self._partitions_count:
+            partition, item = self._pages.get()
+            if item is self._DONE:
+                done += 1
+                if self._on_partition_done is not None:
+                    self._on_partition_done(partition)
+            elif isinstance(item, Exception):
+                done += 1
+                logger.error(f'Error while fetching streams partition: {item}')
+                if error is None:
+                    error = item
+            else:
+                yield item
+        self.close()
+        if error is not None:
+            raise error
+
+    def close(self):
+        self._stop.set()
+        for worker in self._workers:
+            if worker.ident is not None:
+                worker.join()
+
+    def _fetch_partitions(self):
+        while not self._stop.is_set():
+            try:
+                partition = self._partitions.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                for page in self._get_pages(partition):
+                    if not self._put(partition, page):
+                        return
+                self._put(partition, self._DONE)
+            except Exception as e:
+                self._put(partition, e)
+
+    def _put(self, partition, item):
+        while not self._stop.is_set():
+            try:
+                self._pages.put((partition, item), timeout=self._PUT_TIMEOUT_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
@@ -0,0 +1,132 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+
+class CycleTrace:
+    # stages of one cycle of a log group -> seconds spent in them. A span nested in another one is
+    # not counted in its parent, stages of bulks sent in the background overlap the others
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._started = time.perf_counter()
+
+    def span(self, stage):
+        return _Span(self, stage)
+
+    def get_elapsed(self):
+        return time.perf_counter() - self._started
+
+    def format(self):
+        return ', '.join(f'{stage}: {seconds:.3f}s'
+                         for stage, seconds in sorted(self.stages.items(), key=lambda item: item[1], reverse=True))
+
+    def _get_stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _add(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0) + seconds
+
+
+class _Span:
+    __slots__ = ['_trace', '_stage', '_stack', '_start']
+
+    def __init__(self, trace, stage):
+        self._trace = trace
+        self._stage = stage
+
+    def __enter__(self):
+        self._stack = self._trace._get_stack()
+        self._stack.append(0.0)  # seconds of the spans nested in this one
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.perf_counter() - self._start
+        nested = self._stack.pop()
+        if len(self._stack) > 0:
+            self._stack[-1] += elapsed
+        self._trace._add(self._stage, elapsed - nested)
+        return False
+
+
+class CycleProfiler:
+    DEFAULT_CYCLES = 3
+    _TOP_FUNCTIONS = 40
+    _TOP_ALLOCATIONS = 25
+
+    def __init__(self, output_dir, cycles=0):
+        # cProfile and tracemalloc are process wide in effect, so one cycle is profiled at a time
+        self._output_dir = output_dir
+        self._remaining = cycles
+        self._lock = threading.Lock()
+        self._running = False
+
+    def request(self, cycles=DEFAULT_CYCLES):
+        with self._lock:
+            self._remaining = cycles
+        logger.info(f'Profiling the next {cycles} cycles into {self._output_dir}')
+
+    def run(self, name, cycle):
+        if self._remaining == 0 or not self._acquire():
+            return cycle()
+        try:
+            return self._profile(name, cycle)
+        finally:
+            with self._lock:
+                self._running = False
+
+    def _acquire(self):
+        with self._lock:
+            if self._running or self._remaining == 0:
+                return False
+            self._running = True
+            self._remaining -= 1
+            return True
+
+    def _profile(self, name, cycle):
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return cycle()
+        finally:
+            profile.disable()
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            if not tracing:
+                tracemalloc.stop()
+            try:
+                self._write_report(name, profile, snapshot, peak)
+            except Exception as e:
+                logger.error(f'Could not write the profile of {name}: {e}')
+
+    def _write_report(self, name, profile, snapshot, peak):
+        os.makedirs(self._output_dir, exist_ok=True)
+        base = os.path.join(self._output_dir, f'{time.strftime("%Y%m%d-%H%M%S")}-{re.sub(r"[^A-Za-z0-9_.-]+", "_", name)}')
+        # the .prof file opens with pstats or snakeviz
+        profile.dump_stats(base + '.prof')
+        report = io.StringIO()
+        report.write(f'Cycle of {name}, peak traced memory {peak} bytes\n\n')
+        pstats.Stats(profile, stream=report).sort_stats('cumulative').print_stats(self._TOP_FUNCTIONS)
+        report.write('Allocations still held at the end of the cycle, by line\n')
+        for stat in snapshot.statistics('lineno')[:self._TOP_ALLOCATIONS]:
+            report.write(f'{stat}\n')
+        with open(base + '.txt', 'w') as report_file:
+            report_file.write(report.getvalue())
+        logger.info(f'Wrote the profile of {name} to {base}.txt')
@@ -0,0 +1,58 @@
+import threading
+import unittest
+
+import botocore.exceptions
+
+from src.aws_client_factory import AwsClientFactory
+
+
+class AwsClientFactoryTests(unittest.TestCase):
+    def setUp(self):
+        self.factory = AwsClientFactory(max_pool_connections=20)
+
+    def test_client_reused(self):
+        client = self.factory.get_client('logs', 'us-east-1')
+        self.assertIs(client, self.factory.get_client('logs', 'us-east-1'))
+        self.assertIsNot(client, self.factory.get_client('logs', 'eu-west-1'))
+        self.assertEqual(20, client.meta.config.max_pool_connections)
+
+    def test_client_created_once_across_threads(self):
+        clients = []
+        threads = [threading.Thread(target=lambda: clients.append(self.factory.get_client('logs', 'us-east-1')))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, len(set(id(client) for client in clients)))
+
+    def test_invalidate(self):
+        client = self.factory.get_client('logs', 'us-east-1')
+        self.factory.invalidate('logs', 'us-east-1')
+        self.assertIsNot(client, self.factory.get_client('logs', 'us-east-1'))
+
+    def test_get_client_with_role(self):
+        role_arn = 'arn:aws:iam::123456789012:role/logzio-fetcher'
+        client = self.factory.get_client('logs', 'us-east-1', role_arn)
+        self.assertIs(client, self.factory.get_client('logs', 'us-east-1', role_arn))
+        self.assertIsNot(client, self.factory.get_client('logs', 'us-east-1'))
+        self.factory.get_client('logs', 'eu-west-1', role_arn)
+        # the role is assumed once for all regions, on the first call
+        self.assertEqual([role_arn], list(self.factory._role_credentials))
+
+    def test_is_expired_credentials_error(self):
+        expired = botocore.exceptions.ClientError({'Error': {'Code': 'ExpiredTokenException'}}, 'FilterLogEvents')
+        throttled = botocore.exceptions.ClientError({'Error': {'Code': 'ThrottlingException'}}, 'FilterLogEvents')
+        self.assertTrue(self.factory.is_expired_credentials_error(expired))
+        self.assertFalse(self.factory.is_expired_credentials_error(throttled))
+        self.assertFalse(self.factory.is_expired_credentials_error(ValueError()))
+
+    def test_role_clients_share_the_role_credentials(self):
+        role_arn = 'arn:aws:iam::123456789012:role/logzio-fetcher'
+        self.factory.get_client('logs', 'us-east-1', role_arn)
+        credentials = self.factory._role_credentials[role_arn]
+        self.assertIs(credentials, self.factory._get_session('eu-west-1', role_arn).get_credentials())
+
+
+if __name__ == '__main__':
+    unittest.main()
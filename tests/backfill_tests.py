@@ -0,0 +1,63 @@
+import threading
+import time
+import unittest
+
+from src.backfill import TimeSlicedFetcher
+
+
+class TimeSlicedFetcherTests(unittest.TestCase):
+    def test_slices_cover_window(self):
+        fetcher = TimeSlicedFetcher(None, 1000, 4500, 1000, 2, 1)
+        self.assertEqual([(1000, 2000), (2000, 3000), (3000, 4000), (4000, 4500)], fetcher.slices)
+
+    def test_slices_shipped_in_order(self):
+        def get_pages(start, end):
+            # later slices answer faster, the order must still follow the window
+            time.sleep((5000 - start) / 100000)
+            for i in range(3):
+                yield [(start, i)]
+
+        fetcher = TimeSlicedFetcher(get_pages, 1000, 5000, 1000, 3, 1)
+        shipped = []
+        ends = []
+        for end, pages in fetcher:
+            ends.append(end)
+            for page in pages:
+                shipped.extend(page)
+        self.assertEqual([2000, 3000, 4000, 5000], ends)
+        self.assertEqual([(start, i) for start in range(1000, 5000, 1000) for i in range(3)], shipped)
+
+    def test_concurrency_per_group(self):
+        lock = threading.Lock()
+        running = [0]
+        max_running = [0]
+
+        def get_pages(start, end):
+            with lock:
+                running[0] += 1
+                max_running[0] = max(max_running[0], running[0])
+            time.sleep(0.02)
+            yield [start]
+            with lock:
+                running[0] -= 1
+
+        for end, pages in TimeSlicedFetcher(get_pages, 0, 8000, 1000, 2, 1):
+            list(pages)
+        self.assertLessEqual(max_running[0], 2)
+
+    def test_slice_error_stops_backfill(self):
+        def get_pages(start, end):
+            if start == 2000:
+                raise ValueError('throttled')
+            yield [start]
+
+        ends = []
+        with self.assertRaises(ValueError):
+            for end, pages in TimeSlicedFetcher(get_pages, 1000, 4000, 1000, 2, 1):
+                list(pages)
+                ends.append(end)
+        self.assertEqual([2000], ends)
+
+
+if __name__ == '__main__':
+    unittest.main()
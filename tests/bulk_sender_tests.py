@@ -0,0 +1,43 @@
+import threading
+import time
+import unittest
+
+from src.bulk_sender import BulkSender
+
+
+class BulkSenderTests(unittest.TestCase):
+    def test_in_flight_bounded(self):
+        sender = BulkSender(2)
+        lock = threading.Lock()
+        in_flight = [0]
+        max_in_flight = [0]
+
+        def send(bulk):
+            with lock:
+                in_flight[0] += 1
+                max_in_flight[0] = max(max_in_flight[0], in_flight[0])
+            time.sleep(0.05)
+            with lock:
+                in_flight[0] -= 1
+            return bulk
+
+        futures = [sender.submit(send, i) for i in range(6)]
+        self.assertEqual(list(range(6)), [future.result() for future in futures])
+        self.assertEqual(2, max_in_flight[0])
+        sender.shutdown()
+
+    def test_send_error_kept_in_future(self):
+        sender = BulkSender(1)
+
+        def send():
+            raise ValueError('listener is down')
+
+        future = sender.submit(send)
+        self.assertIsInstance(future.exception(), ValueError)
+        # the slot of a failed bulk is released
+        self.assertTrue(sender.submit(lambda: True).result())
+        sender.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from src.checkpoint_store import CheckpointStore, SqliteCheckpointStore, YamlCheckpointStore
+
+
+class CheckpointStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _position(self, path, latest_time):
+        return {'path': path, 'next_token': '', 'latest_time': latest_time}
+
+    def test_yaml_store_write_replaces_file(self):
+        store = YamlCheckpointStore(os.path.join(self.tmp_dir.name, 'position.yaml'))
+        self.assertIsNone(store.load())
+        positions = [self._position('first', 1), self._position('second', 2)]
+        store.upsert(positions[1], lambda: positions)
+        self.assertEqual(positions, store.load())
+        store.remove(['first'], lambda: positions[1:])
+        self.assertEqual(positions[1:], store.load())
+        self.assertEqual(['position.yaml'], os.listdir(self.tmp_dir.name))
+
+    def test_sqlite_store_group_commit(self):
+        db_path = os.path.join(self.tmp_dir.name, 'position.db')
+        store = SqliteCheckpointStore(db_path, commit_interval_seconds=0.1, commit_batch_size=3)
+        store.upsert(self._position('first', 1))
+        store.upsert(self._position('second', 2))
+        reader = SqliteCheckpointStore(db_path)
+        # not committed yet, neither the batch size nor the interval were reached
+        self.assertEqual([], reader.load())
+        store.upsert(self._position('third', 3))
+        self.assertEqual(3, len(reader.load()))
+        store.upsert(self._position('first', 4))
+        time.sleep(0.3)
+        self.assertEqual(self._position('first', 4), reader.load()[0])
+        reader.close()
+        store.close()
+
+    def test_sqlite_store_delete(self):
+        db_path = os.path.join(self.tmp_dir.name, 'position.db')
+        store = SqliteCheckpointStore(db_path)
+        store.upsert(self._position('first', 1))
+        store.flush()
+        self.assertTrue(store.exists())
+        store.delete()
+        self.assertEqual([], os.listdir(self.tmp_dir.name))
+
+    def test_sqlite_store_seen_event_ids(self):
+        db_path = os.path.join(self.tmp_dir.name, 'position.db')
+        # a table of an older version, without the seen event ids column
+        connection = sqlite3.connect(db_path)
+        connection.execute('CREATE TABLE positions (path TEXT PRIMARY KEY, next_token TEXT, latest_time INTEGER)')
+        connection.execute("INSERT INTO positions VALUES ('first', '', 1)")
+        connection.commit()
+        connection.close()
+        store = SqliteCheckpointStore(db_path)
+        self.assertEqual(self._position('first', 1), store.get('first'))
+        position = self._position('second', 2)
+        position['next_token'] = 'token-1'
+        position['window_end'] = 1681390974
+        position['seen_event_ids'] = {'1681389974': ['0123', '0124']}
+        store.upsert(position)
+        self.assertEqual(position, store.get('second'))
+        self.assertEqual([self._position('first', 1), position], store.load())
+        store.close()
+
+
+    def test_sqlite_store_does_not_build_all_positions(self):
+        store = SqliteCheckpointStore(os.path.join(self.tmp_dir.name, 'position.db'))
+        store.upsert(self._position('first', 1), lambda: self.fail('all positions were built'))
+        store.remove(['first'], lambda: self.fail('all positions were built'))
+        self.assertEqual([], store.load())
+        store.close()
+
+    def test_incomplete_store_is_not_instantiated(self):
+        class ReadOnlyStore(CheckpointStore):
+            def exists(self):
+                return True
+
+            def load(self):
+                return []
+
+        with self.assertRaises(TypeError):
+            ReadOnlyStore()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import tempfile
+import unittest
+
+from src.cluster import ClusterMember, HashRing
+from src.lease_store import LeaseStore, SqliteLeaseStore
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1681389974.0
+
+    def __call__(self):
+        return self.now
+
+
+class ClusterTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.lease_path = os.path.join(self.tmp_dir.name, 'leases.db')
+        self.clock = FakeClock()
+        self.keys = [f'/aws/lambda/function-{i}' for i in range(300)]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _member(self, replica_id):
+        # each replica has its own connection to the shared file
+        return ClusterMember(SqliteLeaseStore(self.lease_path), replica_id, lease_seconds=600,
+                             heartbeat_seconds=30, clock=self.clock)
+
+    def test_hash_ring_moves_only_the_share_of_a_new_node(self):
+        ring = HashRing(['a', 'b', 'c'])
+        owners = {key: ring.get_node(key) for key in self.keys}
+        for node in ['a', 'b', 'c']:
+            self.assertGreater(list(owners.values()).count(node), 50)
+        grown_ring = HashRing(['a', 'b', 'c', 'd'])
+        moved = [key for key in self.keys if grown_ring.get_node(key) != owners[key]]
+        self.assertTrue(all(grown_ring.get_node(key) == 'd' for key in moved))
+        self.assertIsNone(HashRing([]).get_node('key'))
+
+    def test_each_key_has_one_owner(self):
+        members = [self._member('replica-a'), self._member('replica-b')]
+        for member in members + members:
+            member.heartbeat()
+        for key in self.keys[:20]:
+            owners = [member for member in members if member.is_assigned(key) and member.acquire(key)]
+            self.assertEqual(1, len(owners))
+            # the other replica can not take a lease that is held
+            other = members[1] if owners[0] is members[0] else members[0]
+            self.assertFalse(other.acquire(key))
+
+    def test_dead_replica_is_rebalanced(self):
+        alive, dead = self._member('replica-a'), self._member('replica-b')
+        dead.heartbeat()
+        alive.heartbeat()
+        key = next(key for key in self.keys if not alive.is_assigned(key))
+        self.assertTrue(dead.acquire(key))
+        self.clock.now += 60
+        alive.heartbeat()
+        self.assertFalse(alive.is_assigned(key))
+        # three missed heartbeats, the lease is taken over before it expires
+        self.clock.now += 60
+        alive.heartbeat()
+        self.assertTrue(alive.is_assigned(key))
+        self.assertTrue(alive.acquire(key))
+        self.assertFalse(dead.acquire(key))
+        self.assertFalse(dead.is_assigned(key))
+
+    def test_leave_releases_leases(self):
+        leaving, staying = self._member('replica-a'), self._member('replica-b')
+        leaving.heartbeat()
+        staying.heartbeat()
+        key = next(key for key in self.keys if leaving.is_assigned(key))
+        self.assertTrue(leaving.acquire(key))
+        leaving.leave()
+        staying.heartbeat()
+        self.assertTrue(staying.is_assigned(key))
+        self.assertTrue(staying.acquire(key))
+
+
+    def test_incomplete_lease_store_is_not_instantiated(self):
+        class HeartbeatOnlyStore(LeaseStore):
+            def heartbeat(self, replica_id, now, expires_at):
+                return [replica_id]
+
+        with self.assertRaises(TypeError):
+            HeartbeatOnlyStore()
+
+
+if __name__ == '__main__':
+    unittest.main()
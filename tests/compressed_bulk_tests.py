@@ -0,0 +1,46 @@
+import gzip
+import os
+import unittest
+
+from src.compressed_bulk import CompressedBulk
+
+
+class CompressedBulkTests(unittest.TestCase):
+    MAX_SIZE = 64 * 1024
+
+    def _fill(self, make_log):
+        bulks = []
+        bulk = CompressedBulk(6)
+        for i in range(2000):
+            log = make_log(i)
+            if not bulk.fits(len(log), self.MAX_SIZE):
+                bulks.append(bulk.seal())
+                bulk = CompressedBulk(6)
+            bulk.add(log)
+        bulks.append(bulk.seal())
+        return bulks
+
+    def test_seal_is_valid_gzip(self):
+        bulk = CompressedBulk(6)
+        bulk.add(b'{"message": "first"}')
+        bulk.add(b'{"message": "second"}')
+        self.assertEqual(2, bulk.logs_count)
+        self.assertEqual(b'{"message": "first"}\n{"message": "second"}', gzip.decompress(bulk.seal()))
+
+    def test_incompressible_logs_stay_under_max_size(self):
+        bulks = self._fill(lambda i: os.urandom(500).hex().encode())
+        self.assertGreater(len(bulks), 1)
+        for data in bulks:
+            self.assertLessEqual(len(data), self.MAX_SIZE)
+        self.assertEqual(2000, sum(len(gzip.decompress(data).split(b'\n')) for data in bulks))
+
+    def test_compressible_logs_use_compressed_size(self):
+        bulks = self._fill(lambda i: b'{"message": "[INFO] request handled", "id": "%d"}' % i)
+        raw_size = sum(len(gzip.decompress(data)) for data in bulks)
+        # the raw logs are larger than the body limit, but compressed they fit in one bulk
+        self.assertGreater(raw_size, self.MAX_SIZE)
+        self.assertEqual(1, len(bulks))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,6 +9,8 @@ class ConfigReaderTests(unittest.TestCase):
     CONFIG_INVALID_FILE = 'fixture/invalid_config.yaml'
     CONFIG_INVALID_INTERVAL_FILE = 'fixture/invalid_interval.yaml'
     CONFIG_NO_AWS_REGION_FILE = 'fixture/no_aws_region.yaml'
+    CONFIG_MULTI_REGION_FILE = 'fixture/multi_region.yaml'
+    CONFIG_INVALID_SETTINGS_FILE = 'fixture/invalid_settings.yaml'
     LATEST_TIME = 1681393953
     INTERVAL = 10
 
@@ -27,13 +29,29 @@ class ConfigReaderTests(unittest.TestCase):
         for lg in log_groups:
             if lg.path == '/aws/lambda/my-lambda':
                 self.assertEqual(2, len(lg.custom_fields))
+                self.assertEqual(0, lg.stream_concurrency)
             elif lg.path == '/other/log/group':
                 self.assertEqual(1, len(lg.custom_fields))
+                self.assertEqual(4, lg.stream_concurrency)
             elif lg.path == 'thisisaloggroup':
                 self.assertIsNone(lg.custom_fields)
+                self.assertEqual('?ERROR ?WARN', lg.filter_pattern)
+                self.assertEqual({'drop_levels': ['debug'], 'drop_patterns': ['health-?check'], 'sample_rate': 0.5,
+                                  'stream_max_events_per_minute': 600}, lg.filter_rules)
             else:
                 self.assertEqual(True, False, msg=f'Invalid log group {lg.path}!')
 
+    def test_get_log_group_patterns(self):
+        patterns = self.config_reader.get_log_group_patterns()
+        self.assertEqual(2, len(patterns))
+        self.assertEqual('/aws/lambda/', patterns[0].prefix)
+        self.assertIsNone(patterns[0].pattern)
+        self.assertEqual({'discovered': True}, patterns[0].custom_fields)
+        self.assertEqual('/aws/ecs/prod-', patterns[1].prefix)
+        self.assertEqual(2, patterns[1].stream_concurrency)
+        self.assertFalse(patterns[0].parse_json)
+        self.assertTrue(patterns[1].parse_json)
+
     def test_get_log_groups_invalid_config(self):
         self.set_alternative_config_reader(self.CONFIG_INVALID_FILE)
         log_groups = self.config_reader.get_log_groups(self.LATEST_TIME, self.INTERVAL)
@@ -50,6 +68,47 @@ class ConfigReaderTests(unittest.TestCase):
         self.assertEqual(0, time_interval)
         self.assertLogs('src.config_reader', level=logging.WARNING)
 
+    def test_get_prefetch_depth(self):
+        self.assertEqual(2, self.config_reader.get_prefetch_depth())
+
+    def test_get_prefetch_depth_not_set(self):
+        self.set_alternative_config_reader(self.CONFIG_INVALID_INTERVAL_FILE)
+        self.assertEqual(0, self.config_reader.get_prefetch_depth())
+
+    def test_get_logzio_pool(self):
+        self.assertEqual(2, self.config_reader.get_logzio_pool_size(1))
+        self.assertEqual(20, self.config_reader.get_logzio_max_connections(10))
+
+    def test_get_max_in_flight_bulks(self):
+        self.assertEqual(4, self.config_reader.get_max_in_flight_bulks())
+
+    def test_get_spill_settings(self):
+        self.assertEqual(512, self.config_reader.get_spill_max_megabytes())
+        self.assertEqual(24, self.config_reader.get_spill_max_age_hours(24))
+        self.assertEqual(5, self.config_reader.get_spill_replay_rate(2))
+        self.set_alternative_config_reader(self.CONFIG_INVALID_INTERVAL_FILE)
+        self.assertEqual(0, self.config_reader.get_spill_max_megabytes())
+
+    def test_get_compression_level(self):
+        self.assertEqual(3, self.config_reader.get_compression_level(6))
+        self.set_alternative_config_reader(self.CONFIG_INVALID_INTERVAL_FILE)
+        self.assertEqual(6, self.config_reader.get_compression_level(6))
+
+    def test_invalid_settings_replaced_by_defaults(self):
+        self.set_alternative_config_reader(self.CONFIG_INVALID_SETTINGS_FILE)
+        with self.assertLogs('src.config_reader', level=logging.WARNING) as logs:
+            self.assertEqual(1, self.config_reader.get_logzio_pool_size(1))
+            self.assertEqual(10, self.config_reader.get_logzio_max_connections(10))
+            self.assertEqual(6, self.config_reader.get_compression_level(6))
+            self.assertEqual(2, self.config_reader.get_spill_replay_rate(2))
+            self.assertEqual(24, self.config_reader.get_spill_max_age_hours(24))
+            log_groups = self.config_reader.get_log_groups(self.LATEST_TIME, self.INTERVAL)
+        for key in ['logzio_pool_size', 'logzio_max_connections', 'compression_level', 'spill_replay_bulks_per_second',
+                    'spill_max_age_hours', 'drop_patterns', 'sample_rate', 'stream_max_events_per_minute']:
+            self.assertTrue(any(key in line for line in logs.output), msg=f'{key} was not rejected')
+        # invalid rules are left out, the valid ones are kept
+        self.assertEqual({'drop_levels': ['debug'], 'drop_patterns': ['health-?check']}, log_groups[0].filter_rules)
+
     def test_get_aws_region(self):
         aws_region = self.config_reader.get_aws_region()
         self.assertEqual('us-east-1', aws_region)
@@ -60,6 +119,22 @@ class ConfigReaderTests(unittest.TestCase):
         self.assertEqual('', aws_region)
         self.assertLogs('src.config_reader', level=logging.DEBUG)
 
+    def test_get_log_groups_multi_region(self):
+        self.set_alternative_config_reader(self.CONFIG_MULTI_REGION_FILE)
+        log_groups = self.config_reader.get_log_groups(self.LATEST_TIME, self.INTERVAL)
+        role_arn = 'arn:aws:iam::123456789012:role/logzio-fetcher'
+        other_role_arn = 'arn:aws:iam::210987654321:role/logzio-fetcher'
+        # one log group per role of a list, the invalid one is skipped
+        self.assertEqual([(None, None), ('eu-west-1', None), ('eu-west-1', role_arn), (None, role_arn),
+                          (None, other_role_arn)],
+                         [(lg.region, lg.role_arn) for lg in log_groups])
+        # the default region keeps the path as key
+        self.assertEqual(['/aws/lambda/my-lambda', '/aws/lambda/my-lambda@eu-west-1',
+                          f'/aws/lambda/my-lambda@eu-west-1@{role_arn}'], [lg.key for lg in log_groups[:3]])
+        patterns = self.config_reader.get_log_group_patterns()
+        self.assertEqual(1, len(patterns))
+        self.assertEqual('eu-west-1', patterns[0].region)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+
+from src.event_deduplicator import EventDeduplicator
+
+
+def event(event_id, timestamp):
+    return {'eventId': event_id, 'timestamp': timestamp, 'message': event_id}
+
+
+class EventDeduplicatorTests(unittest.TestCase):
+    def test_overlapping_windows(self):
+        deduplicator = EventDeduplicator()
+        first = deduplicator.filter_page([event('a', 1000), event('b', 2000), event('b', 2000)])
+        self.assertEqual(['a', 'b'], [e['eventId'] for e in first])
+        deduplicator.commit()
+        second = deduplicator.filter_page([event('b', 2000), event('c', 2500), {'message': 'no id'}])
+        self.assertEqual(['c', None], [e.get('eventId') for e in second])
+        self.assertEqual((2, 3), (deduplicator.hits, deduplicator.misses))
+
+    def test_rollback_keeps_logs_that_were_not_sent(self):
+        deduplicator = EventDeduplicator()
+        deduplicator.filter_page([event('a', 1000)])
+        deduplicator.rollback()
+        self.assertEqual(0, len(deduplicator))
+        self.assertEqual(1, len(deduplicator.filter_page([event('a', 1000)])))
+
+    def test_commit_up_to_acked_page(self):
+        deduplicator = EventDeduplicator()
+        deduplicator.filter_page([event('a', 1000)])
+        acked = deduplicator.seal()
+        deduplicator.filter_page([event('b', 1000)])
+        deduplicator.seal()
+        deduplicator.commit(acked)
+        deduplicator.rollback()
+        self.assertEqual(1, len(deduplicator))
+        self.assertEqual(['b'], [e['eventId'] for e in deduplicator.filter_page([event('a', 1000), event('b', 1000)])])
+
+    def test_pending_bounded(self):
+        deduplicator = EventDeduplicator(max_events=3)
+        for second in range(5):
+            deduplicator.filter_page([event(str(second), second * 1000)])
+            deduplicator.seal()
+        self.assertEqual(3, len(deduplicator))
+        # the oldest ids were never acked, they are forgotten instead of skipped
+        deduplicator.commit()
+        self.assertEqual(1, len(deduplicator.filter_page([event('0', 0)])))
+        self.assertEqual(0, len(deduplicator.filter_page([event('4', 4000)])))
+
+    def test_bounded(self):
+        deduplicator = EventDeduplicator(max_events=3)
+        for second in range(5):
+            deduplicator.filter_page([event(str(second), second * 1000)])
+            deduplicator.commit()
+        self.assertEqual(3, len(deduplicator))
+        # the oldest events were evicted
+        self.assertEqual(1, len(deduplicator.filter_page([event('0', 0)])))
+        self.assertEqual(0, len(deduplicator.filter_page([event('4', 4000)])))
+
+    def test_advance(self):
+        deduplicator = EventDeduplicator()
+        deduplicator.filter_page([event('a', 1000), event('b', 2000), event('c', 2999)])
+        deduplicator.commit()
+        deduplicator.advance(2)
+        # the window starts at the watermark, its events are still skipped
+        self.assertEqual(2, len(deduplicator))
+        self.assertEqual([], deduplicator.filter_page([event('b', 2000)]))
+
+    def test_export_and_load(self):
+        deduplicator = EventDeduplicator()
+        deduplicator.filter_page([event('a', 1000), event('b', 2000)])
+        deduplicator.commit()
+        exported = deduplicator.export()
+        self.assertEqual({2: ['b'], 1: ['a']}, exported)
+        restarted = EventDeduplicator()
+        # keys are strings once serialized as JSON
+        restarted.load({str(second): ids for second, ids in exported.items()})
+        self.assertEqual([], restarted.filter_page([event('a', 1000), event('b', 2000)]))
+
+
+if __name__ == '__main__':
+    unittest.main()
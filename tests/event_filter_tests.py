@@ -0,0 +1,39 @@
+import unittest
+
+from src.event_filter import EventFilter
+
+
+def make_event(i, message='request handled', log_level='INFO', stream='stream-1', timestamp=1681389960000):
+    return {'id': f'{i:056d}', 'message': message, 'log_level': log_level, 'logStream': stream,
+            '@timestamp': timestamp}
+
+
+class EventFilterTests(unittest.TestCase):
+    def test_drop_by_level_and_pattern(self):
+        event_filter = EventFilter(drop_levels=['debug'], drop_patterns=['health-?check', '^GET /ping'])
+        events = [make_event(0, log_level='DEBUG'), make_event(1, message='GET /healthcheck 200'),
+                  make_event(2, message='GET /ping 200'), make_event(3, message='GET /items 200')]
+        self.assertEqual([events[3]], event_filter.filter_page(events))
+        self.assertEqual({EventFilter.REASON_LEVEL: 1, EventFilter.REASON_PATTERN: 2}, event_filter.pop_stats())
+        self.assertEqual({}, event_filter.pop_stats())
+
+    def test_sampling_is_deterministic(self):
+        events = [make_event(i) for i in range(2000)]
+        kept = EventFilter(sample_rate=0.25).filter_page(events)
+        self.assertAlmostEqual(500, len(kept), delta=75)
+        # a window that is read again, or by another replica, keeps the same events
+        kept_again = EventFilter(sample_rate=0.25).filter_page([make_event(i) for i in range(2000)])
+        self.assertEqual([event['id'] for event in kept], [event['id'] for event in kept_again])
+
+    def test_stream_rate_cap(self):
+        event_filter = EventFilter(stream_max_events_per_minute=2)
+        events = [make_event(i) for i in range(3)] + [make_event(3, stream='stream-2')] + \
+                 [make_event(4, timestamp=1681390020000)]
+        self.assertEqual([0, 1, 3, 4], [int(event['id']) for event in event_filter.filter_page(events)])
+        self.assertEqual([], event_filter.filter_page([make_event(5)]))
+        event_filter.start_cycle()
+        self.assertEqual(1, len(event_filter.filter_page([make_event(5)])))
+
+
+if __name__ == '__main__':
+    unittest.main()
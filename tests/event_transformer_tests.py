@@ -0,0 +1,39 @@
+import unittest
+
+from src.event_transformer import EventTransformer
+
+
+def extract(message, event):
+    if message.startswith('[INFO]'):
+        event['log_level'] = 'INFO'
+
+
+class EventTransformerTests(unittest.TestCase):
+    def test_transform_page(self):
+        transformer = EventTransformer({'logGroup': '/aws/lambda/my-lambda', 'owner': '123456789012'}, extract)
+        events = [{'logStreamName': 'stream', 'timestamp': 1681389974000, 'message': '[INFO] started\n',
+                   'ingestionTime': 1681389975000, 'eventId': '0123'},
+                  {'logStreamName': 'stream', 'timestamp': 1681389974001, 'message': 'no level'}]
+        transformed = transformer.transform_page(events)
+        self.assertIs(events, transformed)
+        self.assertEqual({'logGroup': '/aws/lambda/my-lambda', 'owner': '123456789012', 'logStream': 'stream',
+                          '@timestamp': 1681389974000, 'message': '[INFO] started', 'ingestionTime': 1681389975000,
+                          'id': '0123', 'log_level': 'INFO'}, transformed[0])
+        self.assertNotIn('log_level', transformed[1])
+        self.assertNotIn('id', transformed[1])
+
+    def test_failing_event_does_not_stop_the_page(self):
+        def failing_extract(message, event):
+            if message == 'bad':
+                raise ValueError(message)
+
+        transformer = EventTransformer(None, failing_extract)
+        events = [{'message': 'good', 'timestamp': 1}, {'message': 'bad', 'timestamp': 2},
+                  {'message': 'good', 'timestamp': 3}]
+        with self.assertLogs('src.event_transformer', 'WARNING'):
+            transformer.transform_page(events)
+        self.assertEqual([1, 2, 3], [event['@timestamp'] for event in events])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import json
+import unittest
+
+from src import json_encoder
+from src.json_encoder import JsonEncoder, OrjsonEncoder, get_encoder
+
+
+class JsonEncoderTests(unittest.TestCase):
+    LOG = {'message': 'héllo', 'id': '123', '@timestamp': 1681389974000, 'nested': {'key': [1, 2]}}
+
+    def test_json_encoder(self):
+        encoded = JsonEncoder().encode(self.LOG)
+        self.assertIsInstance(encoded, bytes)
+        self.assertEqual(self.LOG, json.loads(encoded))
+
+    def test_get_encoder_unknown(self):
+        self.assertIsInstance(get_encoder('yaml'), JsonEncoder)
+
+    def test_get_encoder_auto(self):
+        expected = OrjsonEncoder if json_encoder.orjson is not None else JsonEncoder
+        self.assertIsInstance(get_encoder(), expected)
+
+    @unittest.skipIf(json_encoder.orjson is None, 'orjson is not installed')
+    def test_orjson_encoder(self):
+        encoder = OrjsonEncoder()
+        self.assertEqual(self.LOG, json.loads(encoder.encode(self.LOG)))
+        # falls back to json for what orjson can't serialize
+        self.assertEqual({'1': 2 ** 70}, json.loads(encoder.encode({1: 2 ** 70})))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+
+from src.log_group_discovery import LogGroupDiscovery, LogGroupPattern
+
+
+class FakePaginator:
+    def __init__(self, client):
+        self._client = client
+
+    def paginate(self, logGroupNamePrefix=''):
+        self._client.listed_prefixes.append(logGroupNamePrefix)
+        names = [name for name in self._client.log_groups if name.startswith(logGroupNamePrefix)]
+        for i in range(0, len(names), 2):
+            yield {'logGroups': [{'logGroupName': name} for name in names[i:i + 2]]}
+
+
+class FakeCloudwatchClient:
+    def __init__(self, log_groups):
+        self.log_groups = log_groups
+        self.listed_prefixes = []
+
+    def get_paginator(self, operation_name):
+        return FakePaginator(self)
+
+
+class LogGroupDiscoveryTests(unittest.TestCase):
+    def setUp(self):
+        self.patterns = [LogGroupPattern(None, '/aws/lambda/prod-*', {'env': 'prod'}, 0),
+                         LogGroupPattern('/aws/lambda/', None, None, 0),
+                         LogGroupPattern(None, '/aws/ecs/*/app', None, 2)]
+        self.client = FakeCloudwatchClient(['/aws/lambda/prod-a', '/aws/lambda/dev-a', '/aws/lambda/literal',
+                                            '/aws/ecs/cluster/app', '/aws/ecs/cluster/other', '/other/group'])
+
+    def get_client(self, region, role_arn):
+        return self.client
+
+    def test_pattern_prefix(self):
+        self.assertEqual('/aws/lambda/prod-', self.patterns[0].prefix)
+        self.assertTrue(self.patterns[0].matches('/aws/lambda/prod-a'))
+        self.assertFalse(self.patterns[0].matches('/aws/lambda/dev-a'))
+        self.assertEqual('/aws/ecs/', self.patterns[2].prefix)
+
+    def test_refresh(self):
+        discovery = LogGroupDiscovery(self.patterns, 600, excluded_keys=['/aws/lambda/literal'])
+        added, removed = discovery.refresh(self.get_client, force=True)
+        self.assertEqual(['/aws/ecs/cluster/app', '/aws/lambda/prod-a', '/aws/lambda/dev-a'], list(added))
+        self.assertEqual(('/aws/lambda/prod-a', self.patterns[0]), added['/aws/lambda/prod-a'])
+        self.assertEqual(('/aws/lambda/dev-a', self.patterns[1]), added['/aws/lambda/dev-a'])
+        self.assertEqual([], removed)
+        # '/aws/lambda/prod-' is covered by listing '/aws/lambda/'
+        self.assertEqual(['/aws/ecs/', '/aws/lambda/'], self.client.listed_prefixes)
+
+    def test_refresh_only_after_ttl(self):
+        discovery = LogGroupDiscovery(self.patterns, 600)
+        discovery.refresh(self.get_client, force=True)
+        self.client.log_groups.append('/aws/lambda/new')
+        self.assertEqual(({}, []), discovery.refresh(self.get_client))
+        self.assertEqual(2, len(self.client.listed_prefixes))
+
+    def test_refresh_reports_changes(self):
+        discovery = LogGroupDiscovery(self.patterns, 0)
+        discovery.refresh(self.get_client, force=True)
+        self.client.log_groups.remove('/aws/lambda/dev-a')
+        self.client.log_groups.append('/aws/lambda/new')
+        added, removed = discovery.refresh(self.get_client)
+        self.assertEqual(['/aws/lambda/new'], list(added))
+        self.assertEqual(['/aws/lambda/dev-a'], removed)
+        self.assertIn('/aws/lambda/new', discovery.get_log_groups())
+
+    def test_refresh_per_region(self):
+        patterns = [LogGroupPattern('/aws/lambda/', None, None, 0),
+                    LogGroupPattern('/aws/lambda/', None, None, 0, region='eu-west-1')]
+        clients = {None: FakeCloudwatchClient(['/aws/lambda/a']),
+                   'eu-west-1': FakeCloudwatchClient(['/aws/lambda/a', '/aws/lambda/b'])}
+        discovery = LogGroupDiscovery(patterns, 600, excluded_keys=['/aws/lambda/a@eu-west-1'])
+        added, _ = discovery.refresh(lambda region, role_arn: clients[region], force=True)
+        self.assertEqual(['/aws/lambda/a', '/aws/lambda/b@eu-west-1'], list(added))
+        self.assertEqual(('/aws/lambda/b', patterns[1]), added['/aws/lambda/b@eu-west-1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import json
+import unittest
+
+from src.log_level_extractor import LogLevelExtractor
+
+
+class LogLevelExtractorTests(unittest.TestCase):
+    def setUp(self):
+        self.extractor = LogLevelExtractor()
+
+    def _extract(self, message, extractor=None):
+        event = {}
+        (extractor or self.extractor).extract(message, event)
+        return event
+
+    def test_bracket_level(self):
+        self.assertEqual('INFO', self.extractor.get_log_level('[info] started'))
+        self.assertEqual('ERROR', self.extractor.get_log_level('2023/04/13 [$LATEST] [ERROR] failed'))
+        # a ] before the [ used to be sliced into garbage
+        self.assertEqual('WARN', self.extractor.get_log_level('a] b [WARN] c'))
+        self.assertEqual('', self.extractor.get_log_level('[INFORMATION] not a level'))
+
+    def test_key_value_level(self):
+        self.assertEqual('WARNING', self.extractor.get_log_level('msg="retrying" level=warning attempt=2'))
+        self.assertEqual('DEBUG', self.extractor.get_log_level('log_level: Debug'))
+        self.assertEqual('ERROR', self._extract(json.dumps({'msg': 'failed', 'level': 'error'}))['log_level'])
+        self.assertEqual('', self.extractor.get_log_level('levels=information'))
+
+    def test_only_prefix_is_scanned(self):
+        extractor = LogLevelExtractor(scan_length=100)
+        self.assertEqual('', extractor.get_log_level('x' * 300 * 1024 + ' [ERROR]'))
+        self.assertEqual('ERROR', extractor.get_log_level('[ERROR] ' + 'x' * 300 * 1024))
+
+    def test_parse_json(self):
+        extractor = LogLevelExtractor(parse_json=True, max_json_length=1024)
+        message = json.dumps({'level': 'info', 'logGroup': 'from message', 'user': {'id': 1}})
+        event = {'logGroup': '/aws/lambda/my-lambda'}
+        extractor.extract(message, event)
+        self.assertEqual({'logGroup': '/aws/lambda/my-lambda', 'level': 'info', 'user': {'id': 1},
+                          'log_level': 'INFO'}, event)
+        # too long to be parsed, the level is still found
+        long_message = json.dumps({'severity': 'ERROR', 'data': 'x' * 2048})
+        self.assertEqual({'log_level': 'ERROR'}, self._extract(long_message, extractor))
+        self.assertEqual({}, self._extract('{not json', extractor))
+
+    def test_log_level_does_not_depend_on_previous_messages(self):
+        text_message = '[INFO] level=error'
+        json_message = '{"level": "warn", "message": "[ERROR] in message"}'
+        for message in ['level=info', '[WARN] started', '{"message": "[DEBUG] in message"}']:
+            self.extractor.get_log_level(message)
+            self.extractor.get_log_level(message, LogLevelExtractor.SHAPE_JSON)
+            # brackets come first in text, keys in json
+            self.assertEqual('INFO', self.extractor.get_log_level(text_message))
+            self.assertEqual('WARN', self.extractor.get_log_level(json_message, LogLevelExtractor.SHAPE_JSON))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+import gzip
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from src.bulk_sender import BulkSender
+from src.logzio_shipper import LogzioShipper, LogzioSession
+from src.metrics import FetcherMetrics
+from src.spill_queue import SpillQueue, SpillReplayer
+
+
+class ListenerHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.bodies.append(gzip.decompress(body).decode())
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LogzioShipperTests(unittest.TestCase):
+    def setUp(self):
+        self.listener = ThreadingHTTPServer(('127.0.0.1', 0), ListenerHandler)
+        self.listener.bodies = []
+        threading.Thread(target=self.listener.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.listener.server_port}'
+
+    def tearDown(self):
+        self.listener.shutdown()
+        self.listener.server_close()
+
+    def test_send_to_logzio(self):
+        shipper = LogzioShipper(self.url, 'some-token')
+        shipper.add_log_to_send({'message': 'hello'})
+        shipper.send_to_logzio()
+        self.assertEqual(1, len(self.listener.bodies))
+        log = json.loads(self.listener.bodies[0])
+        self.assertEqual('hello', log['message'])
+        self.assertEqual('cloudwatch', log['type'])
+        self.assertEqual('cw-fetcher', log['shipper'])
+
+    def test_shipper_metrics(self):
+        metrics = FetcherMetrics()
+        shipper = LogzioShipper(self.url, 'some-token', metrics=metrics.for_log_group('/aws/lambda/my-lambda'))
+        shipper.add_log_to_send({'message': 'hello'})
+        shipper.add_log_to_send({'message': 'world'})
+        shipper.send_to_logzio()
+        rendered = metrics.registry.render()
+        self.assertIn('cloudwatch_fetcher_events_shipped_total{log_group="/aws/lambda/my-lambda"} 2', rendered)
+        self.assertIn('cloudwatch_fetcher_logzio_post_seconds_count 1', rendered)
+        self.assertIn('cloudwatch_fetcher_bulk_compression_ratio_count 1', rendered)
+        self.assertIn('cloudwatch_fetcher_logzio_post_retries_total 0', rendered)
+
+    def test_session_shared_between_shippers(self):
+        session = LogzioSession()
+        shippers = [LogzioShipper(self.url, 'some-token', session) for _ in range(3)]
+        for shipper in shippers:
+            for i in range(2):
+                shipper.add_log_to_send({'message': f'log {i}'})
+                shipper.send_to_logzio()
+        stats = session.get_connection_stats()
+        self.assertEqual(6, stats['requests'])
+        self.assertEqual(1, stats['connections_opened'])
+        self.assertEqual(5, stats['connections_reused'])
+        session.close()
+
+    @mock.patch.object(LogzioShipper, 'MAX_BODY_SIZE_BYTES', 64 * 1024)
+    def test_send_to_logzio_waits_for_background_bulks(self):
+        sender = BulkSender(2)
+        shipper = LogzioShipper(self.url, 'some-token', bulk_sender=sender)
+        for i in range(1000):
+            shipper.add_log_to_send({'message': os.urandom(250).hex()})
+        shipper.send_to_logzio()
+        self.assertGreater(len(self.listener.bodies), 1)
+        self.assertEqual(1000, sum(len(body.split('\n')) for body in self.listener.bodies))
+        sender.shutdown()
+
+    def test_send_to_logzio_raises_background_error(self):
+        sender = BulkSender(1)
+        shipper = LogzioShipper('http://127.0.0.1:1', 'some-token', LogzioSession(retries=0), sender)
+        shipper.add_log_to_send({'message': 'hello'})
+        with self.assertRaises(Exception):
+            shipper.send_to_logzio()
+        sender.shutdown()
+
+    def test_bulk_spilled_while_listener_is_down(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            spill_queue = SpillQueue(spill_dir)
+            shipper = LogzioShipper('http://127.0.0.1:1', 'some-token', LogzioSession(retries=0),
+                                    spill_queue=spill_queue)
+            shipper.add_log_to_send({'message': 'first'})
+            # the bulk is on disk, the logs count as sent
+            shipper.send_to_logzio()
+            self.assertTrue(spill_queue.should_spill())
+            shipper.add_log_to_send({'message': 'second'})
+            shipper.send_to_logzio()
+            replay_shipper = LogzioShipper(self.url, 'some-token')
+            replayer = SpillReplayer(spill_queue, replay_shipper.send_sealed_bulk)
+            self.assertTrue(replayer.replay_once(timeout=0))
+            self.assertTrue(replayer.replay_once(timeout=0))
+            self.assertFalse(replayer.replay_once(timeout=0))
+            self.assertFalse(spill_queue.should_spill())
+            self.assertEqual(['first', 'second'], [json.loads(body)['message'] for body in self.listener.bodies])
+            spill_queue.close()
+
+    @mock.patch.object(LogzioShipper, '_send_or_spill_bulk')
+    def test_watermark_follows_contiguous_acked_bulks(self, send_or_spill_bulk):
+        send_and_ack_bulk = LogzioShipper._send_and_ack_bulk
+        shipper = LogzioShipper(self.url, 'some-token')
+        shipper.mark_watermark('nothing added')
+        self.assertEqual(['nothing added'], shipper.pop_acked_watermarks())
+        with mock.patch.object(LogzioShipper, '_send_and_ack_bulk'):
+            shipper.add_log_to_send({'message': 'first'})
+            shipper.mark_watermark('first')
+            shipper._dispatch_bulk()
+            # no log of this page was kept, it waits for the bulk of the previous one
+            shipper.mark_watermark('filtered')
+            shipper.add_log_to_send({'message': 'second'})
+            shipper.mark_watermark('second')
+            shipper._dispatch_bulk()
+        self.assertEqual([], shipper.pop_acked_watermarks())
+        # bulks sent in the background are acked out of order
+        send_and_ack_bulk(shipper, 1, b'', 0)
+        self.assertEqual([], shipper.pop_acked_watermarks())
+        send_and_ack_bulk(shipper, 0, b'', 0)
+        self.assertEqual(['first', 'filtered', 'second'], shipper.pop_acked_watermarks())
+        self.assertEqual([], shipper.pop_acked_watermarks())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,16 +1,67 @@
 import logging
+import signal
 import unittest
 import os
 
+from unittest import mock
+
+import botocore.exceptions
+
+from src.event_deduplicator import EventDeduplicator
+from src.log_group import LogGroup
+from src.logzio_shipper import LogzioSession, LogzioShipper
 from src.manager import Manager
+from src.metrics import FetcherMetrics
+from src.rate_limiter import AdaptiveRateLimiter
+
+
+class FakePaginator:
+    def __init__(self, pages):
+        self._pages = pages
+
+    def paginate(self, **kwargs):
+        return iter(self._pages)
+
+
+class FakeCloudwatchClient:
+    def __init__(self, pages, stream_pages=None):
+        self._pages = pages
+        self._stream_pages = stream_pages
+        self.calls = []
+
+    def get_paginator(self, operation_name):
+        return FakePaginator(self._stream_pages)
+
+    def filter_log_events(self, **kwargs):
+        self.calls.append(dict(kwargs))
+        page = self._pages[len(self.calls) - 1]
+        if isinstance(page, Exception):
+            raise page
+        return page
 
 
 class ManagerTests(unittest.TestCase):
+    def setUp(self):
+        # run() blocks the signals it waits for
+        self.signal_mask = signal.pthread_sigmask(signal.SIG_BLOCK, [])
+
+    def tearDown(self):
+        signal.pthread_sigmask(signal.SIG_SETMASK, self.signal_mask)
+
     def test_no_logzio_token(self):
         manager = Manager()
         os.environ[manager.ENV_LOGZIO_TOKEN] = ''
         manager.run()
         self.assertLogs('src.manager', logging.ERROR)
+        # before any thread was started
+        self.assertIn(signal.SIGUSR1, signal.pthread_sigmask(signal.SIG_BLOCK, []))
+
+    @mock.patch.dict(os.environ, {Manager.ENV_LOGZIO_TOKEN: 'some-token', Manager.ENV_PROFILE_CYCLES: 'three'})
+    def test_invalid_profile_cycles(self):
+        manager = Manager()
+        with self.assertLogs('src.manager', logging.ERROR) as logs:
+            manager.run()
+        self.assertIn(Manager.ENV_PROFILE_CYCLES, logs.output[-1])
 
     def test_no_aws_credentials(self):
         manager = Manager()
@@ -23,6 +74,265 @@ class ManagerTests(unittest.TestCase):
         manager.run()
         self.assertLogs('src.manager', logging.ERROR)
 
+    def test_get_log_events_pages_follows_next_token(self):
+        manager = Manager()
+        log_group = LogGroup('/aws/lambda/my-lambda', None, 1681389974, 10)
+        pages = [{'events': [{'message': 'first'}], 'nextToken': 'token-1'},
+                 {'events': [], 'nextToken': 'token-2'},
+                 {'events': [{'message': 'second'}, {'message': 'third'}]}]
+        cw_client = FakeCloudwatchClient(pages)
+        fetched = list(manager._get_log_events_pages(cw_client, AdaptiveRateLimiter(), log_group, 1681390974))
+        self.assertEqual(2, len(fetched))
+        self.assertEqual(3, len(cw_client.calls))
+        self.assertNotIn('nextToken', cw_client.calls[0])
+        self.assertEqual('token-1', cw_client.calls[1]['nextToken'])
+        self.assertEqual('token-2', cw_client.calls[2]['nextToken'])
+        self.assertEqual(1681390974000, cw_client.calls[2]['endTime'])
+        self.assertEqual('', log_group.next_token)
+
+    def test_filter_pattern_sent_to_cloudwatch(self):
+        manager = Manager()
+        log_group = LogGroup('/aws/lambda/my-lambda', None, 1681389974, 10, filter_pattern='?ERROR ?WARN')
+        cw_client = FakeCloudwatchClient([{'events': [{'message': 'ERROR first'}]}, {'events': []}])
+        list(manager._get_log_events_pages(cw_client, AdaptiveRateLimiter(), log_group, 1681390974))
+        list(manager._get_slice_pages(cw_client, AdaptiveRateLimiter(), log_group, 1681389974, 1681390000, 1681390974))
+        self.assertEqual(['?ERROR ?WARN', '?ERROR ?WARN'], [call['filterPattern'] for call in cw_client.calls])
+
+    def test_filter_log_events_retries_throttling(self):
+        manager = Manager()
+        throttled = botocore.exceptions.ClientError({'Error': {'Code': 'ThrottlingException'}}, 'FilterLogEvents')
+        cw_client = FakeCloudwatchClient([throttled, {'events': [{'message': 'first'}]}])
+        resp = manager._filter_log_events(cw_client, AdaptiveRateLimiter(), {'logGroupName': 'group'}, 0)
+        self.assertEqual(1, len(resp['events']))
+        self.assertEqual(2, len(cw_client.calls))
+
+    def test_filter_log_events_metrics(self):
+        manager = Manager()
+        metrics = FetcherMetrics()
+        group_metrics = metrics.for_log_group('group')
+        throttled = botocore.exceptions.ClientError({'Error': {'Code': 'ThrottlingException'}}, 'FilterLogEvents')
+        cw_client = FakeCloudwatchClient([throttled, {'events': [], 'ResponseMetadata': {'RetryAttempts': 2}}])
+        manager._filter_log_events(cw_client, AdaptiveRateLimiter(), {'logGroupName': 'group'}, 0, group_metrics)
+        self.assertEqual(2, group_metrics.cloudwatch_calls.value)
+        self.assertEqual(3, group_metrics.cloudwatch_throttles.value)
+        self.assertIn('cloudwatch_fetcher_cloudwatch_call_seconds_count{log_group="group"} 2', metrics.registry.render())
+
+    def test_filter_log_events_other_errors_raised(self):
+        manager = Manager()
+        denied = botocore.exceptions.ClientError({'Error': {'Code': 'AccessDeniedException'}}, 'FilterLogEvents')
+        cw_client = FakeCloudwatchClient([denied])
+        with self.assertRaises(botocore.exceptions.ClientError):
+            manager._filter_log_events(cw_client, AdaptiveRateLimiter(), {'logGroupName': 'group'}, 0)
+        self.assertEqual(1, len(cw_client.calls))
+
+    def test_get_stream_partitions(self):
+        manager = Manager()
+        log_group = LogGroup('/aws/eks/my-cluster', None, 1681389974, 10, stream_concurrency=2)
+        log_group.latest_time = 1681389974
+        log_group.stream_positions = {'stream-done': 1681390974, 'stream-1': 1681390000}
+        streams = [{'logStreamName': 'stream-done', 'lastEventTimestamp': 1681390974000},
+                   {'logStreamName': 'stream-1', 'lastEventTimestamp': 1681390974000}]
+        streams += [{'logStreamName': f'stream-{i}', 'lastEventTimestamp': 1681390000000} for i in range(2, 152)]
+        streams += [{'logStreamName': 'stream-idle', 'lastEventTimestamp': 1681000000000}]
+        cw_client = FakeCloudwatchClient([], [{'logStreams': streams[:100]}, {'logStreams': streams[100:]}])
+        partitions = manager._get_stream_partitions(cw_client, log_group, 1681390974)
+        self.assertEqual([1681389974, 1681389974, 1681390000], [start for start, _ in partitions])
+        self.assertEqual([100, 50, 1], [len(names) for _, names in partitions])
+        self.assertEqual(('stream-1',), partitions[2][1])
+        self.assertNotIn('stream-idle', [name for _, names in partitions for name in names])
+
+    def test_rate_limiter_per_account_and_region(self):
+        manager = Manager()
+        manager._account_ids = {None: '111111111111', 'arn:aws:iam::222222222222:role/fetcher': '222222222222'}
+        rate_limiter = manager._get_rate_limiter('us-east-1')
+        self.assertIs(rate_limiter, manager._get_rate_limiter('us-east-1'))
+        self.assertIsNot(rate_limiter, manager._get_rate_limiter('eu-west-1'))
+        self.assertIsNot(rate_limiter, manager._get_rate_limiter('us-east-1', 'arn:aws:iam::222222222222:role/fetcher'))
+
+    def test_additional_fields_owner_per_role(self):
+        manager = Manager()
+        manager._account_ids = {None: '111111111111', 'arn:aws:iam::222222222222:role/fetcher': '222222222222'}
+        log_group = LogGroup('/aws/lambda/my-lambda', None, 1681389974, 10, region='eu-west-1',
+                             role_arn='arn:aws:iam::222222222222:role/fetcher')
+        self.assertEqual('222222222222', manager._get_additional_fields(log_group)[manager.FIELD_OWNER])
+
+    @mock.patch.object(LogzioShipper, '_send_bulk')
+    def test_failed_window_resumed_after_acked_pages(self, send_bulk):
+        manager = Manager()
+        manager._account_ids = {None: '111111111111'}
+        manager._aws_region = 'us-east-1'
+        manager._logzio_session = LogzioSession()
+        manager._position_manager = mock.Mock()
+        manager._backfill_slice_minutes = 0
+        log_group = LogGroup('/aws/lambda/my-lambda', None, 1681389974, 10)
+        start_time = log_group.latest_time
+        denied = botocore.exceptions.ClientError({'Error': {'Code': 'AccessDeniedException'}}, 'FilterLogEvents')
+        cw_client = FakeCloudwatchClient([{'events': [{'message': 'first', 'timestamp': 1}], 'nextToken': 'token-1'},
+                                          {'events': [{'message': 'second', 'timestamp': 2}], 'nextToken': 'token-2'},
+                                          denied,
+                                          {'events': [{'message': 'third', 'timestamp': 3}]}])
+        manager._get_logs_client = lambda region, role_arn, rate_limiter: cw_client
+        shipper = LogzioShipper('http://127.0.0.1:1', 'some-token', manager._logzio_session)
+        manager._fetch_and_send(log_group, shipper, mock.Mock())
+        # the logs of both pages were sent, the window goes on after them
+        self.assertEqual(1, send_bulk.call_count)
+        self.assertEqual(start_time, log_group.latest_time)
+        self.assertEqual('token-2', log_group.next_token)
+        window_end = log_group.window_end
+        self.assertEqual(window_end * 1000, cw_client.calls[0]['endTime'])
+        manager._slow_cycle_seconds = 0
+        with self.assertLogs('src.manager', 'WARNING') as logs:
+            manager._fetch_and_send(log_group, shipper, mock.Mock())
+        self.assertIn('filter_log_events: ', logs.output[-1])
+        self.assertEqual('token-2', cw_client.calls[3]['nextToken'])
+        self.assertEqual(window_end * 1000, cw_client.calls[3]['endTime'])
+        self.assertEqual(window_end, log_group.latest_time)
+        self.assertEqual('', log_group.next_token)
+        manager._logzio_session.close()
+
+
+    @mock.patch.object(LogzioShipper, '_send_bulk')
+    def test_cycle_stops_once_lease_is_lost(self, send_bulk):
+        manager = Manager()
+        manager._account_ids = {None: '111111111111'}
+        manager._aws_region = 'us-east-1'
+        manager._logzio_session = LogzioSession()
+        manager._position_manager = mock.Mock()
+        manager._backfill_slice_minutes = 0
+        manager._cluster = mock.Mock(heartbeat_seconds=30)
+        manager._cluster.is_assigned.return_value = True
+        manager._cluster.holds.return_value = True
+        # taken over by another replica once the cycle started
+        manager._cluster.acquire.side_effect = [True, False]
+        log_group = LogGroup('/aws/lambda/my-lambda', None, 1681389974, 10)
+        start_time = log_group.latest_time
+        cw_client = FakeCloudwatchClient([{'events': [{'message': 'first', 'timestamp': 1}], 'nextToken': 'token-1'},
+                                          {'events': [{'message': 'second', 'timestamp': 2}]}])
+        manager._get_logs_client = lambda region, role_arn, rate_limiter: cw_client
+        shipper = LogzioShipper('http://127.0.0.1:1', 'some-token', manager._logzio_session)
+        with self.assertLogs('src.manager', 'WARNING'):
+            manager._fetch_and_send(log_group, shipper, mock.Mock())
+        # the lease lasts two intervals of the log group
+        self.assertEqual(mock.call(log_group.key, 20 * 60), manager._cluster.acquire.call_args)
+        manager._position_manager.update_position_file.assert_not_called()
+        self.assertEqual(start_time, log_group.latest_time)
+        manager._logzio_session.close()
+
+
+    @mock.patch.object(LogzioShipper, '_send_bulk')
+    def test_duplicated_and_unique_events_counted(self, send_bulk):
+        manager = Manager()
+        manager._account_ids = {None: '111111111111'}
+        manager._aws_region = 'us-east-1'
+        manager._logzio_session = LogzioSession()
+        manager._position_manager = mock.Mock()
+        manager._backfill_slice_minutes = 0
+        log_group = LogGroup('/aws/lambda/my-lambda', None, 1681389974, 10)
+        log_group.metrics = FetcherMetrics().for_log_group(log_group.key)
+        deduplicator = EventDeduplicator()
+        deduplicator.filter_page([{'eventId': 'a', 'timestamp': 1000}])
+        deduplicator.commit()
+        cw_client = FakeCloudwatchClient([{'events': [{'eventId': 'a', 'message': 'first', 'timestamp': 1000},
+                                                      {'eventId': 'b', 'message': 'second', 'timestamp': 1000},
+                                                      {'eventId': 'c', 'message': 'third', 'timestamp': 2000}]}])
+        manager._get_logs_client = lambda region, role_arn, rate_limiter: cw_client
+        shipper = LogzioShipper('http://127.0.0.1:1', 'some-token', manager._logzio_session)
+        with self.assertLogs('src.manager', 'INFO') as logs:
+            manager._fetch_and_send(log_group, shipper, mock.Mock(), deduplicator=deduplicator)
+        self.assertTrue(any('Skipped 1 logs of /aws/lambda/my-lambda that were already shipped, 2 were new' in line
+                            for line in logs.output))
+        self.assertEqual((1, 2), (log_group.metrics.events_duplicated.value, log_group.metrics.events_unique.value))
+        manager._logzio_session.close()
+
+    @mock.patch.object(LogzioShipper, 'MAX_BODY_SIZE_BYTES', 1)
+    @mock.patch.object(LogzioShipper, '_send_bulk')
+    def test_events_of_failed_bulk_shipped_again(self, send_bulk):
+        manager = Manager()
+        manager._account_ids = {None: '111111111111'}
+        manager._aws_region = 'us-east-1'
+        manager._logzio_session = LogzioSession()
+        manager._position_manager = mock.Mock()
+        manager._backfill_slice_minutes = 0
+        log_group = LogGroup('/aws/lambda/my-lambda', None, 1681389974, 10)
+        deduplicator = EventDeduplicator()
+        # every log gets its own bulk, the one of the first page is posted while the second page is shipped
+        send_bulk.side_effect = [Exception('listener is down'), None, None]
+        pages = [{'events': [{'eventId': 'a', 'message': 'first', 'timestamp': 1000}], 'nextToken': 'token-1'},
+                 {'events': [{'eventId': 'b', 'message': 'second', 'timestamp': 2000}]}]
+        cw_client = FakeCloudwatchClient(pages * 2)
+        manager._get_logs_client = lambda region, role_arn, rate_limiter: cw_client
+        shipper = LogzioShipper('http://127.0.0.1:1', 'some-token', manager._logzio_session)
+        with self.assertLogs('src.manager', 'ERROR'):
+            manager._fetch_and_send(log_group, shipper, mock.Mock(), deduplicator=deduplicator)
+        self.assertEqual(0, len(deduplicator))
+        manager._fetch_and_send(log_group, shipper, mock.Mock(), deduplicator=deduplicator)
+        self.assertEqual(3, send_bulk.call_count)
+        self.assertEqual(0, deduplicator.hits)
+        manager._logzio_session.close()
+
+    @mock.patch.object(LogzioShipper, 'MAX_BODY_SIZE_BYTES', 1)
+    @mock.patch.object(LogzioShipper, '_send_bulk')
+    def test_finished_streams_recorded_once_acked(self, send_bulk):
+        manager = Manager()
+        manager._account_ids = {None: '111111111111'}
+        manager._aws_region = 'us-east-1'
+        manager._logzio_session = LogzioSession()
+        manager._position_manager = mock.Mock()
+        log_group = LogGroup('/aws/eks/my-cluster', None, 1681389974, 10, stream_concurrency=1)
+        # stream-1 is read up to a later time, so each stream gets its own partition
+        log_group.stream_positions = {'stream-1': log_group.latest_time + 100}
+        send_bulk.side_effect = [None, Exception('listener is down')]
+        cw_client = FakeCloudwatchClient([{'events': [{'message': 'first', 'timestamp': 1}]},
+                                          {'events': [{'message': 'second', 'timestamp': 2}]}],
+                                         [{'logStreams': [{'logStreamName': 'stream-1'},
+                                                          {'logStreamName': 'stream-2'}]}])
+        manager._get_logs_client = lambda region, role_arn, rate_limiter: cw_client
+        shipper = LogzioShipper('http://127.0.0.1:1', 'some-token', manager._logzio_session)
+        with self.assertLogs('src.manager', 'ERROR'):
+            manager._fetch_and_send(log_group, shipper, mock.Mock())
+        self.assertEqual(['stream-2'], cw_client.calls[0]['logStreamNames'])
+        # the logs of stream-1 were in the bulk that failed, it is read again
+        self.assertGreater(log_group.stream_positions['stream-2'], log_group.latest_time)
+        self.assertEqual(log_group.latest_time + 100, log_group.stream_positions['stream-1'])
+        manager._logzio_session.close()
+
+
+    @mock.patch.dict(os.environ, {Manager.ENV_REPLICA_ID: ''})
+    def test_spill_in_cluster_mode_needs_replica_id(self):
+        manager = Manager()
+        manager._cluster = mock.Mock(replica_id='hostname-1234')
+        with self.assertRaises(Exception):
+            manager._start_spill_replay()
+        self.assertIsNone(manager._spill_replayer)
+
+
+    @mock.patch.object(LogzioShipper, '_send_bulk')
+    def test_resumed_window_checkpointed_at_its_end(self, send_bulk):
+        manager = Manager()
+        manager._account_ids = {None: '111111111111'}
+        manager._aws_region = 'us-east-1'
+        manager._logzio_session = LogzioSession()
+        manager._position_manager = mock.Mock()
+        manager._CHECKPOINT_SECONDS = 0
+        saved = []
+        manager._position_manager.update_position_file.side_effect = lambda log_group, *args: saved.append(
+            (log_group.latest_time, log_group.next_token, log_group.window_end))
+        log_group = LogGroup('/aws/lambda/my-lambda', None, 1681389974, 10)
+        window_end = log_group.latest_time + 600
+        log_group.next_token = 'token-1'
+        log_group.window_end = window_end
+        cw_client = FakeCloudwatchClient([{'events': [{'message': 'first', 'timestamp': 1}], 'nextToken': 'token-2'},
+                                          {'events': [{'message': 'second', 'timestamp': 2}]}])
+        manager._get_logs_client = lambda region, role_arn, rate_limiter: cw_client
+        shipper = LogzioShipper('http://127.0.0.1:1', 'some-token', manager._logzio_session)
+        manager._fetch_and_send(log_group, shipper, mock.Mock())
+        self.assertEqual('token-1', cw_client.calls[0]['nextToken'])
+        # the window is never saved with one of its tokens once it was read to its end, nor moved back
+        self.assertGreater(len(saved), 0)
+        self.assertEqual([(window_end, '', 0)] * len(saved), saved)
+        self.assertEqual((window_end, '', 0), (log_group.latest_time, log_group.next_token, log_group.window_end))
+        manager._logzio_session.close()
+
 
 if __name__ == '__main__':
     unittest.main()
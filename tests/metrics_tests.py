@@ -0,0 +1,63 @@
+import unittest
+import urllib.error
+import urllib.request
+
+from src.metrics import FetcherMetrics, MetricsRegistry, MetricsServer, _Metric
+
+
+class MetricsTests(unittest.TestCase):
+    def test_render(self):
+        registry = MetricsRegistry('test_')
+        counter = registry.counter('events_total', 'Events', ('log_group',))
+        counter.labels('/aws/lambda/"my"-lambda').inc(3)
+        histogram = registry.histogram('latency_seconds', 'Latency', buckets=[0.1, 1])
+        child = histogram.labels()
+        for value in [0.05, 0.5, 0.5, 5]:
+            child.observe(value)
+        self.assertEqual('# HELP test_events_total Events\n'
+                         '# TYPE test_events_total counter\n'
+                         'test_events_total{log_group="/aws/lambda/\\"my\\"-lambda"} 3\n'
+                         '# HELP test_latency_seconds Latency\n'
+                         '# TYPE test_latency_seconds histogram\n'
+                         'test_latency_seconds_bucket{le="0.1"} 1\n'
+                         'test_latency_seconds_bucket{le="1"} 3\n'
+                         'test_latency_seconds_bucket{le="+Inf"} 4\n'
+                         'test_latency_seconds_sum 6.05\n'
+                         'test_latency_seconds_count 4\n', registry.render())
+
+    def test_remove_log_group(self):
+        metrics = FetcherMetrics()
+        group_metrics = metrics.for_log_group('/aws/lambda/my-lambda')
+        group_metrics.events_fetched.inc(2)
+        group_metrics.add_dropped({'level': 4})
+        self.assertIn('cloudwatch_fetcher_events_fetched_total{log_group="/aws/lambda/my-lambda"} 2',
+                      metrics.registry.render())
+        self.assertIn('cloudwatch_fetcher_events_dropped_total{log_group="/aws/lambda/my-lambda",reason="level"} 4',
+                      metrics.registry.render())
+        metrics.remove_log_group('/aws/lambda/my-lambda')
+        self.assertNotIn('cloudwatch_fetcher_events_fetched_total{', metrics.registry.render())
+
+    def test_incomplete_metric_is_not_instantiated(self):
+        class Summary(_Metric):
+            _TYPE = 'summary'
+
+        with self.assertRaises(TypeError):
+            Summary('latency_seconds', 'Latency')
+
+    def test_server(self):
+        registry = MetricsRegistry()
+        registry.counter('requests_total', 'Requests').labels().inc()
+        server = MetricsServer(registry, 0, '127.0.0.1')
+        server.start()
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{server.port}/metrics') as response:
+                self.assertEqual(MetricsRegistry.CONTENT_TYPE, response.headers['Content-Type'])
+                self.assertIn('requests_total 1', response.read().decode())
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(f'http://127.0.0.1:{server.port}/other')
+        finally:
+            server.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import time
+import unittest
+
+from src.page_prefetcher import PagePrefetcher
+
+
+class PagePrefetcherTests(unittest.TestCase):
+    def test_pages_kept_in_order(self):
+        pages = [[i] for i in range(20)]
+        prefetcher = PagePrefetcher(iter(pages), 2)
+        self.assertEqual(pages, list(prefetcher))
+
+    def test_fetch_error_raised_to_consumer(self):
+        def pages():
+            yield ['first']
+            raise ValueError('fetch failed')
+
+        consumed = []
+        with self.assertRaises(ValueError):
+            for page in PagePrefetcher(pages(), 2):
+                consumed.append(page)
+        self.assertEqual([['first']], consumed)
+
+    def test_depth_bounds_fetched_pages(self):
+        fetched = []
+
+        def pages():
+            for i in range(10):
+                fetched.append(i)
+                yield [i]
+
+        prefetcher = PagePrefetcher(pages(), 2)
+        iterator = iter(prefetcher)
+        self.assertEqual([0], next(iterator))
+        time.sleep(0.3)
+        # one page consumed, two waiting in the queue and one blocked on put
+        self.assertLessEqual(len(fetched), 4)
+        prefetcher.close()
+
+    def test_close_stops_producer(self):
+        def pages():
+            while True:
+                yield ['page']
+
+        prefetcher = PagePrefetcher(pages(), 1)
+        next(iter(prefetcher))
+        prefetcher.close()
+        self.assertFalse(prefetcher._thread.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,12 +9,14 @@ from src.log_group import LogGroup
 
 class PositionManagerTests(unittest.TestCase):
     NEW_POS_FILE = 'position.yaml'
+    NEW_POS_DB_FILES = ['position.db', 'position.db-wal', 'position.db-shm', 'position.yaml.migrated']
     POS_FILE_EXISTS = 'fixture/position.yaml'
 
     def tearDown(self):
-        position_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), self.NEW_POS_FILE)
-        if os.path.exists(position_file):
-            os.remove(position_file)
+        for file_name in [self.NEW_POS_FILE] + self.NEW_POS_DB_FILES:
+            position_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), file_name)
+            if os.path.exists(position_file):
+                os.remove(position_file)
 
     def _get_pm(self, file_path):
         position_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), file_path)
@@ -50,7 +52,7 @@ class PositionManagerTests(unittest.TestCase):
         self.assertEqual(log_group.next_token, pos_yaml[0][pm.FIELD_NEXT_TOKEN])
 
     def test_update_position_file(self):
-        pm = PositionManager(self.NEW_POS_FILE)
+        pm = self._get_pm(self.NEW_POS_FILE)
         pos_data = [{'latest_time': 1681389974, 'next_token': 'some-token-123', 'path': '/a/log/group'},
                     {'latest_time': 1681389974, 'next_token': 'another-token-456', 'path': 'some-other-log-group'}]
         position_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), self.NEW_POS_FILE)
@@ -117,6 +119,62 @@ class PositionManagerTests(unittest.TestCase):
                 self.assertEqual(pos_data[idx][pm.FIELD_LATEST_TIME], test_yaml[idx][pm.FIELD_LATEST_TIME])
                 self.assertEqual(pos_data[idx][pm.FIELD_NEXT_TOKEN], test_yaml[idx][pm.FIELD_NEXT_TOKEN])
 
+    def test_sqlite_store(self):
+        position_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), self.NEW_POS_FILE)
+        pm = PositionManager(position_file_path, PositionManager.STORE_SQLITE)
+        self.assertEqual(PositionManager.STORE_SQLITE, pm.store_type)
+        self.assertEqual([], pm.get_pos_file_yaml())
+        log_group = LogGroup('first/log/group', None, 1681389974, 30)
+        log_group.next_token = 'some-token-123'
+        pm.update_position_file(log_group)
+        log_group.latest_time = 1681390000
+        pm.update_position_file(log_group)
+        pm.update_position_file(LogGroup('second/log/group', None, 1681389974, 30))
+        pm.close()
+        self.assertFalse(os.path.exists(position_file_path))
+        pm = PositionManager(position_file_path, PositionManager.STORE_SQLITE)
+        pos_data = pm.get_pos_file_yaml()
+        self.assertEqual(2, len(pos_data))
+        self.assertEqual(log_group.path, pos_data[0][pm.FIELD_PATH])
+        self.assertEqual(1681390000, pos_data[0][pm.FIELD_LATEST_TIME])
+        self.assertEqual('some-token-123', pos_data[0][pm.FIELD_NEXT_TOKEN])
+        pm.sync_position_file([log_group])
+        self.assertEqual(1, len(pm.get_pos_file_yaml()))
+        pm.close()
+
+    def test_sqlite_store_migrates_yaml(self):
+        position_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), self.NEW_POS_FILE)
+        pos_data = [{'latest_time': 1681389974, 'next_token': 'some-token-123', 'path': 'first/log/group'},
+                    {'latest_time': 1681389975, 'next_token': 'another-token-456', 'path': 'second/log/group'}]
+        with open(position_file_path, 'w') as pf:
+            yaml.dump(pos_data, pf)
+        pm = PositionManager(position_file_path, PositionManager.STORE_SQLITE)
+        self.assertEqual(pos_data, [dict(sorted(pos.items())) for pos in pm.get_pos_file_yaml()])
+        self.assertFalse(os.path.exists(position_file_path))
+        self.assertTrue(os.path.exists(position_file_path + '.migrated'))
+        pm.close()
+
+    def test_get_position(self):
+        pm = self._get_pm(self.POS_FILE_EXISTS)
+        position = pm.get_position('/a/log/group')
+        self.assertEqual('some-token-123', position[pm.FIELD_NEXT_TOKEN])
+        self.assertEqual(1681389974, position[pm.FIELD_LATEST_TIME])
+        self.assertIsNone(pm.get_position('not/in/file'))
+
+    def test_get_position_reload(self):
+        position_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), self.NEW_POS_FILE)
+        pm = PositionManager(position_file_path, PositionManager.STORE_SQLITE, shared=True)
+        other_pm = PositionManager(position_file_path, PositionManager.STORE_SQLITE, shared=True)
+        self.assertIsNone(other_pm.get_position('/a/log/group'))
+        log_group = LogGroup('/a/log/group', None, 1681389974, 10)
+        pm.update_position_file(log_group)
+        # positions are loaded once, unless reloaded
+        self.assertIsNone(other_pm.get_position('/a/log/group'))
+        # shared stores are committed on every update
+        self.assertEqual(log_group.latest_time, other_pm.get_position('/a/log/group', reload=True)['latest_time'])
+        pm.close()
+        other_pm.close()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,47 @@
+import threading
+import time
+import unittest
+
+from src.rate_limiter import AdaptiveRateLimiter
+
+
+class AdaptiveRateLimiterTests(unittest.TestCase):
+    def test_rate_limited(self):
+        limiter = AdaptiveRateLimiter(max_rate=20)
+        start = time.monotonic()
+        for _ in range(11):
+            limiter.acquire()
+        # the first request is free, the next ten take half a second at 20 per second
+        self.assertGreaterEqual(time.monotonic() - start, 0.45)
+
+    def test_throttle_and_recover(self):
+        limiter = AdaptiveRateLimiter(max_rate=8, min_rate=1)
+        limiter.on_throttle()
+        self.assertEqual(4, limiter.rate)
+        for _ in range(4):
+            limiter.on_throttle()
+        self.assertEqual(1, limiter.rate)
+        for _ in range(1000):
+            limiter.on_success()
+        self.assertEqual(8, limiter.rate)
+
+    def test_higher_priority_served_first(self):
+        limiter = AdaptiveRateLimiter(max_rate=5)
+        limiter.acquire()
+        order = []
+
+        def acquire(priority):
+            limiter.acquire(priority)
+            order.append(priority)
+
+        threads = [threading.Thread(target=acquire, args=(priority,)) for priority in [1, 300, 50]]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.01)
+        for thread in threads:
+            thread.join()
+        self.assertEqual([300, 50, 1], order)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import threading
+import time
+import unittest
+
+from src.scheduler import Scheduler
+
+
+class SchedulerTests(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = Scheduler(2)
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def test_jobs_run_every_interval(self):
+        runs = []
+        self.scheduler.add('group', lambda: runs.append(time.monotonic()), 0.05)
+        self.scheduler.start()
+        time.sleep(0.28)
+        self.assertGreaterEqual(len(runs), 3)
+
+    def test_more_jobs_than_workers(self):
+        ran = set()
+        lock = threading.Lock()
+        threads = set()
+
+        def job(key):
+            with lock:
+                ran.add(key)
+                threads.add(threading.current_thread().name)
+            time.sleep(0.01)
+
+        for i in range(20):
+            self.scheduler.add(f'group_{i}', lambda i=i: job(i), 60)
+        self.scheduler.start()
+        time.sleep(0.3)
+        self.assertEqual(set(range(20)), ran)
+        self.assertLessEqual(len(threads), 2)
+        self.assertEqual(20, len(self.scheduler.get_lateness()))
+
+    def test_runs_of_a_key_never_overlap(self):
+        running = []
+        overlaps = []
+
+        def job():
+            if len(running) > 0:
+                overlaps.append(True)
+            running.append(True)
+            time.sleep(0.05)
+            running.pop()
+
+        self.scheduler.add('group', job, 0)
+        self.scheduler.start()
+        time.sleep(0.02)
+        # adding the running key again replaces its job without queueing a second run
+        self.scheduler.add('group', job, 0)
+        time.sleep(0.2)
+        self.assertEqual([], overlaps)
+
+    def test_removed_job_not_rescheduled(self):
+        runs = []
+        self.scheduler.add('group', lambda: runs.append(True), 0.05)
+        self.scheduler.start()
+        time.sleep(0.02)
+        self.scheduler.remove('group')
+        time.sleep(0.15)
+        self.assertEqual(1, len(runs))
+
+    def test_stop_waits_for_running_job(self):
+        finished = []
+
+        def job():
+            time.sleep(0.1)
+            finished.append(True)
+
+        self.scheduler.add('group', job, 60)
+        self.scheduler.start()
+        time.sleep(0.02)
+        self.scheduler.stop()
+        self.assertEqual([True], finished)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import tempfile
+import unittest
+
+from src.spill_queue import SpillQueue, SpillReplayer
+
+
+class SpillQueueTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.now = 1000.0
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _queue(self, **kwargs):
+        return SpillQueue(self.tmp_dir.name, clock=lambda: self.now, **kwargs)
+
+    def _segments(self):
+        return sorted(name for name in os.listdir(self.tmp_dir.name) if name.endswith('.seg'))
+
+    def test_replayed_oldest_first_across_segments(self):
+        queue = self._queue(segment_bytes=64)
+        for i in range(4):
+            self.assertTrue(queue.put(f'bulk {i}'.encode() * 4, i))
+        self.assertGreater(len(self._segments()), 1)
+        replayed = []
+        while True:
+            bulk = queue.peek(timeout=0)
+            if bulk is None:
+                break
+            replayed.append(bulk[1])
+            queue.ack(bulk[0])
+        self.assertEqual([0, 1, 2, 3], replayed)
+        # sent segments are removed, the one being written is kept
+        self.assertEqual(1, len(self._segments()))
+        self.assertEqual(0, len(queue))
+        queue.close()
+
+    def test_max_bytes(self):
+        queue = self._queue(max_bytes=100)
+        self.assertTrue(queue.put(b'x' * 50, 50))
+        self.assertFalse(queue.put(b'x' * 50, 50))
+        queue.close()
+
+    def test_expired_bulks_dropped(self):
+        queue = self._queue(max_age_seconds=60)
+        queue.put(b'old', 3)
+        self.now += 30
+        queue.put(b'new', 3)
+        self.now += 40
+        with self.assertLogs('src.spill_queue', 'WARNING'):
+            self.assertEqual((b'new', 3), queue.peek(timeout=0))
+        queue.close()
+
+    def test_restart_resumes_after_sent_bulks(self):
+        queue = self._queue()
+        for i in range(3):
+            queue.put(f'bulk {i}'.encode(), i)
+        queue.ack(queue.peek(timeout=0)[0])
+        queue.close()
+        # a bulk torn by a crash while it was written
+        with open(os.path.join(self.tmp_dir.name, self._segments()[-1]), 'ab') as segment:
+            segment.write(b'\x00\x00')
+        restarted = self._queue()
+        restarted.put(b'bulk 3', 3)
+        replayed = []
+        with self.assertLogs('src.spill_queue', 'WARNING'):
+            for _ in range(3):
+                data, raw_size = restarted.peek(timeout=0)
+                replayed.append(raw_size)
+                restarted.ack(data)
+        self.assertEqual([1, 2, 3], replayed)
+        self.assertIsNone(restarted.peek(timeout=0))
+        restarted.close()
+
+    def test_replay_failure_keeps_bulk(self):
+        queue = self._queue()
+        queue.put(b'bulk', 4)
+
+        def failing_send(data, raw_size):
+            raise ConnectionError('listener is down')
+
+        with self.assertRaises(ConnectionError):
+            SpillReplayer(queue, failing_send).replay_once(timeout=0)
+        self.assertTrue(queue.should_spill())
+        self.assertEqual((b'bulk', 4), queue.peek(timeout=0))
+        queue.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
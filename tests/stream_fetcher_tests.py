@@ -0,0 +1,41 @@
+import unittest
+
+from src.stream_fetcher import StreamPartitionFetcher
+
+
+class StreamPartitionFetcherTests(unittest.TestCase):
+    def test_all_partitions_fetched(self):
+        def get_pages(partition):
+            for i in range(3):
+                yield [(partition, i)]
+
+        done = []
+        fetcher = StreamPartitionFetcher(get_pages, ['a', 'b', 'c', 'd'], 2, 1, on_partition_done=done.append)
+        events = [event for page in fetcher for event in page]
+        self.assertEqual(12, len(events))
+        for partition in ['a', 'b', 'c', 'd']:
+            self.assertEqual([(partition, i) for i in range(3)], [e for e in events if e[0] == partition])
+        self.assertEqual(['a', 'b', 'c', 'd'], sorted(done))
+
+    def test_failed_partition_not_done(self):
+        def get_pages(partition):
+            yield [partition]
+            if partition == 'b':
+                raise ValueError('throttled')
+
+        done = []
+        fetcher = StreamPartitionFetcher(get_pages, ['a', 'b', 'c'], 3, 1, on_partition_done=done.append)
+        events = []
+        with self.assertRaises(ValueError):
+            for page in fetcher:
+                events.extend(page)
+        # the other partitions are completed before the error is raised
+        self.assertEqual(['a', 'b', 'c'], sorted(events))
+        self.assertEqual(['a', 'c'], sorted(done))
+
+    def test_no_partitions(self):
+        self.assertEqual([], list(StreamPartitionFetcher(None, [], 4, 1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import os
+import tempfile
+import time
+import unittest
+
+from src.tracing import CycleProfiler, CycleTrace
+
+
+class TracingTests(unittest.TestCase):
+    def test_nested_spans_not_counted_in_parent(self):
+        trace = CycleTrace()
+        with trace.span('compress'):
+            time.sleep(0.01)
+            with trace.span('post'):
+                time.sleep(0.05)
+        self.assertGreaterEqual(trace.stages['post'], 0.05)
+        self.assertLess(trace.stages['compress'], 0.05)
+        self.assertTrue(trace.format().startswith('post: '))
+
+    def test_span_recorded_on_error(self):
+        trace = CycleTrace()
+        with self.assertRaises(ValueError):
+            with trace.span('transform'):
+                raise ValueError('bad event')
+        self.assertIn('transform', trace.stages)
+
+    def test_profiler_runs_requested_cycles(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            profiler = CycleProfiler(output_dir)
+            self.assertEqual(1, profiler.run('/aws/lambda/my-lambda', lambda: 1))
+            self.assertEqual([], os.listdir(output_dir))
+            profiler.request(1)
+            with self.assertLogs('src.tracing', 'INFO'):
+                self.assertEqual(2, profiler.run('/aws/lambda/my-lambda', lambda: sum([1, 1])))
+            profiler.run('/aws/lambda/my-lambda', lambda: 3)
+            reports = sorted(os.listdir(output_dir))
+            self.assertEqual(2, len(reports))
+            self.assertTrue(reports[0].endswith('_aws_lambda_my-lambda.prof'))
+            with open(os.path.join(output_dir, reports[1])) as report:
+                self.assertIn('peak traced memory', report.read())
+
+
+if __name__ == '__main__':
+    unittest.main()